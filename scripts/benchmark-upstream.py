@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the upstream synchronization script.
+
+Generates local git repositories of different shapes (number of commits,
+files, file sizes, binary blobs), times the tracker operations against each
+of them and writes the results as JSON. A run can be compared with a stored
+baseline and fails when an operation got slower than the allowed threshold.
+
+Usage:
+    python scripts/benchmark-upstream.py
+    python scripts/benchmark-upstream.py --shape small --repeat 5 --output results.json
+    python scripts/benchmark-upstream.py --save-baseline
+    python scripts/benchmark-upstream.py --baseline scripts/benchmark-baseline.json --threshold 0.25
+"""
+
+import contextlib
+import io
+import json
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from script_loader import load_script
+
+check_upstream = load_script("check-upstream.py")
+
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "benchmark-baseline.json"
+
+
+@dataclass
+class RepoShape:
+    """Parameters of a generated upstream repository."""
+    name: str
+    commits: int
+    files: int
+    file_size: int
+    changed_per_commit: int = 2
+    binary_files: int = 0
+    binary_size: int = 64 * 1024
+    seed: int = 1
+
+
+SHAPES = {
+    shape.name: shape for shape in [
+        RepoShape("small", commits=50, files=100, file_size=2 * 1024),
+        RepoShape("many-commits", commits=2000, files=200, file_size=2 * 1024),
+        RepoShape("many-files", commits=50, files=5000, file_size=1024, changed_per_commit=20),
+        RepoShape("large-files", commits=20, files=50, file_size=200 * 1024),
+        RepoShape("binary", commits=50, files=100, file_size=2 * 1024, binary_files=20, binary_size=256 * 1024),
+    ]
+}
+
+
+def _php_source(index: int, version: int, size: int) -> bytes:
+    """Build a DTO-like PHP class of roughly `size` bytes."""
+    lines = [
+        "<?php",
+        "",
+        "namespace DefStudio\\Telegraph\\DTO;",
+        "",
+        f"class Generated{index} implements Arrayable",
+        "{",
+    ]
+    fields = []
+    length = sum(len(line) + 1 for line in lines)
+
+    while length < size:
+        # Each version renames every seventh field, so revisions change the schema
+        field = f"field{len(fields)}"
+        if version and len(fields) % 7 == version % 7:
+            field += f"r{version}"
+        fields.append(field)
+        line = f"    private ?string ${field} = null;"
+        lines.append(line)
+        # The field also appears in fromArray() and toArray()
+        length += 3 * len(line)
+
+    lines += ["", "    public static function fromArray(array $data): self", "    {", "        $dto = new self();"]
+    lines += [f"        $dto->{field} = $data['{field}'] ?? null;" for field in fields]
+    lines += ["        return $dto;", "    }", "", "    public function toArray(): array", "    {", "        return ["]
+    lines += [f"            '{field}' => $this->{field}," for field in fields]
+    lines += ["        ];", "    }", "}", ""]
+    return "\n".join(lines).encode()
+
+
+def _binary_content(index: int, version: int, size: int) -> bytes:
+    """Build incompressible binary content for a blob."""
+    return random.Random(f"{index}:{version}").getrandbits(size * 8).to_bytes(size, "little")
+
+
+def generate_repo(path: Path, shape: RepoShape) -> List[str]:
+    """
+    Create a bare git repository with the given shape on branch `main`.
+
+    The history is written with a single `git fast-import` process: the first
+    commit adds every file and each later commit rewrites
+    `shape.changed_per_commit` of them (binary files included).
+
+    Returns:
+        The commit hashes, oldest first
+    """
+    subprocess.run(["git", "init", "-q", "--bare", str(path)], check=True)
+    subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/main"], cwd=path, check=True)
+    rng = random.Random(shape.seed)
+    paths = [f"src/DTO/Generated{i}.php" for i in range(shape.files)]
+    paths += [f"resources/blobs/blob{i}.bin" for i in range(shape.binary_files)]
+    versions = {p: 0 for p in paths}
+
+    def content(file_path: str) -> bytes:
+        index = int(re.sub(r"\D", "", Path(file_path).stem))
+        if file_path.endswith(".bin"):
+            return _binary_content(index, versions[file_path], shape.binary_size)
+        return _php_source(index, versions[file_path], shape.file_size)
+
+    proc = subprocess.Popen(
+        ["git", "fast-import", "--quiet", "--done"], cwd=path, stdin=subprocess.PIPE
+    )
+
+    def data(payload: bytes) -> None:
+        proc.stdin.write(b"data %d\n" % len(payload) + payload + b"\n")
+
+    for number in range(shape.commits):
+        if number == 0:
+            touched = paths
+        else:
+            touched = rng.sample(paths, min(shape.changed_per_commit, len(paths)))
+            for file_path in touched:
+                versions[file_path] += 1
+
+        proc.stdin.write(b"commit refs/heads/main\n")
+        proc.stdin.write(b"committer Bench <bench@example.com> %d +0000\n" % (1700000000 + number * 60))
+        data(f"Commit {number}".encode())
+        for file_path in touched:
+            proc.stdin.write(f"M 100644 inline {file_path}\n".encode())
+            data(content(file_path))
+
+    proc.stdin.write(b"done\n")
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError(f"git fast-import failed for shape {shape.name}")
+
+    output = subprocess.run(
+        ["git", "rev-list", "--reverse", "main"], cwd=path, check=True, capture_output=True, text=True
+    ).stdout
+    return output.split()
+
+
+def _prepare_upstream(root: Path, shape: RepoShape) -> Dict:
+    """Generate a shape as a remote plus a clone, and the config tracking its first commit."""
+    remote = root / "remote.git"
+    commits = generate_repo(remote, shape)
+    clone = root / "upstream"
+    subprocess.run(["git", "clone", "-q", str(remote), str(clone)], check=True)
+
+    return {
+        "repository": {"name": f"bench/{shape.name}", "local_path": str(clone)},
+        "tracking": {"current_commit": commits[0], "last_sync_commit": commits[0]},
+        "files": {"extracted_count": shape.files},
+        "sync_status": {"up_to_date": False, "pending_changes": []},
+    }
+
+
+def _operations(first: str, last: str) -> Dict[str, Callable]:
+    """Tracker operations to time, each consuming its full result."""
+    def check_for_updates(tracker):
+        has_updates, _, commits = tracker.check_for_updates()
+        return has_updates, list(commits)
+
+    return {
+        "check_for_updates": check_for_updates,
+        "get_file_changes": lambda tracker: tracker.get_file_changes(first, last),
+        "generate_diff_report": lambda tracker: tracker.generate_diff_report(first, last),
+    }
+
+
+def run_benchmarks(
+    shapes: List[RepoShape],
+    backends: List[str],
+    repeat: int = 3,
+    workdir: Optional[Path] = None,
+    render_workers: int = 1,
+) -> Dict:
+    """
+    Time every tracker operation for each repository shape and git backend.
+
+    Each run uses a fresh tracker with the diff cache disabled, so timings
+    cover the cold path.
+
+    Returns:
+        Results document with environment details and one entry per
+        (shape, backend, operation), holding min/median seconds, all runs,
+        the git process and byte counters and the seconds per span
+    """
+    results = []
+
+    for shape in shapes:
+        root = Path(tempfile.mkdtemp(prefix=f"upstream-bench-{shape.name}-", dir=workdir))
+        try:
+            start = time.perf_counter()
+            config = _prepare_upstream(root, shape)
+            print(f"Generated {shape.name} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+            first = config["tracking"]["current_commit"]
+            config["report"] = {"render_workers": render_workers}
+
+            for backend in backends:
+                config["repository"]["backend"] = backend
+                config_path = root / f"upstream-{backend}.json"
+                config_path.write_text(json.dumps(config))
+
+                for operation, run in _operations(first, "HEAD").items():
+                    runs = []
+                    for _ in range(repeat):
+                        tracker = check_upstream.UpstreamTracker(str(config_path))
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            start = time.perf_counter()
+                            run(tracker)
+                            runs.append(time.perf_counter() - start)
+                        tracker.close()
+                    # Counters do not vary between runs, so the last run's are kept
+                    timings = tracker.timings
+
+                    results.append({
+                        "shape": shape.name,
+                        "backend": backend,
+                        "operation": operation,
+                        "min": min(runs),
+                        "median": statistics.median(runs),
+                        "runs": runs,
+                        "counters": dict(timings.totals),
+                        "spans": {path: span["seconds"] for path, span in timings.spans.items()},
+                    })
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    git_version = subprocess.run(["git", "--version"], capture_output=True, text=True).stdout.strip()
+    return {
+        "generated": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "git": git_version,
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "render_workers": render_workers,
+        "shapes": [asdict(shape) for shape in shapes],
+        "results": results,
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float, min_delta: float = 0.01) -> List[Dict]:
+    """
+    Find operations that got slower than the baseline allows.
+
+    Best-of-N times are compared, and differences under `min_delta` seconds
+    are ignored so that very fast operations do not fail on noise.
+
+    Args:
+        current: Results of this run
+        baseline: Stored results to compare with
+        threshold: Allowed slowdown as a fraction (0.25 = 25% slower)
+        min_delta: Smallest absolute slowdown in seconds considered a regression
+
+    Returns:
+        One entry per regression with the baseline and current times
+    """
+    def key(entry):
+        return entry["shape"], entry["backend"], entry["operation"]
+
+    expected = {key(entry): entry["min"] for entry in baseline["results"]}
+    regressions = []
+
+    for entry in current["results"]:
+        before = expected.get(key(entry))
+        if before is None:
+            continue
+        if entry["min"] > before * (1 + threshold) and entry["min"] - before > min_delta:
+            regressions.append({
+                "shape": entry["shape"],
+                "backend": entry["backend"],
+                "operation": entry["operation"],
+                "baseline": before,
+                "current": entry["min"],
+                "ratio": entry["min"] / before if before else float("inf"),
+            })
+
+    return regressions
+
+
+def print_results(results: Dict, stream=None) -> None:
+    """Print results as an aligned table."""
+    stream = stream or sys.stdout
+    print(
+        f"{'shape':<14} {'backend':<10} {'operation':<22} {'min (s)':>10} {'median (s)':>11} "
+        f"{'git procs':>10} {'bytes read':>12}",
+        file=stream,
+    )
+    for entry in results["results"]:
+        print(
+            f"{entry['shape']:<14} {entry['backend']:<10} {entry['operation']:<22} "
+            f"{entry['min']:>10.4f} {entry['median']:>11.4f} "
+            f"{entry['counters']['processes']:>10} {entry['counters']['bytes_read']:>12}",
+            file=stream,
+        )
+
+
+def main():
+    """Main entry point for the benchmark script."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark upstream tracker operations")
+    parser.add_argument("--shape", action="append", choices=sorted(SHAPES), help="Repository shape to run (repeatable, default: all)")
+    parser.add_argument("--backend", action="append", choices=sorted(check_upstream.GIT_BACKENDS), help="Git backend to run (repeatable, default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per operation; the fastest is compared")
+    parser.add_argument("--render-workers", type=int, default=1, help="Processes decoding patch text in reports")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help=f"Compare with a stored baseline (default: {DEFAULT_BASELINE.name} if present)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--min-delta", type=float, default=0.01, help="Ignore slowdowns smaller than this many seconds")
+
+    args = parser.parse_args()
+
+    shapes = [SHAPES[name] for name in args.shape or SHAPES]
+    backends = args.backend or sorted(check_upstream.GIT_BACKENDS)
+    results = run_benchmarks(shapes, backends, args.repeat, render_workers=args.render_workers)
+    print_results(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"Results saved to {args.output}")
+
+    baseline_path = Path(args.baseline) if args.baseline else DEFAULT_BASELINE
+
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        if args.baseline:
+            print(f"Error: Baseline {baseline_path} not found", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    regressions = compare_results(
+        results, json.loads(baseline_path.read_text()), args.threshold, args.min_delta
+    )
+
+    if regressions:
+        print(f"\n✗ {len(regressions)} regression(s) against {baseline_path}:", file=sys.stderr)
+        for r in regressions:
+            print(
+                f"  {r['shape']}/{r['backend']}/{r['operation']}: "
+                f"{r['baseline']:.4f}s -> {r['current']:.4f}s ({r['ratio']:.2f}x)",
+                file=sys.stderr,
+            )
+        sys.exit(1)
+
+    print(f"\n✓ No regressions against {baseline_path} (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,195 +6,3758 @@ This script tracks changes in the DefStudio/Telegraph repository and helps
 maintain synchronization with the upstream source.
 """
 
+import functools
+import hashlib
+import io
 import json
 import os
+import random
+import re
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Pattern, TextIO, Tuple
 
-try:
-    import git
-except ImportError:
-    print("Error: GitPython is required. Install with: pip install gitpython")
-    sys.exit(1)
 
+def _import_git():
+    """
+    Import GitPython on first use.
+    
+    Config-only commands such as --status and --update never touch git, so
+    the import is deferred until a handler actually needs a repository.
+    """
+    try:
+        import git
+    except ImportError:
+        raise ImportError("GitPython is required. Install with: pip install gitpython") from None
+    return git
 
-class UpstreamTracker:
-    """Tracks and manages upstream repository synchronization."""
+
+CHANGE_TYPE_NAMES = {
+    'M': "modified",
+    'A': "added",
+    'D': "deleted",
+    'R': "renamed",
+}
+
+
+@dataclass
+class FileChange:
+    """A single file-level change between two upstream commits."""
     
-    def __init__(self, config_path: str = "upstream.json"):
-        self.config_path = Path(config_path)
-        self.config = self._load_config()
-        self.repo_path = Path(self.config["repository"]["local_path"])
+    change_type: str
+    a_path: Optional[str]
+    b_path: Optional[str]
+    a_blob: Optional[str] = None
+    b_blob: Optional[str] = None
+    category: Optional[str] = None
+    a_size: Optional[int] = None
+    b_size: Optional[int] = None
+    binary: Optional[bool] = None
+    
+    @property
+    def path(self) -> str:
+        """The path identifying this change (new path for renames)."""
+        return self.b_path or self.a_path
+    
+    @property
+    def display_path(self) -> str:
+        """Human readable path, showing both sides of a rename."""
+        if self.change_type == 'R':
+            return f"{self.a_path} -> {self.b_path}"
+        return self.a_path or self.b_path
+
+
+def _glob_to_regex(pattern: str) -> Pattern:
+    """Translate a git-style path glob (`*`, `?`, `**`) into a regex."""
+    parts = []
+    i = 0
+    
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    
+    return re.compile("".join(parts) + r"\Z")
+
+
+class PathFilter:
+    """
+    Include/exclude path globs per extraction category.
+    
+    Built from `files.categories` in upstream.json, where a category may be a
+    plain file count or an object with `include` and `exclude` glob lists.
+    The globs are handed to git as pathspecs so that untracked subtrees are
+    never read; git applies exclusions to the whole pathspec, so an exclude
+    in one category should not cover paths another category includes.
+    """
+    
+    def __init__(self, categories: Dict):
+        self.include: List[str] = []
+        self.exclude: List[str] = []
+        self._matchers: Dict[str, Tuple[List[Pattern], List[Pattern]]] = {}
         
-    def _load_config(self) -> Dict:
-        """Load the upstream configuration file."""
-        if not self.config_path.exists():
-            raise FileNotFoundError(f"Configuration file {self.config_path} not found")
+        for name, spec in categories.items():
+            if not isinstance(spec, dict) or not spec.get("include"):
+                continue
+            
+            include = list(spec["include"])
+            exclude = list(spec.get("exclude", []))
+            self.include.extend(include)
+            self.exclude.extend(exclude)
+            self._matchers[name] = (
+                [_glob_to_regex(p) for p in include],
+                [_glob_to_regex(p) for p in exclude],
+            )
+    
+    def __bool__(self) -> bool:
+        return bool(self._matchers)
+    
+    @property
+    def pathspecs(self) -> List[str]:
+        """Git pathspecs selecting every tracked path."""
+        if not self:
+            return []
+        return (
+            [f":(glob){p}" for p in dict.fromkeys(self.include)]
+            + [f":(glob,exclude){p}" for p in dict.fromkeys(self.exclude)]
+        )
+    
+    @property
+    def prefixes(self) -> List[str]:
+        """
+        Literal leading directories of the include globs.
         
-        with open(self.config_path, 'r') as f:
+        Used to narrow commands such as `git ls-tree` that do not understand
+        glob pathspecs; an empty list means the whole tree must be listed.
+        """
+        prefixes = []
+        
+        for pattern in self.include:
+            literal = re.split(r"[*?\[]", pattern, 1)[0]
+            if literal != pattern:
+                literal = literal.rpartition("/")[0]
+            if not literal:
+                return []
+            prefixes.append(literal)
+        
+        return list(dict.fromkeys(prefixes))
+    
+    def category(self, path: Optional[str]) -> Optional[str]:
+        """Get the first category tracking a path, or None if it is ignored."""
+        if not path:
+            return None
+        
+        for name, (include, exclude) in self._matchers.items():
+            if any(p.match(path) for p in include) and not any(p.match(path) for p in exclude):
+                return name
+        
+        return None
+
+
+# Options for patch text parsed by DiffSnapshot. The header prefixes, color,
+# external drivers and relative paths are pinned so user config such as
+# diff.noprefix or diff.external cannot change the `diff --git a/X b/Y` lines
+PATCH_OPTIONS = (
+    "--full-index", "-M", "--no-color", "--no-ext-diff", "--no-relative",
+    "--src-prefix=a/", "--dst-prefix=b/",
+)
+
+
+def _iter_records(stream: BinaryIO, separator: bytes, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Split a byte stream into separator-terminated records as it is read."""
+    pending = b""
+    
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        
+        records = (pending + chunk).split(separator)
+        pending = records.pop()
+        for record in records:
+            if record.strip():
+                yield record
+    
+    if pending.strip():
+        yield pending
+
+
+def _stop_stream(proc) -> None:
+    """Kill a streaming git process whose output was abandoned, and reap it."""
+    proc.kill()
+    try:
+        proc.wait()
+    except Exception:
+        # A killed process exits non-zero, which wait() reports as a failure
+        pass
+
+
+def _tee(lines: Iterator[bytes], sink: BinaryIO) -> Iterator[bytes]:
+    """Pass lines through while copying them to a file."""
+    for line in lines:
+        sink.write(line)
+        yield line
+
+
+_C_ESCAPES = {7: "a", 8: "b", 9: "t", 10: "n", 11: "v", 12: "f", 13: "r", 34: '"', 92: "\\"}
+
+
+def _quote_path(path: str) -> bytes:
+    """
+    Quote a path the way git writes it in patch headers with core.quotePath=false.
+    
+    Paths holding a double quote, a backslash or a control character are
+    C-quoted (`"a/Tab\\there.php"`); anything else, non-ASCII included, is
+    written as is.
+    """
+    raw = path.encode('utf-8', errors='surrogateescape')
+    if not any(byte < 32 or byte == 127 or byte in (34, 92) for byte in raw):
+        return raw
+    
+    quoted = "".join(
+        f"\\{_C_ESCAPES[byte]}" if byte in _C_ESCAPES else f"\\{byte:03o}" if byte < 32 or byte == 127 else chr(byte)
+        for byte in raw
+    )
+    return b'"' + quoted.encode('latin-1') + b'"'
+
+
+class DiffCache:
+    """
+    Content-addressed on-disk cache for diff results.
+    
+    Entries are keyed by resolved commit SHAs (plus pathspecs), so their
+    content never goes stale: when an upstream ref moves it resolves to a
+    new key and the old entries simply age out. Reads refresh an entry's
+    mtime and writes evict the least recently used entries until the cache
+    fits in max_bytes.
+    """
+    
+    def __init__(self, path: Path, max_bytes: int = 100 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+    
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Build a cache key from resolved commit SHAs and other inputs."""
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+    
+    def get_json(self, key: str) -> Optional[Dict]:
+        """Read a JSON entry, or None on a cache miss."""
+        path = self.get_path(key, ".json")
+        if path is None:
+            return None
+        
+        with open(path, 'r') as f:
             return json.load(f)
     
-    def _save_config(self) -> None:
-        """Save the updated configuration file."""
-        with open(self.config_path, 'w') as f:
-            json.dump(self.config, f, indent=2)
+    def put_json(self, key: str, data: Dict) -> None:
+        """Store a JSON entry."""
+        with self.writer(key, ".json") as f:
+            f.write(json.dumps(data).encode())
     
-    def _get_repo(self) -> git.Repo:
-        """Get the git repository object."""
-        if not self.repo_path.exists():
-            raise FileNotFoundError(f"Repository path {self.repo_path} not found")
+    def get_path(self, key: str, suffix: str) -> Optional[Path]:
+        """Get the file holding an entry, marking it as recently used."""
+        path = self.path / f"{key}{suffix}"
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+    
+    @contextmanager
+    def writer(self, key: str, suffix: str) -> Iterator[BinaryIO]:
+        """
+        Open an entry for writing.
+        
+        The entry only becomes visible once the block completes; if it raises
+        or the consumer abandons it, the partial file is discarded.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        target = self.path / f"{key}{suffix}"
+        temp = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        completed = False
         
         try:
-            return git.Repo(self.repo_path)
-        except git.InvalidGitRepositoryError:
-            raise ValueError(f"Invalid git repository at {self.repo_path}")
+            with open(temp, 'wb') as f:
+                yield f
+            os.replace(temp, target)
+            completed = True
+        finally:
+            if not completed and temp.exists():
+                temp.unlink()
+        
+        self.evict()
     
-    def get_current_commit(self) -> str:
-        """Get the current commit hash of the upstream repository."""
-        repo = self._get_repo()
-        return repo.head.commit.hexsha
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = []
+        total = 0
+        
+        # Trackers of other upstreams may evict from the same directory concurrently
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+    
+    def clear(self) -> None:
+        """Remove every cache entry."""
+        if self.path.exists():
+            shutil.rmtree(self.path)
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive advisory lock on a file for the enclosed block.
+    
+    Uses flock, which the kernel releases if the process dies. The file is
+    created if missing. Files updated by atomic rename get a new inode, so
+    the lock is retaken until it is held on the file currently at `path`.
+    Where fcntl is unavailable (Windows) the block runs unlocked.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    
+    while True:
+        f = open(path, 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    
+    try:
+        yield
+    finally:
+        f.close()
+
+
+def _write_json_atomic(path: Path, data: Dict, indent: Optional[int] = None) -> None:
+    """
+    Replace a JSON file so readers see either the old or the new content, never a partial write.
+    
+    The temporary file has a unique name, so threads of one process writing
+    the same file do not replace each other's half-written copies. The
+    file's permissions are kept.
+    """
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+        try:
+            os.chmod(temp, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+
+
+class SyncJournal:
+    """
+    Append-only history of upstream checks and syncs.
+    
+    Each check or tracking update is one JSON line appended to the journal.
+    A small index next to it holds the latest state of every upstream and
+    the journal size it reflects, so the current state is read in constant
+    time however long the history grows. Appends happen under an advisory
+    lock on the journal and the index is replaced atomically; an index that
+    does not match the journal (after an interrupted write or a merge) is
+    rebuilt with one pass over it.
+    """
+    
+    INDEX_VERSION = 1
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.index_path = path.with_name(f"{path.name}.index")
+    
+    def append(self, record: Dict) -> Dict:
+        """
+        Append a record and update the index.
+        
+        Args:
+            record: Record with "type" ("check" or "sync") and "upstream"
+        
+        Returns:
+            The upstream's state after the record
+        """
+        record = {"time": datetime.now().isoformat(), **record}
+        line = (json.dumps(record) + "\n").encode()
+        
+        with _file_lock(self.path):
+            index = self._load_index(locked=True)
+            with open(self.path, 'ab') as f:
+                f.write(line)
+            
+            index["size"] += len(line)
+            index["records"] += 1
+            state = self._apply(index["upstreams"].get(record["upstream"], {}), record)
+            index["upstreams"][record["upstream"]] = state
+            _write_json_atomic(self.index_path, index)
+        
+        return state
+    
+    def state(self, upstream: str) -> Optional[Dict]:
+        """Get the latest state of an upstream, or None if it has no records."""
+        return self._load_index()["upstreams"].get(upstream)
+    
+    def history(self, upstream: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Read records newest first.
+        
+        The journal is read backwards in blocks, so the latest entries are
+        available without scanning the whole history.
+        
+        Args:
+            upstream: Only yield this upstream's records
+            limit: Stop after this many records
+        """
+        if limit == 0 or not self.path.exists():
+            return
+        
+        count = 0
+        for line in self._reverse_lines():
+            record = json.loads(line)
+            if upstream and record.get("upstream") != upstream:
+                continue
+            yield record
+            count += 1
+            if limit and count >= limit:
+                return
+    
+    def _reverse_lines(self, block_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Yield the journal's non-empty lines from last to first."""
+        with open(self.path, 'rb') as f:
+            position = f.seek(0, os.SEEK_END)
+            tail = b""
+            
+            while position > 0:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + tail).split(b"\n")
+                tail = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield line
+            
+            if tail.strip():
+                yield tail
+    
+    def _load_index(self, locked: bool = False) -> Dict:
+        """
+        Read the index, rebuilding it when it does not describe the current journal.
+        
+        A stale index is rebuilt and persisted under the journal lock, so
+        concurrent readers (threads or processes) repair it once, and never
+        while an append is in progress.
+        
+        Args:
+            locked: The caller already holds the journal lock
+        """
+        if not self.path.exists():
+            return self._rebuild_index()
+        
+        index = self._read_index()
+        if index is not None:
+            return index
+        
+        if not locked:
+            with _file_lock(self.path):
+                return self._load_index(locked=True)
+        
+        index = self._rebuild_index()
+        # Persist the repaired index so later reads are constant time again
+        _write_json_atomic(self.index_path, index)
+        return index
+    
+    def _read_index(self) -> Optional[Dict]:
+        """Read the index if it matches the journal's current size."""
+        size = self.path.stat().st_size
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if index.get("version") == self.INDEX_VERSION and index.get("size") == size:
+            return index
+        return None
+    
+    def _rebuild_index(self) -> Dict:
+        """Replay the whole journal into a fresh index."""
+        index = {"version": self.INDEX_VERSION, "size": 0, "records": 0, "upstreams": {}}
+        if not self.path.exists():
+            return index
+        
+        with open(self.path, 'rb') as f:
+            for line in f:
+                index["size"] += len(line)
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                index["records"] += 1
+                index["upstreams"][record["upstream"]] = self._apply(
+                    index["upstreams"].get(record["upstream"], {}), record
+                )
+        
+        return index
+    
+    @staticmethod
+    def _apply(state: Dict, record: Dict) -> Dict:
+        """Fold one record into an upstream's latest state."""
+        state = dict(state)
+        
+        if record["type"] == "sync":
+            state["current_commit"] = record["to_commit"]
+            state["last_checked"] = record["time"]
+            state["last_sync"] = record["time"]
+        elif record["type"] == "check" and not record.get("error"):
+            state["last_checked"] = record["time"]
+            state["last_check"] = {
+                key: record.get(key) for key in ("to_commit", "has_updates", "commits", "files")
+            }
+        
+        return state
+
+
+class CommitIndex:
+    """
+    SQLite index of the tracked paths each upstream commit changed.
+    
+    The tracker adds rows from one streaming `git log --name-status` over
+    the commits not indexed yet, so keeping the index current costs a walk
+    of the new commits only, and lookups by path, category or date become
+    indexed queries instead of history walks. The index records the commit
+    it was built up to and a key of the path filters it was built with.
+    
+    Results keep `git log` order: every update is numbered as a batch, and
+    within a batch rows are inserted newest first.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS commits (
+            sha TEXT PRIMARY KEY,
+            time INTEGER NOT NULL,
+            subject TEXT,
+            batch INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            sha TEXT NOT NULL REFERENCES commits(sha),
+            change_type TEXT NOT NULL,
+            path TEXT NOT NULL,
+            old_path TEXT,
+            category TEXT
+        );
+        CREATE INDEX IF NOT EXISTS commits_time ON commits(time);
+        CREATE INDEX IF NOT EXISTS changes_sha ON changes(sha);
+        CREATE INDEX IF NOT EXISTS changes_path ON changes(path);
+        CREATE INDEX IF NOT EXISTS changes_old_path ON changes(old_path);
+        CREATE INDEX IF NOT EXISTS changes_category ON changes(category);
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._db = None
+    
+    def _connect(self):
+        """Open the database on first use, creating the schema if needed."""
+        if self._db is None:
+            import sqlite3
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path))
+            self._db.executescript(self.SCHEMA)
+        return self._db
+    
+    def meta(self, key: str) -> Optional[str]:
+        """Read a value stored with the index, such as the last indexed commit."""
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def add(
+        self,
+        commits: Iterable[Tuple[str, int, str, List[Tuple[str, str, Optional[str], Optional[str]]]]],
+        head: str,
+        filter_key: str,
+        reset: bool = False,
+    ) -> int:
+        """
+        Add commits and move the indexed head, in a single transaction.
+        
+        Args:
+            commits: Tuples of (sha, commit_time, subject, changes), each
+                change being (change_type, path, old_path, category)
+            head: Commit the index is complete up to afterwards
+            filter_key: Key of the path filters the rows were selected with
+            reset: Drop every existing row first
+        
+        Returns:
+            Number of commits added
+        """
+        db = self._connect()
+        count = 0
+        
+        with db:
+            if reset:
+                db.execute("DELETE FROM changes")
+                db.execute("DELETE FROM commits")
+            batch = db.execute("SELECT COALESCE(MAX(batch), 0) + 1 FROM commits").fetchone()[0]
+            
+            for sha, commit_time, subject, changes in commits:
+                db.execute("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?)", (sha, commit_time, subject, batch))
+                db.execute("DELETE FROM changes WHERE sha = ?", (sha,))
+                db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?, ?)", [(sha, *change) for change in changes])
+                count += 1
+            
+            db.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                [("head", head), ("filter_key", filter_key)],
+            )
+        
+        return count
+    
+    def query(
+        self,
+        paths: Optional[List[str]] = None,
+        category: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        shas: Optional[Iterable[str]] = None,
+    ) -> List[Dict]:
+        """
+        Find indexed commits matching every given condition, newest first.
+        
+        Args:
+            paths: Upstream paths, matched against both sides of renames
+            category: Category of the changed file
+            since: Only commits at or after this Unix time
+            until: Only commits at or before this Unix time
+            shas: Only these commits
+        
+        Returns:
+            One dictionary per commit with "sha", "time", "subject" and the
+            matching "files" (change_type, path, old_path, category)
+        """
+        conditions, params = [], []
+        if paths:
+            marks = ", ".join("?" * len(paths))
+            conditions.append(f"(changes.path IN ({marks}) OR changes.old_path IN ({marks}))")
+            params.extend(paths + paths)
+        if category:
+            conditions.append("changes.category = ?")
+            params.append(category)
+        if since is not None:
+            conditions.append("commits.time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("commits.time <= ?")
+            params.append(until)
+        
+        rows = self._connect().execute(
+            "SELECT commits.sha, commits.time, commits.subject,"
+            " changes.change_type, changes.path, changes.old_path, changes.category"
+            " FROM changes JOIN commits ON commits.sha = changes.sha"
+            f" {'WHERE ' + ' AND '.join(conditions) if conditions else ''}"
+            " ORDER BY commits.batch DESC, commits.rowid, changes.path",
+            params,
+        )
+        
+        selected = set(shas) if shas is not None else None
+        commits: Dict[str, Dict] = {}
+        for sha, commit_time, subject, change_type, path, old_path, category_name in rows:
+            if selected is not None and sha not in selected:
+                continue
+            commit = commits.setdefault(sha, {"sha": sha, "time": commit_time, "subject": subject, "files": []})
+            commit["files"].append({
+                "change_type": change_type, "path": path, "old_path": old_path, "category": category_name,
+            })
+        
+        return list(commits.values())
+    
+    def clear(self) -> None:
+        """Drop every row, so the next update indexes the whole history."""
+        db = self._connect()
+        with db:
+            for table in ("changes", "commits", "meta"):
+                db.execute(f"DELETE FROM {table}")
+    
+    def close(self) -> None:
+        """Close the database connection."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _peak_rss_kb() -> Optional[int]:
+    """Peak resident memory of this process in KiB, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Timings:
+    """
+    Named spans recording where a tracker run spends its time.
+    
+    A span opened while another is open is recorded as "outer/inner". Each
+    span accumulates its calls, wall time, git subprocesses started and bytes
+    read from git, plus the process's peak resident memory when it last
+    closed. Counters are also kept as run-wide `totals`, so benchmarks and CI
+    can assert on them without parsing output.
+    """
+    
+    COUNTERS = ("processes", "bytes_read")
+    
+    def __init__(self):
+        self.spans: Dict[str, Dict] = {}
+        self.totals = {counter: 0 for counter in self.COUNTERS}
+        self.events: List[Dict] = []
+        self._stack: List[str] = []
+        self._origin = time.perf_counter()
+    
+    def add(self, processes: int = 0, bytes_read: int = 0) -> None:
+        """Count git subprocesses started and bytes read."""
+        self.totals["processes"] += processes
+        self.totals["bytes_read"] += bytes_read
+    
+    @contextmanager
+    def span(self, name: str, count: bool = True) -> Iterator[None]:
+        """
+        Record the enclosed block as a span.
+        
+        Args:
+            count: Count the block as a call; off for later stretches of one call
+        """
+        path = f"{self._stack[-1]}/{name}" if self._stack else name
+        span = self.spans.setdefault(path, {
+            "calls": 0, "seconds": 0.0, "processes": 0, "bytes_read": 0, "peak_rss_kb": None,
+        })
+        before = dict(self.totals)
+        self._stack.append(path)
+        start = time.perf_counter()
+        
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            # A lazily consumed generator may close its span out of order
+            if self._stack[-1] == path:
+                self._stack.pop()
+            else:
+                self._stack.remove(path)
+            
+            counters = {counter: self.totals[counter] - before[counter] for counter in self.COUNTERS}
+            span["calls"] += count
+            span["seconds"] += elapsed
+            for counter, value in counters.items():
+                span[counter] += value
+            span["peak_rss_kb"] = _peak_rss_kb()
+            
+            self.events.append({
+                "name": name,
+                "cat": path,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": elapsed * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": counters,
+            })
+    
+    def summary(self) -> Dict[str, Dict]:
+        """Get a copy of every span's counters, keyed by span path."""
+        return {path: dict(span) for path, span in self.spans.items()}
+    
+    def write_summary(self, stream: TextIO) -> None:
+        """Write the spans as an aligned table, in start order with children under parents."""
+        stream.write(f"{'span':<36} {'calls':>6} {'seconds':>9} {'git procs':>10} {'bytes read':>12} {'peak RSS':>10}\n")
+        
+        children: Dict[str, List[str]] = {}
+        for path in self.spans:
+            children.setdefault(path.rpartition("/")[0], []).append(path)
+        
+        def walk(parent: str) -> Iterator[str]:
+            for path in children.get(parent, []):
+                yield path
+                yield from walk(path)
+        
+        for path in walk(""):
+            span = self.spans[path]
+            label = "  " * path.count("/") + path.rsplit("/", 1)[-1]
+            peak = f"{span['peak_rss_kb'] // 1024} MiB" if span["peak_rss_kb"] is not None else "-"
+            stream.write(
+                f"{label:<36} {span['calls']:>6} {span['seconds']:>9.3f} "
+                f"{span['processes']:>10} {span['bytes_read']:>12} {peak:>10}\n"
+            )
+        
+        stream.write(f"{'total':<36} {'':>6} {'':>9} {self.totals['processes']:>10} {self.totals['bytes_read']:>12}\n")
+
+
+class _CountingReader:
+    """Binary stream wrapper that reports the bytes read through it."""
+    
+    def __init__(self, raw: BinaryIO, timings: Timings):
+        self.raw = raw
+        self._timings = timings
+    
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self._timings.add(bytes_read=len(data))
+        return data
+    
+    def __iter__(self) -> Iterator[bytes]:
+        count = 0
+        try:
+            for line in self.raw:
+                count += len(line)
+                yield line
+        finally:
+            self._timings.add(bytes_read=count)
+    
+    def close(self) -> None:
+        self.raw.close()
+
+
+class _CountedProcess:
+    """Streaming git process whose stdout is counted."""
+    
+    def __init__(self, proc, timings: Timings):
+        self.proc = proc
+        self.stdout = _CountingReader(proc.stdout, timings)
+    
+    def wait(self) -> int:
+        return self.proc.wait()
+    
+    def kill(self) -> None:
+        self.proc.kill()
+
+
+class GitBackend:
+    """
+    The git operations UpstreamTracker relies on.
+    
+    Implementations are selected with `repository.backend` in the config or
+    `--backend` on the command line. All of them return plain strings and
+    FileChange objects so the tracker never depends on a specific library.
+    """
+    
+    name = ""
+    # Set by the tracker so git activity is counted in its spans
+    timings: Optional[Timings] = None
+    
+    def _record(self, processes: int = 0, bytes_read: int = 0) -> None:
+        """Count git subprocesses and output, if timings are attached."""
+        if self.timings:
+            self.timings.add(processes, bytes_read)
+    
+    def _counted(self, proc):
+        """Wrap a streaming process so the bytes read from it are counted."""
+        self._record(processes=1)
+        return _CountedProcess(proc, self.timings) if self.timings else proc
+    
+    def resolve(self, ref: str) -> str:
+        """Resolve a ref or commit expression to a full commit hash."""
+        raise NotImplementedError
+    
+    def commit_time(self, ref: str) -> int:
+        """Get the committer timestamp of a commit."""
+        raise NotImplementedError
+    
+    def head(self) -> str:
+        """Get the commit checked out in the upstream clone."""
+        raise NotImplementedError
+    
+    def active_branch(self) -> str:
+        """Get the name of the checked out branch."""
+        raise NotImplementedError
+    
+    def fetch_all(self) -> None:
+        """Fetch every ref from origin."""
+        raise NotImplementedError
+    
+    def diff_tree(self, from_ref: str, to_ref: str, pathspecs: List[str]) -> List[FileChange]:
+        """List file-level changes between two commits, without patch text."""
+        raise NotImplementedError
+    
+    def read_blob(self, sha: str) -> bytes:
+        """Read the content of a blob."""
+        raise NotImplementedError
+    
+    def blob_size(self, sha: str) -> int:
+        """Get the size of a blob in bytes, without reading its content."""
+        raise NotImplementedError
+    
+    def blob_sizes(self, shas: Iterable[str]) -> Dict[str, int]:
+        """
+        Get the sizes of many blobs with one `git cat-file --batch-check`.
+        
+        Blobs missing from the object store are left out.
+        """
+        query = "".join(f"{sha}\n" for sha in dict.fromkeys(shas))
+        if not query:
+            return {}
+        
+        output = self.run("cat-file", "--batch-check=%(objectname) %(objectsize)", input=query)
+        sizes = {}
+        for line in output.splitlines():
+            sha, _, size = line.partition(" ")
+            if size.isdigit():
+                sizes[sha] = int(size)
+        return sizes
+    
+    def run(self, command: str, *args: str, input: Optional[str] = None, config: Optional[Dict[str, str]] = None) -> str:
+        """
+        Run a git command and return its output without the final newline.
+        
+        Args:
+            input: Text fed to the command's stdin, for `--stdin` options
+            config: Configuration overrides for this command only (`git -c`)
+        """
+        raise NotImplementedError
+    
+    def stream(self, command: str, *args: str, config: Optional[Dict[str, str]] = None):
+        """
+        Start a git command whose output is read incrementally.
+        
+        Args:
+            config: Configuration overrides for this command only (`git -c`)
+        
+        Returns:
+            A process with a binary `stdout`, a `wait()` that raises if
+            the command failed and a `kill()`
+        """
+        raise NotImplementedError
+    
+    def close(self) -> None:
+        """Release any long-lived resources."""
+
+
+class GitPythonBackend(GitBackend):
+    """Backend that goes through GitPython's Repo object."""
+    
+    name = "gitpython"
+    
+    def __init__(self, repo):
+        self.repo = repo
+        self._commits: Dict[str, object] = {}
+        # Keep non-ASCII paths unquoted in patch headers, as the native backend does
+        repo.git.set_persistent_git_options(c="core.quotePath=false")
+    
+    def _commit(self, ref: str):
+        """Look up a commit object, once per ref."""
+        if ref not in self._commits:
+            try:
+                self._commits[ref] = self.repo.commit(ref)
+            except _import_git().BadName as e:
+                raise ValueError(f"Unknown revision {ref}") from e
+        return self._commits[ref]
+    
+    def resolve(self, ref: str) -> str:
+        return self._commit(ref).hexsha
+    
+    def commit_time(self, ref: str) -> int:
+        return self._commit(ref).committed_date
+    
+    def head(self) -> str:
+        return self.repo.head.commit.hexsha
+    
+    def active_branch(self) -> str:
+        return self.repo.active_branch.name
+    
+    def fetch_all(self) -> None:
+        self._record(processes=1)
+        self.repo.remotes.origin.fetch()
+    
+    def diff_tree(self, from_ref: str, to_ref: str, pathspecs: List[str]) -> List[FileChange]:
+        self._record(processes=1)
+        return [
+            FileChange(
+                change_type=item.change_type,
+                a_path=item.a_path,
+                b_path=item.b_path,
+                a_blob=item.a_blob.hexsha if item.a_blob else None,
+                b_blob=item.b_blob.hexsha if item.b_blob else None,
+            )
+            for item in self._commit(from_ref).diff(self._commit(to_ref), paths=pathspecs or None)
+        ]
+    
+    def read_blob(self, sha: str) -> bytes:
+        content = self.repo.odb.stream(bytes.fromhex(sha)).read()
+        self._record(bytes_read=len(content))
+        return content
+    
+    def blob_size(self, sha: str) -> int:
+        return self.repo.odb.info(bytes.fromhex(sha)).size
+    
+    def _git(self, command: str, *args: str, config: Optional[Dict[str, str]] = None, **kwargs):
+        """
+        Call a git command through GitPython.
+        
+        Config overrides are passed in the environment (GIT_CONFIG_COUNT),
+        since setting them with `repo.git(c=...)` would leak into whichever
+        thread runs git next.
+        """
+        if config:
+            kwargs["env"] = {"GIT_CONFIG_COUNT": str(len(config))}
+            for i, (key, value) in enumerate(config.items()):
+                kwargs["env"][f"GIT_CONFIG_KEY_{i}"] = key
+                kwargs["env"][f"GIT_CONFIG_VALUE_{i}"] = value
+        return getattr(self.repo.git, command.replace("-", "_"))(*args, **kwargs)
+    
+    def run(self, command: str, *args: str, input: Optional[str] = None, config: Optional[Dict[str, str]] = None) -> str:
+        if input is None:
+            output = self._git(command, *args, config=config)
+        else:
+            # GitPython hands istream to Popen, which needs a real file
+            with tempfile.TemporaryFile() as stdin:
+                stdin.write(input.encode('utf-8'))
+                stdin.seek(0)
+                output = self._git(command, *args, config=config, istream=stdin)
+        self._record(processes=1, bytes_read=len(output))
+        return output
+    
+    def stream(self, command: str, *args: str, config: Optional[Dict[str, str]] = None):
+        return self._counted(self._git(command, *args, config=config, as_process=True))
+
+
+class _GitProcess:
+    """A streaming git subprocess with GitPython-like wait() semantics."""
+    
+    def __init__(self, args: List[str]):
+        self.args = args
+        self.proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stdout = self.proc.stdout
+    
+    def wait(self) -> int:
+        stderr = self.proc.stderr.read()
+        self.proc.stderr.close()
+        status = self.proc.wait()
+        if status != 0:
+            raise RuntimeError(f"{' '.join(self.args)} failed: {stderr.decode(errors='ignore').strip()}")
+        return status
+    
+    def kill(self) -> None:
+        self.proc.kill()
+    
+    def __del__(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stderr.close()
+
+
+class NativeGitBackend(GitBackend):
+    """
+    Backend that talks to git directly.
+    
+    Object lookups go through long-lived `git cat-file --batch-check` and
+    `git cat-file --batch` processes, so resolving refs and reading commits
+    or blobs costs a pipe round trip instead of a new subprocess. Listings
+    and patches come from `diff-tree`, `log` and `diff`, parsed directly.
+    """
+    
+    name = "native"
+    
+    def __init__(self, repo_path: Path):
+        self.repo_path = Path(repo_path)
+        self._batch: Dict[str, subprocess.Popen] = {}
+        self._lock = threading.Lock()
+        
+        result = subprocess.run(
+            ["git", "-C", str(self.repo_path), "rev-parse", "--git-dir"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            raise ValueError(f"Invalid git repository at {self.repo_path}")
+    
+    def _git_args(self, command: str, *args: str, config: Optional[Dict[str, str]] = None) -> List[str]:
+        options = [option for key, value in (config or {}).items() for option in ("-c", f"{key}={value}")]
+        return ["git", "-C", str(self.repo_path), "-c", "core.quotePath=false", *options, command, *args]
+    
+    def _batch_process(self, mode: str) -> subprocess.Popen:
+        """Get (starting if needed) the persistent cat-file process for a mode."""
+        proc = self._batch.get(mode)
+        if proc is None or proc.poll() is not None:
+            self._record(processes=1)
+            proc = subprocess.Popen(
+                self._git_args("cat-file", f"--{mode}"),
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            )
+            self._batch[mode] = proc
+        return proc
+    
+    def _batch_query(self, mode: str, query: str) -> Tuple[str, str, int, bytes]:
+        """
+        Ask a cat-file batch process about one object.
+        
+        Returns:
+            Tuple of (sha, object_type, size, content); content is empty
+            for batch-check
+        """
+        with self._lock:
+            proc = self._batch_process(mode)
+            proc.stdin.write(query.encode() + b"\n")
+            proc.stdin.flush()
+            header_line = proc.stdout.readline()
+            header = header_line.decode().split()
+            
+            if len(header) != 3:
+                raise ValueError(f"Unknown revision {query}")
+            
+            sha, object_type, size = header
+            content = b""
+            if mode == "batch":
+                content = proc.stdout.read(int(size))
+                proc.stdout.read(1)
+            self._record(bytes_read=len(header_line) + len(content))
+            return sha, object_type, int(size), content
+    
+    def resolve(self, ref: str) -> str:
+        return self._batch_query("batch-check", f"{ref}^{{commit}}")[0]
+    
+    def commit_time(self, ref: str) -> int:
+        _, _, _, content = self._batch_query("batch", f"{ref}^{{commit}}")
+        for line in content.split(b"\n"):
+            if line.startswith(b"committer "):
+                return int(line.rsplit(b" ", 2)[1])
+            if not line:
+                break
+        raise ValueError(f"Commit {ref} has no committer line")
+    
+    def head(self) -> str:
+        return self.resolve("HEAD")
+    
+    def active_branch(self) -> str:
+        return self.run("symbolic-ref", "--short", "HEAD")
+    
+    def fetch_all(self) -> None:
+        self.run("fetch", "origin")
+    
+    def diff_tree(self, from_ref: str, to_ref: str, pathspecs: List[str]) -> List[FileChange]:
+        output = self.run(
+            "diff-tree", "-r", "-M", "-z", "--raw", "--full-index", "--no-color",
+            from_ref, to_ref, "--", *pathspecs,
+        )
+        fields = output.split("\0")
+        changes = []
+        
+        i = 0
+        while i < len(fields) - 1:
+            info = fields[i]
+            i += 1
+            if not info.startswith(":"):
+                continue
+            
+            _old_mode, _new_mode, old_sha, new_sha, status = info[1:].split()
+            change_type = status[0]
+            a_path = fields[i]
+            i += 1
+            b_path = a_path
+            if change_type in ('R', 'C'):
+                b_path = fields[i]
+                i += 1
+            
+            changes.append(FileChange(
+                change_type=change_type,
+                a_path=a_path,
+                b_path=b_path,
+                a_blob=None if set(old_sha) == {"0"} else old_sha,
+                b_blob=None if set(new_sha) == {"0"} else new_sha,
+            ))
+        
+        return changes
+    
+    def read_blob(self, sha: str) -> bytes:
+        return self._batch_query("batch", sha)[3]
+    
+    def blob_size(self, sha: str) -> int:
+        return self._batch_query("batch-check", sha)[2]
+    
+    def run(self, command: str, *args: str, input: Optional[str] = None, config: Optional[Dict[str, str]] = None) -> str:
+        result = subprocess.run(
+            self._git_args(command, *args, config=config),
+            input=input.encode('utf-8') if input is not None else None,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        self._record(processes=1, bytes_read=len(result.stdout))
+        if result.returncode != 0:
+            raise RuntimeError(f"git {command} failed: {result.stderr.decode(errors='ignore').strip()}")
+        output = result.stdout.decode('utf-8', errors='ignore')
+        return output[:-1] if output.endswith("\n") else output
+    
+    def stream(self, command: str, *args: str, config: Optional[Dict[str, str]] = None):
+        return self._counted(_GitProcess(self._git_args(command, *args, config=config)))
+    
+    def close(self) -> None:
+        for proc in self._batch.values():
+            if proc.poll() is None:
+                proc.stdin.close()
+                proc.wait()
+            proc.stdout.close()
+        self._batch.clear()
+
+
+GIT_BACKENDS = {
+    GitPythonBackend.name: GitPythonBackend,
+    NativeGitBackend.name: NativeGitBackend,
+}
+
+
+DEFAULT_MAX_BLOB_BYTES = 1024 * 1024
+# Above this many files a patch subset is filtered from the full range stream
+# instead of being listed on the command line
+MAX_PATH_ARGS = 200
+
+
+def shard_file_name(path: str) -> str:
+    """Name of the patch shard for an upstream path (`src/DTO/User.php` -> `src__DTO__User.php.diff`)."""
+    return path.replace("/", "__") + ".diff"
+
+
+def _format_size(size: Optional[int]) -> str:
+    """Format a byte count for reports (e.g. 512 B, 1.5 KiB, 3.2 MiB), or "unknown" for None."""
+    if size is None:
+        return "unknown"
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KiB"
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+
+class DiffSnapshot:
+    """
+    The result of diffing two upstream commits, computed once and shared.
+    
+    The tree diff is taken once when the snapshot is built. Line stats and
+    patch text are only loaded the first time a consumer asks for them, each
+    with a single git call covering the whole range. Large ranges can be
+    consumed with iter_patch_lines() without holding any patch in memory.
+    With a DiffCache, all three are read back from disk on later runs.
+    
+    Binary files and files over max_blob_bytes are summarized rather than
+    diffed: git sees them as binary and never builds their patches, and
+    their one-line stanzas are dropped from the patch stream.
+    """
+    
+    def __init__(
+        self,
+        backend: GitBackend,
+        from_commit: str,
+        to_commit: str,
+        path_filter: Optional[PathFilter] = None,
+        cache: Optional[DiffCache] = None,
+        max_blob_bytes: Optional[int] = None,
+    ):
+        self._backend = backend
+        self._from = from_commit
+        self._to = to_commit
+        self.from_sha = backend.resolve(from_commit)
+        self.to_sha = backend.resolve(to_commit)
+        self.pathspecs = path_filter.pathspecs if path_filter else []
+        self.max_blob_bytes = max_blob_bytes
+        self._cache = cache
+        self._cache_key = cache.key(
+            "diff", self.from_sha, self.to_sha, str(max_blob_bytes or ""), *self.pathspecs
+        ) if cache else None
+        self._stats: Optional[Dict[str, Tuple[Optional[int], Optional[int]]]] = None
+        self._patches: Optional[Dict[str, bytes]] = None
+        self._classified = False
+        
+        cached = cache.get_json(self._cache_key) if cache else None
+        if cached is not None:
+            self.changes: List[FileChange] = [FileChange(**c) for c in cached["changes"]]
+            self._classified = cached.get("classified", False)
+            if cached.get("stats") is not None:
+                self._stats = {path: tuple(value) for path, value in cached["stats"].items()}
+        else:
+            self.changes = self._compute_changes(path_filter)
+            self._store()
+    
+    def _compute_changes(self, path_filter: Optional[PathFilter]) -> List[FileChange]:
+        """Diff the two trees, keeping only changes to tracked paths."""
+        changes = []
+        
+        for change in self._backend.diff_tree(self._from, self._to, self.pathspecs):
+            if path_filter:
+                change.category = path_filter.category(change.b_path) or path_filter.category(change.a_path)
+                if change.category is None:
+                    continue
+            
+            changes.append(change)
+        
+        return changes
+    
+    def _classify(self, changes: List[FileChange]) -> None:
+        """
+        Record blob sizes and whether each change is binary.
+        
+        Only reports need this, so it runs the first time summarized() is
+        called and the result is cached with the change list.
+        
+        Binary status comes from the numstat pass that also provides line
+        stats: git prints `-` counts for a file its `diff` attribute or a
+        NUL byte marks as binary. Sizes come from one `cat-file
+        --batch-check` over every blob in the range, after the numstat diff
+        has fetched any blobs a partial clone is missing in one batch.
+        Files over max_blob_bytes get `-` counts as well, so whether they
+        are binary is left unknown rather than read from their content.
+        """
+        measured = [change for change in changes if change.a_blob or change.b_blob]
+        if not measured:
+            return
+        
+        if self._stats is None:
+            self._stats = self._load_stats()
+        sizes = self._backend.blob_sizes(sha for change in measured for sha in (change.a_blob, change.b_blob) if sha)
+        
+        for change in measured:
+            change.a_size = sizes.get(change.a_blob) if change.a_blob else None
+            change.b_size = sizes.get(change.b_blob) if change.b_blob else None
+            if not self.oversized(change):
+                change.binary = self._stats.get(change.path) == (None, None)
+    
+    def oversized(self, change: FileChange) -> bool:
+        """Whether either version of a file is over max_blob_bytes."""
+        return bool(self.max_blob_bytes) and max(change.a_size or 0, change.b_size or 0) > self.max_blob_bytes
+    
+    def summarized(self) -> List[FileChange]:
+        """Changes reported by size and blob id instead of a patch."""
+        if not self._classified:
+            self._classify(self.changes)
+            self._classified = True
+            self._store()
+        return [change for change in self.changes if change.binary or self.oversized(change)]
+    
+    @property
+    def diff_config(self) -> Dict[str, str]:
+        """
+        Configuration for patch and stats calls that keeps git off summarized files.
+        
+        Summarized files are not excluded by path, since one exclude per file
+        can overflow the command line on large ranges. Binary files are cheap
+        for git to skip on its own, and with core.bigFileThreshold files over
+        max_blob_bytes are treated as binary, so git prints a one-line
+        "Binary files differ" stanza without building their patches. Those
+        stanzas are then dropped like any other summarized change.
+        """
+        return {"core.bigFileThreshold": str(self.max_blob_bytes)} if self.max_blob_bytes else {}
+    
+    def _store(self) -> None:
+        """Write the change list and any loaded stats to the cache."""
+        if self._cache:
+            self._cache.put_json(self._cache_key, {
+                "changes": [asdict(change) for change in self.changes],
+                "classified": self._classified,
+                "stats": self._stats,
+            })
+    
+    def __len__(self) -> int:
+        return len(self.changes)
+    
+    def __iter__(self) -> Iterator[FileChange]:
+        return iter(self.changes)
+    
+    def by_type(self) -> Dict[str, List[str]]:
+        """Group changed paths by change type, as returned by get_file_changes."""
+        changes = {name: [] for name in CHANGE_TYPE_NAMES.values()}
+        
+        for change in self.changes:
+            name = CHANGE_TYPE_NAMES.get(change.change_type)
+            if name:
+                changes[name].append(change.display_path)
+        
+        return changes
+    
+    def stats(self, change: FileChange) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Get (insertions, deletions) for a change.
+        
+        Both values are None for binary files and files over max_blob_bytes.
+        """
+        if self._stats is None:
+            self._stats = self._load_stats()
+            self._store()
+        return self._stats.get(change.path, (0, 0))
+    
+    def patch(self, change: FileChange) -> bytes:
+        """Get the patch text for a change."""
+        if self._patches is None:
+            patches: Dict[str, List[bytes]] = {}
+            for item, line in self.iter_patch_lines():
+                patches.setdefault(item.path, []).append(line)
+            self._patches = {path: b"".join(lines) for path, lines in patches.items()}
+        return self._patches.get(change.path, b"")
+    
+    def iter_patch_lines(self, changes: Optional[List[FileChange]] = None) -> Iterator[Tuple[FileChange, bytes]]:
+        """
+        Stream the patch for the whole range one line at a time.
+        
+        Lines are read straight from a single git diff process, so memory use
+        does not depend on the size of the range. The consumer may stop early.
+        
+        Args:
+            changes: Only stream the patches of these changes; up to
+                MAX_PATH_ARGS of them, git is limited to their paths and
+                nothing is written to the cache
+        
+        Yields:
+            Tuples of (change, raw_patch_line)
+        """
+        if self._cache:
+            cached = self._cache.get_path(self._cache_key, ".patch")
+            if cached is not None:
+                with open(cached, 'rb') as f:
+                    yield from self._pair_patch_lines(f, changes)
+                return
+        
+        if changes is not None and len(changes) <= MAX_PATH_ARGS:
+            paths = dict.fromkeys(path for change in changes for path in (change.a_path, change.b_path) if path)
+            if not paths:
+                return
+            proc = self._backend.stream(
+                "diff", *PATCH_OPTIONS, self.from_sha, self.to_sha, "--", *(f":(literal){path}" for path in paths),
+                config=self.diff_config,
+            )
+            finished = False
+            try:
+                yield from self._pair_patch_lines(proc.stdout, changes)
+                finished = True
+            finally:
+                proc.stdout.close()
+                if finished:
+                    proc.wait()
+                else:
+                    _stop_stream(proc)
+            return
+        
+        proc = self._backend.stream(
+            "diff", *PATCH_OPTIONS, self.from_sha, self.to_sha, "--", *self.pathspecs, config=self.diff_config,
+        )
+        finished = False
+        
+        try:
+            if self._cache:
+                # Copy the raw stream into the cache as it is consumed
+                with self._cache.writer(self._cache_key, ".patch") as cache_file:
+                    yield from self._pair_patch_lines(_tee(proc.stdout, cache_file), changes)
+            else:
+                yield from self._pair_patch_lines(proc.stdout, changes)
+            finished = True
+        finally:
+            proc.stdout.close()
+            if finished:
+                proc.wait()
+            else:
+                _stop_stream(proc)
+    
+    def _pair_patch_lines(self, lines, changes: Optional[List[FileChange]] = None) -> Iterator[Tuple[FileChange, bytes]]:
+        """Attribute raw `git diff` lines to the change they belong to, dropping other changes."""
+        summarized = {id(c) for c in self.summarized()}
+        headers = {
+            b"diff --git " + _quote_path(f"a/{c.a_path or c.b_path}") + b" " + _quote_path(f"b/{c.b_path or c.a_path}") + b"\n": c
+            for c in (self.changes if changes is None else changes) if id(c) not in summarized
+        }
+        change = None
+        
+        for line in lines:
+            if line.startswith(b"diff --git "):
+                change = headers.get(line)
+            if change is not None:
+                yield change, line
+    
+    def _load_stats(self) -> Dict[str, Tuple[Optional[int], Optional[int]]]:
+        """Load line stats for every change with one numstat call."""
+        output = self._backend.run(
+            "diff", "--numstat", "-z", "-M", "--no-relative", self.from_sha, self.to_sha, "--", *self.pathspecs,
+            config=self.diff_config,
+        )
+        fields = output.split("\0")
+        stats = {}
+        
+        i = 0
+        while i < len(fields):
+            record = fields[i]
+            i += 1
+            if not record:
+                continue
+            
+            added, deleted, path = record.split("\t", 2)
+            if not path:
+                # Renames carry the old and new path as the next two fields
+                path = fields[i + 1]
+                i += 2
+            
+            stats[path] = (
+                None if added == "-" else int(added),
+                None if deleted == "-" else int(deleted),
+            )
+        
+        return stats
+
+
+_PHP_STRING_OR_COMMENT = re.compile(
+    r"""'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"|/\*.*?\*/|//[^\n]*|#(?!\[)[^\n]*""",
+    re.S,
+)
+_PHP_CLASS = re.compile(r"\b(?:abstract\s+|final\s+|readonly\s+)*class\s+(\w+)")
+_PHP_PROPERTY = re.compile(
+    r"\b(?:public|protected|private)\s+(?:(?:readonly|static)\s+)*(?:([?\w\\|&]+)\s+)?\$(\w+)"
+)
+_PHP_ARRAY_KEY = re.compile(r"""(['"])([^'"]+)\1\s*=>""")
+
+SCHEMA_PARALLEL_THRESHOLD = 16
+
+
+def _php_normalize_type(php_type: Optional[str]) -> str:
+    """Spell a declared type the same way however it was written (?int is int|null)."""
+    if not php_type:
+        return "mixed"
+    parts = php_type.lstrip("?").lstrip("\\").split("|")
+    if php_type.startswith("?"):
+        parts.append("null")
+    return "|".join(sorted(set(parts), key=lambda part: (part == "null", part.lower())))
+
+
+def _php_closing_bracket(masked: str, start: int, brackets: Pattern) -> int:
+    """
+    Find the end of a bracketed block.
+    
+    Only bracket characters are visited, which keeps long method bodies cheap.
+    
+    Args:
+        masked: Source with comments removed and string contents blanked
+        start: Index just after the opening bracket
+        brackets: Pattern matching the opening and closing bracket
+    
+    Returns:
+        Index just after the matching closing bracket, or the source length
+    """
+    depth = 1
+    for match in brackets.finditer(masked, start):
+        depth += 1 if match.group() in "({" else -1
+        if not depth:
+            return match.end()
+    return len(masked)
+
+
+_PHP_PARENS = re.compile(r"[()]")
+_PHP_BRACES = re.compile(r"[{}]")
+
+
+def _php_method(code: str, masked: str, name: str) -> Tuple[str, str]:
+    """
+    Find a method in comment-free PHP source.
+    
+    Args:
+        code: Source with comments removed
+        masked: The same source with string contents blanked, for matching
+            brackets without being fooled by quotes
+        name: Method name
+    
+    Returns:
+        Tuple of (parameter_list, body), both empty if the method is absent
+    """
+    match = re.search(rf"\bfunction\s+&?{name}\s*\(", masked)
+    if not match:
+        return "", ""
+    
+    end = _php_closing_bracket(masked, match.end(), _PHP_PARENS)
+    params = code[match.end():end - 1]
+    
+    start = masked.find("{", end)
+    if start == -1 or masked.find(";", end, start) != -1:
+        # Abstract or interface method without a body
+        return params, ""
+    
+    return params, code[start + 1:_php_closing_bracket(masked, start + 1, _PHP_BRACES) - 1]
+
+
+def parse_php_schema(source: str) -> Optional[Dict]:
+    """
+    Extract the data schema of a PHP DTO class.
+    
+    This is a lightweight scan rather than a full PHP parser: it reads
+    declared and constructor-promoted properties with their types, the keys
+    read from the input array in `fromArray()` or the constructor, and the
+    keys written by `toArray()`.
+    
+    Returns:
+        Dictionary with class, properties (name to type), input_keys and
+        output_keys, or None if the source defines no class
+    """
+    code = _PHP_STRING_OR_COMMENT.sub(
+        lambda m: m.group(0) if m.group(0)[0] in "'\"" else " ", source
+    )
+    masked = _PHP_STRING_OR_COMMENT.sub(
+        lambda m: m.group(0)[0] + " " * (len(m.group(0)) - 2) + m.group(0)[-1]
+        if m.group(0)[0] in "'\"" else m.group(0),
+        code,
+    )
+    
+    class_match = _PHP_CLASS.search(masked)
+    if not class_match:
+        return None
+    
+    properties = {
+        name: _php_normalize_type(php_type)
+        for php_type, name in _PHP_PROPERTY.findall(masked, class_match.end())
+    }
+    
+    input_keys = set()
+    for method in ("fromArray", "__construct"):
+        params, body = _php_method(code, masked, method)
+        for variable in re.findall(r"\barray\s+\$(\w+)", params):
+            quoted = r"""(['"])([^'"]+)\1"""
+            input_keys.update(key for _, key in re.findall(rf"\${variable}\s*\[\s*{quoted}\s*\]", body))
+            input_keys.update(key for _, key in re.findall(rf"\(\s*\${variable}\s*,\s*{quoted}", body))
+            input_keys.update(key for _, key in re.findall(rf"{quoted}\s*,\s*\${variable}\s*\)", body))
+    
+    _, to_array = _php_method(code, masked, "toArray")
+    
+    return {
+        "class": class_match.group(1),
+        "properties": properties,
+        "input_keys": sorted(input_keys),
+        "output_keys": sorted({key for _, key in _PHP_ARRAY_KEY.findall(to_array)}),
+    }
+
+
+def diff_schemas(old: Optional[Dict], new: Optional[Dict]) -> Optional[Dict]:
+    """
+    Compare two DTO schemas field by field.
+    
+    Returns:
+        Dictionary with the class name, added/removed properties (name to
+        type), retyped properties (name to [old, new]) and added/removed
+        input and output keys, or None if nothing changed
+    """
+    if old is None and new is None:
+        return None
+    
+    old = old or {"properties": {}, "input_keys": [], "output_keys": []}
+    new_or_empty = new or {"properties": {}, "input_keys": [], "output_keys": []}
+    old_props, new_props = old["properties"], new_or_empty["properties"]
+    
+    changes = {
+        "class": (new or old)["class"],
+        "status": "added" if "class" not in old else "removed" if new is None else "modified",
+        "added": {name: t for name, t in new_props.items() if name not in old_props},
+        "removed": {name: t for name, t in old_props.items() if name not in new_props},
+        "retyped": {
+            name: [old_props[name], t] for name, t in new_props.items()
+            if name in old_props and old_props[name] != t
+        },
+    }
+    for field in ("input_keys", "output_keys"):
+        changes[f"{field}_added"] = sorted(set(new_or_empty[field]) - set(old[field]))
+        changes[f"{field}_removed"] = sorted(set(old[field]) - set(new_or_empty[field]))
+    
+    if not any(value for key, value in changes.items() if key not in ("class", "status")):
+        return None
+    return changes
+
+
+def parse_php_schemas(sources: List[str], max_workers: Optional[int] = None) -> List[Optional[Dict]]:
+    """
+    Run parse_php_schema() over many sources, in parallel for larger batches.
+    
+    Parsing is CPU bound, so batches of SCHEMA_PARALLEL_THRESHOLD files or
+    more are spread over a process pool; smaller ones are not worth its
+    startup cost.
+    
+    Returns:
+        Schemas in the order of the sources
+    """
+    workers = max_workers or os.cpu_count() or 1
+    if len(sources) < SCHEMA_PARALLEL_THRESHOLD or workers == 1:
+        return [parse_php_schema(source) for source in sources]
+    
+    from concurrent.futures import ProcessPoolExecutor
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(parse_php_schema, sources, chunksize=max(1, len(sources) // (workers * 4))))
+
+
+_PHP_DECLARATION = re.compile(r"^\s*(?:(?:abstract|final|readonly)\s+)*(?:class|interface|trait|enum)\s", re.M)
+_PHP_PREAMBLE = re.compile(r"<\?php|\bdeclare\s*\([^)]*\)\s*;|\bnamespace\s+[\w\\]+\s*;|\buse\s+[^;]+;")
+_PHP_QUALIFIED_NAME = re.compile(r"\\?(?:\w+\\)+(\w+)")
+
+# Bump when normalize_php() changes, so cached hashes are recomputed
+DRIFT_CACHE_VERSION = 1
+
+
+def normalize_php(source: str) -> List[str]:
+    """
+    Reduce PHP source to the lines that matter when comparing a port.
+    
+    Comments, the opening tag, `declare`, `namespace` and `use` imports
+    before the first class-like declaration are dropped, qualified names are
+    cut to their last segment (so `\\Illuminate\\Support\\Collection` and an
+    imported `Collection` compare equal) and whitespace is collapsed. The
+    code is then split after every `{`, `;` and `}` rather than at line
+    breaks, so brace placement and line wrapping do not count either. Trait
+    `use` statements inside the class body are kept.
+    
+    Returns:
+        Non-empty normalized statements, one per line
+    """
+    code = _PHP_STRING_OR_COMMENT.sub(lambda m: m.group() if m.group()[0] in "'\"" else " ", source)
+    declaration = _PHP_DECLARATION.search(code)
+    split = declaration.start() if declaration else len(code)
+    code = _PHP_PREAMBLE.sub(" ", code[:split]) + code[split:]
+    code = re.sub(r"\s+", " ", _PHP_QUALIFIED_NAME.sub(r"\1", code))
+    
+    lines = (line.strip() for line in re.split(r"(?<=[{};])", code))
+    return [line for line in lines if line]
+
+
+def _normalized_hash(lines: List[str]) -> str:
+    """Content hash of normalized lines."""
+    return hashlib.sha1("\n".join(lines).encode()).hexdigest()
+
+
+def divergence_score(local: List[str], upstream: List[str]) -> float:
+    """
+    Score how far two normalized files have diverged.
+    
+    Returns:
+        0.0 for identical line sequences up to 1.0 for nothing in common
+    """
+    import difflib
+    
+    matcher = difflib.SequenceMatcher(None, local, upstream, autojunk=False)
+    return round(1.0 - matcher.ratio(), 3)
+
+
+RENDER_BATCH_BYTES = 256 * 1024
+
+
+def _render_patches(
+    patches: List[List[bytes]],
+    max_file_bytes: Optional[int],
+    keep_lines: bool,
+) -> List[Tuple[str, int, int, Optional[List[Tuple[int, Optional[str]]]]]]:
+    """
+    Decode a batch of file patches, applying the per-file byte limit.
+    
+    Runs in a render worker process. Lines are kept or skipped exactly as
+    the serial loop in write_diff_report() does, so the parallel path
+    produces the same report.
+    
+    Args:
+        patches: Raw patch lines of each file
+        max_file_bytes: Patch bytes to keep per file, or None
+        keep_lines: Also return every line, so the caller can cut the report
+            at the total byte limit
+    
+    Returns:
+        For each file, (text, kept_bytes, skipped_bytes, lines), where lines
+        holds (raw_length, text or None if skipped) per line when keep_lines
+        is set
+    """
+    rendered = []
+    
+    for patch in patches:
+        kept = []
+        lines = [] if keep_lines else None
+        file_bytes = 0
+        skipped_bytes = 0
+        
+        for line in patch:
+            if max_file_bytes is not None and file_bytes + len(line) > max_file_bytes:
+                skipped_bytes += len(line)
+                if keep_lines:
+                    lines.append((len(line), None))
+                continue
+            
+            text = line.decode('utf-8', errors='ignore')
+            kept.append(text)
+            if keep_lines:
+                lines.append((len(line), text))
+            file_bytes += len(line)
+        
+        rendered.append(("".join(kept), file_bytes, skipped_bytes, lines))
+    
+    return rendered
+
+
+def _timed(name: str, generator: bool = False) -> Callable:
+    """
+    Record every call of a tracker method as a span in `self.timings`.
+    
+    Args:
+        name: Span name
+        generator: The method is a generator; the span then covers only
+            the stretches it runs, from each resume to the next yield, and
+            is counted as one call. A suspended or abandoned generator never
+            leaves the span open under its consumer's spans.
+    """
+    def decorate(method: Callable) -> Callable:
+        if generator:
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                items = method(self, *args, **kwargs)
+                first = True
+                done = False
+                try:
+                    while True:
+                        with self.timings.span(name, count=first):
+                            first = False
+                            try:
+                                item = next(items)
+                            except StopIteration:
+                                done = True
+                                return
+                        yield item
+                finally:
+                    if not done:
+                        # An abandoned generator's cleanup (e.g. reaping git) belongs to the span too
+                        with self.timings.span(name, count=False):
+                            items.close()
+        else:
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self.timings.span(name):
+                    return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class UpstreamTracker:
+    """Tracks and manages upstream repository synchronization."""
+    
+    def __init__(self, config_path: str = "upstream.json", upstream: Optional[str] = None):
+        self.config_path = Path(config_path)
+        self._document = self._load_config()
+        self.config = self._select_upstream(upstream)
+        self.repo_path = Path(self.config["repository"]["local_path"])
+        self.path_filter = PathFilter(self.config.get("files", {}).get("categories", {}))
+        self.manifest_path = self.config_path.parent / self.config.get("files", {}).get(
+            "manifest", self._default_manifest_name()
+        )
+        self._snapshots: Dict[Tuple[str, str], DiffSnapshot] = {}
+        self._schemas: Dict[str, Optional[Dict]] = {}
+        self._trees: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        self.timings = Timings()
+        self.backend_name = self.config["repository"].get("backend", GitPythonBackend.name)
+        self.render_workers = self.config.get("report", {}).get("render_workers", 1)
+        self.max_blob_bytes = self.config.get("report", {}).get("max_blob_bytes", DEFAULT_MAX_BLOB_BYTES)
+        self._backend: Optional[GitBackend] = None
+        self.cache = self._create_cache()
+        self.journal = self._create_journal()
+        self.commit_index = self._create_commit_index()
+        self.last_modified_path = self._last_modified_path()
+        self.check_error: Optional[str] = None
+        
+        self._apply_journal_state()
+        
+    def _load_config(self) -> Dict:
+        """Load the upstream configuration file."""
+        if not self.config_path.exists():
+            raise FileNotFoundError(f"Configuration file {self.config_path} not found")
+        
+        with open(self.config_path, 'r') as f:
+            return json.load(f)
+    
+    def _select_upstream(self, upstream: Optional[str]) -> Dict:
+        """
+        Pick the configuration of one upstream repository.
+        
+        A config either describes a single upstream at the top level or lists
+        several under `upstreams`, each with its own repository, tracking and
+        files blocks. Other top-level keys (cache, report, ...) are shared by
+        every upstream. Nested blocks are the document's own dictionaries, so
+        updating e.g. `config["tracking"]` is persisted by _save_config().
+        """
+        upstreams = self._document.get("upstreams")
+        
+        if upstreams is None:
+            if upstream and upstream != self._document["repository"]["name"]:
+                raise ValueError(f"Upstream {upstream} is not configured in {self.config_path}")
+            return self._document
+        
+        names = [entry["repository"]["name"] for entry in upstreams]
+        if upstream is None:
+            if len(upstreams) != 1:
+                raise ValueError(f"{self.config_path} lists {len(upstreams)} upstreams, select one of: {', '.join(names)}")
+            entry = upstreams[0]
+        elif upstream in names:
+            entry = upstreams[names.index(upstream)]
+        else:
+            raise ValueError(f"Upstream {upstream} is not configured in {self.config_path}")
+        
+        shared = {key: value for key, value in self._document.items() if key != "upstreams"}
+        return {**shared, **entry}
+    
+    def _default_manifest_name(self) -> str:
+        """Name the manifest file, keeping one per upstream in multi-upstream configs."""
+        return f"upstream-manifest{self._name_suffix()}.json"
+    
+    def _name_suffix(self) -> str:
+        """Suffix keeping per-upstream files apart in multi-upstream configs ("" otherwise)."""
+        if "upstreams" not in self._document:
+            return ""
+        return "-" + re.sub(r"[^A-Za-z0-9]+", "-", self.config["repository"]["name"]).strip("-")
+    
+    def _create_cache(self) -> Optional[DiffCache]:
+        """Create the on-disk diff cache if it is enabled in the config."""
+        settings = self.config.get("cache")
+        if not settings or not settings.get("enabled", True):
+            return None
+        
+        return DiffCache(
+            self.config_path.parent / settings.get("path", ".upstream-cache"),
+            settings.get("max_bytes", 100 * 1024 * 1024),
+        )
+    
+    def _apply_journal_state(self) -> None:
+        """Let the journal's latest state supersede the seed tracking values in the config."""
+        if not self.journal:
+            return
+        
+        state = self.journal.state(self.config["repository"]["name"]) or {}
+        for key in ("current_commit", "last_checked"):
+            if key in state:
+                self.config["tracking"][key] = state[key]
+    
+    def refresh_tracking(self) -> None:
+        """
+        Re-read tracking state that another run may have changed.
+        
+        Long-lived trackers call this so a concurrent `--update` is seen.
+        """
+        document = self._load_config()
+        if "upstreams" in document:
+            names = [entry["repository"]["name"] for entry in document["upstreams"]]
+            document = document["upstreams"][names.index(self.config["repository"]["name"])]
+        
+        self.config["tracking"].update(document["tracking"])
+        self._apply_journal_state()
+    
+    def _create_journal(self) -> Optional[SyncJournal]:
+        """Create the sync journal if it is enabled in the config."""
+        settings = self.config.get("journal")
+        if not settings or not settings.get("enabled", True):
+            return None
+        
+        return SyncJournal(self.config_path.parent / settings.get("path", "upstream-journal.ndjson"))
+    
+    def _create_commit_index(self) -> Optional[CommitIndex]:
+        """Create the commit index if it is enabled in the config."""
+        settings = self.config.get("commit_index")
+        if not settings or not settings.get("enabled", True):
+            return None
+        
+        return CommitIndex(
+            self.config_path.parent / settings.get("path", f".upstream-index{self._name_suffix()}.sqlite")
+        )
+    
+    def _last_modified_path(self) -> Optional[Path]:
+        """Locate the last-modified index if it is enabled in the config."""
+        settings = self.config.get("last_modified")
+        if not settings or not settings.get("enabled", True):
+            return None
+        
+        return self.config_path.parent / settings.get("path", f".upstream-last-modified{self._name_suffix()}.json")
+    
+    def _save_config(self) -> None:
+        """
+        Save this upstream's tracking block into the configuration file.
+        
+        The file is re-read under an advisory lock and replaced atomically,
+        so concurrent runs updating different upstreams (or other keys) do
+        not overwrite each other's changes.
+        """
+        with _file_lock(self.config_path):
+            document = self._load_config()
+            
+            if "upstreams" in document:
+                names = [entry["repository"]["name"] for entry in document["upstreams"]]
+                target = document["upstreams"][names.index(self.config["repository"]["name"])]
+            else:
+                target = document
+            target["tracking"] = self.config["tracking"]
+            
+            _write_json_atomic(self.config_path, document, indent=2)
+            self._document = document
+    
+    def _get_repo(self) -> "git.Repo":
+        """Get the git repository object."""
+        if not self.repo_path.exists():
+            raise FileNotFoundError(f"Repository path {self.repo_path} not found")
+        
+        git = _import_git()
+        try:
+            return git.Repo(self.repo_path)
+        except git.InvalidGitRepositoryError:
+            raise ValueError(f"Invalid git repository at {self.repo_path}")
+    
+    def _get_backend(self) -> GitBackend:
+        """Get the git backend, creating it on first use and reusing it afterwards."""
+        if self._backend is None:
+            if self.backend_name not in GIT_BACKENDS:
+                raise ValueError(f"Unknown git backend '{self.backend_name}', choose from {', '.join(GIT_BACKENDS)}")
+            
+            if self.backend_name == GitPythonBackend.name:
+                self._backend = GitPythonBackend(self._get_repo())
+            else:
+                if not self.repo_path.exists():
+                    raise FileNotFoundError(f"Repository path {self.repo_path} not found")
+                self._backend = GIT_BACKENDS[self.backend_name](self.repo_path)
+            self._backend.timings = self.timings
+        
+        return self._backend
+    
+    def close(self) -> None:
+        """Stop any long-lived git processes held by the backend."""
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+        if self.commit_index is not None:
+            self.commit_index.close()
+    
+    def get_current_commit(self) -> str:
+        """Get the current commit hash of the upstream repository."""
+        return self._get_backend().head()
+    
+    @_timed("check_for_updates")
+    def check_for_updates(
+        self,
+        max_commits: Optional[int] = None,
+        since: Optional[str] = None,
+    ) -> Tuple[bool, Optional[str], Iterable[str]]:
+        """
+        Check if there are updates available from upstream.
+        
+        Args:
+            max_commits: Stop listing new commits after this many
+            since: Only list commits newer than this date (any git date format)
+        
+        Returns:
+            Tuple of (has_updates, new_commit_hash, new_commits), where
+            new_commits is produced lazily as it is iterated and is the only
+            part max_commits and since apply to. When upstream moved but no
+            new commit touches a tracked path, has_updates is False and
+            new_commit_hash is still the new upstream head, so tracking can
+            move past the irrelevant commits.
+        """
+        self.check_error = None
+        try:
+            current_commit = self.config["tracking"]["current_commit"]
+            latest_commit = self.fetch_upstream()
+            
+        except Exception as e:
+            self.check_error = str(e)
+            print(f"Error checking for updates: {e}")
+            return False, None, []
+        
+        # The index only serves --query, so failing to update it must not hide updates
+        if self.commit_index:
+            try:
+                self.update_commit_index(latest_commit)
+            except Exception as e:
+                print(f"Error updating the commit index: {e}", file=sys.stderr)
+        self.refresh_last_modified(current_commit)
+        
+        if current_commit == latest_commit:
+            return False, None, []
+        
+        # Listing limits only shape the list, they must not hide updates
+        if not self._touches_tracked_paths(current_commit, latest_commit):
+            return False, latest_commit, []
+        
+        return True, latest_commit, self.iter_commits(current_commit, latest_commit, max_commits, since)
+    
+    def _touches_tracked_paths(self, from_commit: str, to_commit: str) -> bool:
+        """Whether any commit in a range changes a tracked path, read with one `git log -1`."""
+        return bool(self._get_backend().run(
+            "log", "-1", "--format=%H", f"{from_commit}..{to_commit}", "--", *self.path_filter.pathspecs,
+        ))
+    
+    def watch(
+        self,
+        on_change: Callable[[str], None],
+        interval: Optional[float] = None,
+        max_polls: Optional[int] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        Poll the upstream head and call on_change whenever it moves.
+        
+        The tracker, its repository handle and backend processes stay alive
+        between polls, and a poll is one `git ls-remote`, so an unchanged
+        upstream costs next to nothing. Only when the head moves is the
+        tracking state re-read and on_change run (typically a full check).
+        Sleeps are jittered so several watchers do not poll in lockstep, and
+        back off exponentially, up to `watch.max_backoff`, after failures.
+        A check that fails (on_change raises or leaves `check_error` set)
+        counts as a failure, and the same head is checked again next poll.
+        
+        Timings and per-range caches are reset every poll so memory stays
+        flat however long the watch runs.
+        
+        Args:
+            on_change: Called with the new remote head
+            interval: Seconds between polls (defaults to `watch.interval` or 300)
+            max_polls: Stop after this many polls (default: run until interrupted)
+            sleep: Function used to wait between polls
+        """
+        settings = self.config.get("watch", {})
+        interval = interval or settings.get("interval", 300)
+        max_backoff = max(settings.get("max_backoff", 3600), interval)
+        jitter = settings.get("jitter", 0.1)
+        
+        seen = self.config["tracking"]["current_commit"]
+        failures = 0
+        polls = 0
+        
+        while True:
+            polls += 1
+            self.timings = Timings()
+            if self._backend is not None:
+                self._backend.timings = self.timings
+            
+            try:
+                with self.timings.span("poll"):
+                    head = self.get_remote_head()
+                
+                if head and head != seen:
+                    self.refresh_tracking()
+                    self._snapshots.clear()
+                    self._schemas.clear()
+                    self.check_error = None
+                    on_change(head)
+                    # A failed check leaves the head unseen, so the next poll retries it
+                    if self.check_error:
+                        raise RuntimeError(self.check_error)
+                    seen = head
+                failures = 0
+            except Exception as e:
+                failures += 1
+                print(f"Error watching upstream: {e}", file=sys.stderr)
+            
+            if max_polls is not None and polls >= max_polls:
+                return
+            delay = min(interval * 2 ** failures, max_backoff)
+            sleep(delay * random.uniform(1 - jitter, 1 + jitter))
+    
+    def get_remote_head(self) -> Optional[str]:
+        """
+        Read the upstream branch head from the remote's ref advertisement.
+        
+        Uses `git ls-remote`, which transfers no objects.
+        
+        Returns:
+            The remote head commit hash, or None if the branch is not advertised
+        """
+        output = self._get_backend().run("ls-remote", "origin", f"refs/heads/{self._fetch_branch()}")
+        return output.split()[0] if output.strip() else None
+    
+    def _fetch_branch(self) -> str:
+        """Get the upstream branch to track, from config or the checked out branch."""
+        return self.config.get("fetch", {}).get("branch") or self._get_backend().active_branch()
+    
+    @_timed("fetch")
+    def fetch_upstream(self) -> str:
+        """
+        Bring the local upstream clone up to date and return the latest commit.
+        
+        Without a `fetch` block in the config every ref is fetched and the
+        checked out HEAD is used. With one, the remote head is compared via
+        `git ls-remote` first and the fetch is skipped when it matches the
+        tracked commit; otherwise only the tracked branch is fetched,
+        optionally shallow (back to the tracked commit) and blobless, so
+        blobs are only downloaded later for the paths a diff actually reads.
+        
+        Returns:
+            The latest upstream commit hash
+        """
+        backend = self._get_backend()
+        settings = self.config.get("fetch")
+        
+        if not settings:
+            print("Fetching latest changes from upstream...")
+            backend.fetch_all()
+            return backend.head()
+        
+        current_commit = self.config["tracking"]["current_commit"]
+        branch = self._fetch_branch()
+        
+        if settings.get("ls_remote_check", True):
+            remote_head = self.get_remote_head()
+            if remote_head == current_commit:
+                print("Upstream head unchanged, skipping fetch")
+                return remote_head
+        
+        args = ["--no-tags"] if settings.get("single_branch", True) else []
+        if settings.get("filter"):
+            args.append(f"--filter={settings['filter']}")
+        if settings.get("shallow"):
+            try:
+                args.append(f"--shallow-since=@{backend.commit_time(current_commit)}")
+            except ValueError:
+                print(f"Tracked commit {current_commit[:8]} not available locally, fetching full history")
+        
+        refspecs = [f"+refs/heads/{branch}:refs/remotes/origin/{branch}"] if settings.get("single_branch", True) else []
+        
+        print(f"Fetching {branch} from upstream...")
+        backend.run("fetch", "origin", *args, *refspecs)
+        return backend.resolve(f"refs/remotes/origin/{branch}")
+    
+    def fetch_refs(self, refs: Iterable[str]) -> None:
+        """
+        Fetch the refs that do not resolve in the clone yet, in one call.
+        
+        Fetches with a `fetch` block skip tags, so release tags named on the
+        command line may only exist upstream. Plain names are fetched as
+        tags, `refs/...` names and full commit hashes as given, blobless
+        when the fetch settings ask for it.
+        """
+        backend = self._get_backend()
+        missing = []
+        for ref in dict.fromkeys(refs):
+            try:
+                backend.resolve(ref)
+            except Exception:
+                missing.append(ref)
+        if not missing:
+            return
+        
+        refspecs = [
+            ref if re.fullmatch(r"[0-9a-f]{40}", ref) else f"+{ref}:{ref}" if ref.startswith("refs/")
+            else f"+refs/tags/{ref}:refs/tags/{ref}"
+            for ref in missing
+        ]
+        args = ["--no-tags"]
+        if self.config.get("fetch", {}).get("filter"):
+            args.append(f"--filter={self.config['fetch']['filter']}")
+        
+        print(f"Fetching {', '.join(missing)} from upstream...", file=sys.stderr)
+        try:
+            backend.run("fetch", "origin", *args, *refspecs)
+        except Exception as e:
+            raise ValueError(f"Unknown revision {', '.join(missing)}, not found locally or upstream: {e}") from e
+    
+    def iter_commits(
+        self,
+        from_commit: str,
+        to_commit: str,
+        max_commits: Optional[int] = None,
+        since: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Lazily list the commits in a range that touch tracked paths.
+        
+        Yields:
+            Lines of the form "<short_sha> - <message>", newest first
+        """
+        for commit in self.iter_log(from_commit, to_commit, max_commits, since):
+            yield f"{commit['sha'][:8]} - {commit['message']}"
+    
+    @_timed("rev_walk", generator=True)
+    def iter_log(
+        self,
+        from_commit: str,
+        to_commit: str,
+        max_commits: Optional[int] = None,
+        since: Optional[str] = None,
+    ) -> Iterator[Dict[str, str]]:
+        """
+        Lazily read the commits in a range that touch tracked paths.
+        
+        Metadata comes from one streaming `git log` process rather than one
+        lookup per commit object, so the first entries are available at once
+        and memory does not grow with the length of the range.
+        
+        Yields:
+            Dictionaries with the full "sha" and "message" of each commit,
+            newest first
+        """
+        backend = self._get_backend()
+        args = [f"{from_commit}..{to_commit}", "-z", "--format=%H%n%B"]
+        if max_commits:
+            args.append(f"--max-count={max_commits}")
+        if since:
+            args.append(f"--since={since}")
+        
+        # Relative --since dates change meaning over time, so only exact ranges are cached
+        cache_key = None
+        if self.cache and not since:
+            cache_key = DiffCache.key(
+                "log",
+                backend.resolve(from_commit),
+                backend.resolve(to_commit),
+                str(max_commits or ""),
+                *self.path_filter.pathspecs,
+            )
+            cached = self.cache.get_path(cache_key, ".commits")
+            if cached is not None:
+                with open(cached, 'r') as f:
+                    for line in f:
+                        yield json.loads(line)
+                return
+        
+        proc = backend.stream("log", *args, "--", *self.path_filter.pathspecs)
+        finished = False
+        
+        try:
+            records = (
+                {"sha": sha, "message": message.strip()}
+                for sha, _, message in (
+                    record.decode('utf-8', errors='ignore').partition("\n")
+                    for record in _iter_records(proc.stdout, b"\0")
+                )
+            )
+            
+            if cache_key:
+                with self.cache.writer(cache_key, ".commits") as cache_file:
+                    for entry in records:
+                        cache_file.write(json.dumps(entry).encode() + b"\n")
+                        yield entry
+            else:
+                yield from records
+            finished = True
+        finally:
+            proc.stdout.close()
+            if finished:
+                proc.wait()
+            else:
+                _stop_stream(proc)
+    
+    @_timed("commit_index")
+    def update_commit_index(self, to_commit: Optional[str] = None) -> int:
+        """
+        Bring the commit index up to date with an upstream commit.
+        
+        Only commits after the last indexed one are read. The index is
+        rebuilt from scratch when the path filters changed or the last
+        indexed commit is no longer an ancestor (upstream history was
+        rewritten).
+        
+        Args:
+            to_commit: Commit to index up to (defaults to the fetched upstream head)
+        
+        Returns:
+            Number of commits added
+        """
+        if not self.commit_index:
+            raise ValueError("Commit index is not enabled, add a commit_index block to the config")
+        
+        backend = self._get_backend()
+        tip = backend.resolve(to_commit or self._upstream_head())
+        filter_key = DiffCache.key(*self.path_filter.pathspecs)
+        head = self.commit_index.meta("head") if self.commit_index.meta("filter_key") == filter_key else None
+        
+        if head == tip:
+            return 0
+        if head:
+            try:
+                backend.run("merge-base", "--is-ancestor", head, tip)
+            except Exception:
+                head = None
+        
+        proc = backend.stream(
+            "log", "-z", "--name-status", "-M", "--format=%x01%H%x00%ct%x00%s",
+            f"{head}..{tip}" if head else tip, "--", *self.path_filter.pathspecs,
+        )
+        finished = False
+        
+        try:
+            added = self.commit_index.add(self._parse_name_status(proc.stdout), tip, filter_key, reset=head is None)
+            finished = True
+        finally:
+            proc.stdout.close()
+            if finished:
+                proc.wait()
+            else:
+                _stop_stream(proc)
+        
+        return added
+    
+    def _parse_name_status(
+        self, stream: BinaryIO
+    ) -> Iterator[Tuple[str, int, str, List[Tuple[str, str, Optional[str], Optional[str]]]]]:
+        """Parse `git log -z --name-status` records into CommitIndex.add() tuples."""
+        for record in _iter_records(stream, b"\x01"):
+            fields = record.decode('utf-8', errors='ignore').split("\0")
+            if len(fields) < 3:
+                continue
+            
+            sha, commit_time, subject = fields[:3]
+            rest = [field.lstrip("\n") for field in fields[3:]]
+            changes = []
+            
+            i = 0
+            while i < len(rest):
+                status = rest[i]
+                i += 1
+                if not status:
+                    continue
+                if status[0] in "RC":
+                    old_path, path = rest[i], rest[i + 1]
+                    i += 2
+                else:
+                    old_path, path = None, rest[i]
+                    i += 1
+                
+                category = self.path_filter.category(path) or self.path_filter.category(old_path)
+                if category is None and self.path_filter:
+                    continue
+                change_type = status[0] if status[0] in CHANGE_TYPE_NAMES else 'M'
+                changes.append((CHANGE_TYPE_NAMES[change_type], path, old_path, category))
+            
+            yield sha, int(commit_time), subject, changes
+    
+    def _upstream_head(self) -> str:
+        """The newest upstream commit already fetched, without fetching."""
+        if self.config.get("fetch"):
+            try:
+                return self._get_backend().resolve(f"refs/remotes/origin/{self._fetch_branch()}")
+            except Exception:
+                pass
+        return self._get_backend().head()
+    
+    def _git_timestamp(self, date: str, until: bool = False) -> int:
+        """Convert any date git understands ("2025-11-01", "2 weeks ago", ...) to Unix time."""
+        output = self._get_backend().run("rev-parse", f"--{'until' if until else 'since'}={date}")
+        return int(output.strip().partition("=")[2])
+    
+    def upstream_paths(self, path: str) -> List[str]:
+        """
+        Map a local or upstream file path to the upstream paths it stands for.
+        
+        Local paths are resolved through the manifest when there is one and
+        through the categories' `local` prefix maps otherwise. The path itself
+        is always included, so upstream paths can be given directly.
+        """
+        paths = [path]
+        
+        if self.manifest_path.exists():
+            files = self._load_manifest()["files"]
+            paths.extend(upstream for upstream, entry in files.items() if entry["local"] == path)
+        else:
+            for name, spec in self.config.get("files", {}).get("categories", {}).items():
+                mapping = spec.get("local", {}) if isinstance(spec, dict) else {}
+                for prefix, local_prefix in mapping.items():
+                    if path.startswith(local_prefix):
+                        upstream = prefix + path[len(local_prefix):]
+                        if self.path_filter.category(upstream) == name:
+                            paths.append(upstream)
+        
+        return list(dict.fromkeys(paths))
+    
+    def query_commits(
+        self,
+        path: Optional[str] = None,
+        category: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        since_sync: bool = False,
+    ) -> List[Dict]:
+        """
+        Look up upstream commits in the commit index, updating it first.
+        
+        Args:
+            path: Local or upstream file the commits changed
+            category: Category of the files the commits changed
+            since: Only commits after this date (any git date format)
+            until: Only commits before this date (any git date format)
+            since_sync: Only commits not reachable from the tracked commit
+        
+        Returns:
+            Matching commits as returned by CommitIndex.query(), newest first
+        """
+        self.update_commit_index()
+        
+        new_commits = None
+        if since_sync:
+            # Selected by ancestry, not time: commits merged after the sync may be older than it
+            current_commit = self.config["tracking"]["current_commit"]
+            output = self._get_backend().run("rev-list", f"{current_commit}..{self.commit_index.meta('head')}")
+            new_commits = output.split()
+        
+        return self.commit_index.query(
+            self.upstream_paths(path) if path else None,
+            category,
+            self._git_timestamp(since) if since else None,
+            self._git_timestamp(until, until=True) if until else None,
+            new_commits,
+        )
+    
+    @_timed("last_modified")
+    def update_last_modified(self, commit: Optional[str] = None) -> Dict:
+        """
+        Bring the last-modified index up to date with a tracked commit.
+        
+        The index records, for every tracked upstream file, the newest commit
+        that changed it. It is built by one `git log --name-only` walk back
+        from the commit that stops as soon as every tracked path has been
+        seen, instead of one history walk per file. Later updates walk only
+        the commits added since the indexed one. The index is rebuilt when
+        the path filters changed or the indexed commit is no longer an
+        ancestor (upstream history was rewritten).
+        
+        Args:
+            commit: Commit to index (defaults to `current_commit`)
+        
+        Returns:
+            Dictionary with the indexed "commit", "commits_read" by this
+            update and "files" mapping upstream path to {"commit", "time",
+            "category"}
+        """
+        if not self.last_modified_path:
+            raise ValueError("Last-modified index is not enabled, add a last_modified block to the config")
+        
+        backend = self._get_backend()
+        tip = backend.resolve(commit or self.config["tracking"]["current_commit"])
+        filter_key = DiffCache.key(*self.path_filter.pathspecs)
+        
+        index = None
+        if self.last_modified_path.exists():
+            with open(self.last_modified_path, 'r') as f:
+                index = json.load(f)
+            if index.get("filter_key") != filter_key:
+                index = None
+        if index and index["commit"] == tip:
+            index["commits_read"] = 0
+            return index
+        
+        head = index["commit"] if index else None
+        if head:
+            try:
+                backend.run("merge-base", "--is-ancestor", head, tip)
+            except Exception:
+                head = None
+        
+        tracked = self.tracked_tree(tip)
+        files = {path: entry for path, entry in index["files"].items() if path in tracked} if head else {}
+        seen = set()
+        commits_read = 0
+        
+        proc = backend.stream(
+            "log", "-z", "--name-only", "--no-renames", "--format=%x01%H%x00%ct",
+            f"{head}..{tip}" if head else tip, "--", *self.path_filter.pathspecs,
+        )
+        finished = False
+        
+        try:
+            for record in _iter_records(proc.stdout, b"\x01"):
+                fields = record.decode('utf-8', errors='ignore').split("\0")
+                if len(fields) < 2:
+                    continue
+                
+                commits_read += 1
+                for path in (field.lstrip("\n") for field in fields[2:]):
+                    if path in tracked and path not in seen:
+                        seen.add(path)
+                        files[path] = {"commit": fields[0], "time": int(fields[1]), "category": tracked[path][1]}
+                
+                # Newest first, so once every path is seen older commits cannot matter
+                if len(seen) == len(tracked):
+                    break
+            else:
+                finished = True
+        finally:
+            proc.stdout.close()
+            if finished:
+                proc.wait()
+            else:
+                _stop_stream(proc)
+        
+        index = {"commit": tip, "filter_key": filter_key, "files": dict(sorted(files.items()))}
+        _write_json_atomic(self.last_modified_path, index)
+        return {**index, "commits_read": commits_read}
+    
+    def refresh_last_modified(self, commit: str) -> None:
+        """
+        Update the last-modified index, if enabled, reporting failures on stderr.
+        
+        Nothing is read from the repository when the stored index already
+        describes the commit. The index only feeds --status, so an error
+        here must not abort a check.
+        """
+        if not self.last_modified_path:
+            return
+        
+        try:
+            index = self.load_last_modified()
+            if index and index["commit"] == commit:
+                return
+            self.update_last_modified(commit)
+        except Exception as e:
+            print(f"Error updating the last-modified index: {e}", file=sys.stderr)
+    
+    def load_last_modified(self) -> Optional[Dict]:
+        """
+        Read the stored last-modified index without touching the repository.
+        
+        Returns:
+            The index written by update_last_modified(), or None when it has
+            not been built yet or was built for different path filters
+        """
+        if not self.last_modified_path or not self.last_modified_path.exists():
+            return None
+        
+        with open(self.last_modified_path, 'r') as f:
+            index = json.load(f)
+        if index.get("filter_key") != DiffCache.key(*self.path_filter.pathspecs):
+            return None
+        
+        return index
+    
+    def print_last_modified(self, limit: Optional[int] = None) -> None:
+        """
+        Print the stalest and freshest tracked upstream files from the stored index.
+        
+        Args:
+            limit: Files to list at each end (defaults to `last_modified.show` or 5)
+        """
+        limit = limit or self.config.get("last_modified", {}).get("show", 5)
+        index = self.load_last_modified()
+        if index is None:
+            print("Last modified: not indexed yet, run --check")
+            return
+        files = sorted(index["files"].items(), key=lambda item: (item[1]["time"], item[0]))
+        
+        def show(entries: List[Tuple[str, Dict]]) -> None:
+            for path, entry in entries:
+                date = datetime.fromtimestamp(entry["time"]).strftime("%Y-%m-%d")
+                print(f"  {date}  {entry['commit'][:8]}  {path}")
+        
+        print(f"Last modified ({len(files)} tracked files at {index['commit'][:8]}):")
+        if index["commit"] != self.config["tracking"]["current_commit"]:
+            print(f" Indexed commit differs from the tracked {self.config['tracking']['current_commit'][:8]}, run --check to refresh")
+        if not files:
+            return
+        print(" Stalest:")
+        show(files[:limit])
+        print(" Freshest:")
+        show(files[::-1][:limit])
+    
+    def get_diff_snapshot(self, from_commit: str, to_commit: str) -> DiffSnapshot:
+        """
+        Get the diff between two commits, computing it at most once per pair.
+        
+        Returns:
+            A DiffSnapshot shared by every consumer of this commit pair
+        """
+        key = (from_commit, to_commit)
+        
+        if key not in self._snapshots:
+            with self.timings.span("tree_diff"):
+                self._snapshots[key] = DiffSnapshot(
+                    self._get_backend(), from_commit, to_commit, self.path_filter, self.cache,
+                    self.max_blob_bytes,
+                )
+        
+        return self._snapshots[key]
+    
+    def get_file_changes(self, from_commit: str, to_commit: str) -> Dict[str, List[str]]:
+        """
+        Get the list of files changed between two commits.
+        
+        Returns:
+            Dictionary with categories of changed files
+        """
+        try:
+            return self.get_diff_snapshot(from_commit, to_commit).by_type()
+            
+        except Exception as e:
+            print(f"Error getting file changes: {e}")
+            return {"modified": [], "added": [], "deleted": [], "renamed": []}
+    
+    def _load_schemas(self, blobs: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Get the DTO schema of each blob, parsing every blob at most once.
+        
+        Schemas are keyed by blob id, so unchanged files are served from
+        memory or the cache and only blobs never seen before are read and
+        parsed.
+        """
+        pending = []
+        for sha in blobs:
+            if sha in self._schemas:
+                continue
+            cached = self.cache.get_json(self.cache.key("schema", sha)) if self.cache else None
+            if cached is not None:
+                self._schemas[sha] = cached["schema"]
+            else:
+                pending.append(sha)
+        
+        if pending:
+            backend = self._get_backend()
+            with self.timings.span("read_blobs"):
+                sources = [backend.read_blob(sha).decode('utf-8', errors='ignore') for sha in pending]
+            with self.timings.span("parse"):
+                schemas = parse_php_schemas(sources)
+            
+            for sha, schema in zip(pending, schemas):
+                self._schemas[sha] = schema
+                if self.cache:
+                    self.cache.put_json(self.cache.key("schema", sha), {"schema": schema})
+        
+        return self._schemas
+    
+    @_timed("schema")
+    def get_schema_changes(self, from_commit: str, to_commit: str) -> List[Dict]:
+        """
+        Compare the DTO schemas of the PHP files changed between two commits.
+        
+        Returns:
+            One entry per file whose schema changed, as returned by
+            diff_schemas() with the file's display path under "path"
+        """
+        snapshot = self.get_diff_snapshot(from_commit, to_commit)
+        summarized = {id(c) for c in snapshot.summarized()}
+        php_changes = [c for c in snapshot if c.path.endswith(".php") and id(c) not in summarized]
+        schemas = self._load_schemas({
+            sha for change in php_changes for sha in (change.a_blob, change.b_blob) if sha
+        })
+        
+        changes = []
+        for change in php_changes:
+            diff = diff_schemas(schemas.get(change.a_blob), schemas.get(change.b_blob))
+            if diff:
+                diff["path"] = change.display_path
+                changes.append(diff)
+        
+        return changes
+    
+    @staticmethod
+    def _write_schema_changes(changes: List[Dict], stream: TextIO, nesting: str = "") -> None:
+        """Write the schema changes section of a diff report."""
+        stream.write(f"{nesting}## Schema Changes ({len(changes)})\n")
+        
+        for change in changes:
+            status = "" if change["status"] == "modified" else f", {change['status']}"
+            stream.write(f"{nesting}### {change['class']} ({change['path']}{status})\n")
+            
+            for name, php_type in change["added"].items():
+                stream.write(f"- added property `${name}: {php_type}`\n")
+            for name, php_type in change["removed"].items():
+                stream.write(f"- removed property `${name}: {php_type}`\n")
+            for name, (old_type, new_type) in change["retyped"].items():
+                stream.write(f"- retyped property `${name}`: `{old_type}` -> `{new_type}`\n")
+            
+            for field, label in (("input_keys", "input key"), ("output_keys", "output key")):
+                for key in change[f"{field}_added"]:
+                    stream.write(f"- added {label} `{key}`\n")
+                for key in change[f"{field}_removed"]:
+                    stream.write(f"- removed {label} `{key}`\n")
+            
+            stream.write("\n")
+    
+    @staticmethod
+    def _write_summarized_files(
+        snapshot: DiffSnapshot, changes: List[FileChange], stream: TextIO, nesting: str = ""
+    ) -> None:
+        """Write the section listing binary and oversized files by size and blob id."""
+        stream.write(f"{nesting}## Binary and Large Files ({len(changes)})\n")
+        
+        for change in changes:
+            kind = "binary" if change.binary else "large"
+            if change.a_blob is None:
+                sizes = f"new, {_format_size(change.b_size)}"
+            elif change.b_blob is None:
+                sizes = f"removed, was {_format_size(change.a_size)}"
+            elif change.a_size is None or change.b_size is None:
+                # Blobs missing from a partial clone have no known size
+                sizes = f"{_format_size(change.a_size)} -> {_format_size(change.b_size)}, change unknown"
+            else:
+                delta = change.b_size - change.a_size
+                sign = "+" if delta >= 0 else "-"
+                sizes = f"{_format_size(change.a_size)} -> {_format_size(change.b_size)}, {sign}{_format_size(abs(delta))}"
+            
+            blobs = " -> ".join(sha[:12] for sha in (change.a_blob, change.b_blob) if sha)
+            stream.write(f"- {change.path} ({kind}): {sizes} (`{blobs}`)\n")
+        
+        stream.write("\n")
+    
+    def _write_report_header(self, from_commit: str, to_commit: str, stream: TextIO, nesting: str = "") -> None:
+        """Write the report title and the range it covers."""
+        stream.write("\n".join([
+            f"{nesting}# Upstream Diff Report",
+            f"Generated: {datetime.now().isoformat()}",
+            f"From commit: {from_commit}",
+            f"To commit: {to_commit}",
+            f"Repository: {self.config['repository']['name']}",
+            "",
+        ]) + "\n")
+    
+    @_timed("report_index")
+    def write_report_index(
+        self,
+        from_commit: str,
+        to_commit: str,
+        stream: TextIO,
+        shard_dir: Optional[Path] = None,
+        heading_level: int = 1,
+    ) -> None:
+        """
+        Write a diffstat-style report index without any patch text.
+        
+        Line counts come from a single `git diff --numstat`, so no patch is
+        generated. Files are listed with their counts and totals are given per
+        category; schema changes and summarized files follow as in the full
+        report.
+        
+        Args:
+            from_commit: Starting commit hash
+            to_commit: Ending commit hash
+            stream: Text stream to write the Markdown index to
+            shard_dir: Directory holding patch shards; files with a shard
+                there get a link to it
+            heading_level: Markdown level of the report title
+        """
+        nesting = "#" * (heading_level - 1)
+        snapshot = self.get_diff_snapshot(from_commit, to_commit)
+        summarized = {id(c) for c in snapshot.summarized()}
+        
+        rows = []
+        categories: Dict[str, List[int]] = {}
+        for change in snapshot:
+            insertions, deletions = (None, None) if id(change) in summarized else snapshot.stats(change)
+            rows.append((change, insertions, deletions))
+            totals = categories.setdefault(change.category or "other", [0, 0, 0])
+            totals[0] += 1
+            totals[1] += insertions or 0
+            totals[2] += deletions or 0
+        
+        self._write_report_header(from_commit, to_commit, stream, nesting)
+        stream.write(f"{nesting}## Summary\n")
+        stream.write(
+            f"Total files changed: {len(snapshot)} "
+            f"(+{sum(t[1] for t in categories.values())} -{sum(t[2] for t in categories.values())})\n\n"
+        )
+        
+        if categories:
+            stream.write(f"{nesting}## Categories\n| Category | Files | + | - |\n|---|---:|---:|---:|\n")
+            for name, (files, insertions, deletions) in sorted(categories.items()):
+                stream.write(f"| {name} | {files} | {insertions} | {deletions} |\n")
+            stream.write("\n")
+            
+            stream.write(f"{nesting}## Files\n| File | Change | + | - |{' Patch |' if shard_dir else ''}\n")
+            stream.write(f"|---|---|---:|---:|{'---|' if shard_dir else ''}\n")
+            for change, insertions, deletions in rows:
+                display_path = change.display_path.replace("|", "\\|")
+                row = (
+                    f"| {display_path} | {CHANGE_TYPE_NAMES.get(change.change_type, change.change_type)} "
+                    f"| {'bin' if insertions is None else insertions} | {'bin' if deletions is None else deletions} |"
+                )
+                if shard_dir:
+                    shard = shard_file_name(change.path)
+                    row += f" [diff]({shard}) |" if (shard_dir / shard).exists() else " |"
+                stream.write(row + "\n")
+            stream.write("\n")
+        
+        if self.config.get("report", {}).get("schema_changes", True):
+            schema_changes = self.get_schema_changes(from_commit, to_commit)
+            if schema_changes:
+                self._write_schema_changes(schema_changes, stream, nesting)
+        
+        if summarized:
+            self._write_summarized_files(snapshot, snapshot.summarized(), stream, nesting)
+    
+    @_timed("patch_shards")
+    def write_patch_shards(
+        self,
+        from_commit: str,
+        to_commit: str,
+        directory: Path,
+        paths: Optional[List[str]] = None,
+    ) -> Dict[str, str]:
+        """
+        Write each changed file's patch to its own file in a directory.
+        
+        Shards are named after the file path (see shard_file_name()). Without
+        paths, every file in the categories listed under
+        `report.shard_categories` gets a shard (all categories when unset);
+        with paths, only those files do and git diffs just their paths.
+        Summarized binary and oversized files never get one.
+        
+        Args:
+            from_commit: Starting commit hash
+            to_commit: Ending commit hash
+            directory: Directory to write the shards to
+            paths: Local or upstream paths of the files to expand
+        
+        Returns:
+            Dictionary mapping upstream path to shard file name
+        """
+        snapshot = self.get_diff_snapshot(from_commit, to_commit)
+        summarized = {id(c) for c in snapshot.summarized()}
+        
+        if paths is not None:
+            wanted_paths = {upstream for path in paths for upstream in self.upstream_paths(path)}
+            selected = [c for c in snapshot if c.a_path in wanted_paths or c.b_path in wanted_paths]
+        else:
+            categories = self.config.get("report", {}).get("shard_categories")
+            selected = [c for c in snapshot if categories is None or c.category in categories]
+        selected = [c for c in selected if id(c) not in summarized]
+        
+        directory.mkdir(parents=True, exist_ok=True)
+        shards: Dict[str, str] = {}
+        current, shard = None, None
+        
+        try:
+            subset = None if len(selected) == len(snapshot) - len(summarized) else selected
+            for change, line in snapshot.iter_patch_lines(subset):
+                if change is not current:
+                    if shard:
+                        shard.close()
+                    current = change
+                    shards[change.path] = shard_file_name(change.path)
+                    shard = open(directory / shards[change.path], 'wb')
+                shard.write(line)
+        finally:
+            if shard:
+                shard.close()
+        
+        return shards
+    
+    def write_sharded_report(
+        self,
+        from_commit: str,
+        to_commit: str,
+        directory: str,
+        paths: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Write patch shards and an `index.md` linking them into a directory.
+        
+        Args:
+            from_commit: Starting commit hash
+            to_commit: Ending commit hash
+            directory: Directory for the index and the shards
+            paths: Only expand these files (see write_patch_shards())
+        """
+        try:
+            directory = Path(directory)
+            shards = self.write_patch_shards(from_commit, to_commit, directory, paths)
+            with open(directory / "index.md", 'w') as f:
+                self.write_report_index(from_commit, to_commit, f, directory)
+            print(f"Report index saved to {directory / 'index.md'} ({len(shards)} patch shard(s) written)")
+            
+        except Exception as e:
+            print(f"Error generating diff report: {e}")
+    
+    @_timed("diff_report")
+    def write_diff_report(
+        self,
+        from_commit: str,
+        to_commit: str,
+        stream: TextIO,
+        max_file_bytes: Optional[int] = None,
+        max_total_bytes: Optional[int] = None,
+        heading_level: int = 1,
+    ) -> None:
+        """
+        Write a detailed diff report between two commits to a text stream.
+        
+        The report is written section by section and patches are copied line
+        by line, so peak memory stays flat however large the range is.
+        
+        Args:
+            from_commit: Starting commit hash
+            to_commit: Ending commit hash
+            stream: Text stream to write the Markdown report to
+            max_file_bytes: Patch bytes to include per file (defaults to config)
+            max_total_bytes: Patch bytes to include overall (defaults to config)
+            heading_level: Markdown level of the report title, for nesting it
+                inside a larger document
+        """
+        limits = self.config.get("report", {})
+        nesting = "#" * (heading_level - 1)
+        if max_file_bytes is None:
+            max_file_bytes = limits.get("max_file_bytes")
+        if max_total_bytes is None:
+            max_total_bytes = limits.get("max_total_bytes")
+        
+        snapshot = self.get_diff_snapshot(from_commit, to_commit)
+        
+        self._write_report_header(from_commit, to_commit, stream, nesting)
+        stream.write(f"{nesting}## Summary\nTotal files changed: {len(snapshot)}\n\n")
+        
+        # Add file changes summary
+        for change_type, files in snapshot.by_type().items():
+            if files:
+                stream.write(f"{nesting}### {change_type.title()} Files ({len(files)})\n")
+                for file in files:
+                    stream.write(f"- {file}\n")
+                stream.write("\n")
+        
+        if limits.get("schema_changes", True):
+            schema_changes = self.get_schema_changes(from_commit, to_commit)
+            if schema_changes:
+                self._write_schema_changes(schema_changes, stream, nesting)
+        
+        summarized = snapshot.summarized()
+        if summarized:
+            self._write_summarized_files(snapshot, summarized, stream, nesting)
+        
+        # Add detailed diff
+        stream.write(f"{nesting}## Detailed Diff\n")
+        stream.write("```diff\n")
+        
+        with self.timings.span("patches"):
+            if self.render_workers > 1:
+                files_started, total_reached = self._write_patches_parallel(
+                    snapshot, stream, max_file_bytes, max_total_bytes
+                )
+            else:
+                files_started, total_reached = self._write_patches(
+                    snapshot, stream, max_file_bytes, max_total_bytes
+                )
+            
+            if total_reached:
+                remaining = len(snapshot) - len(summarized) - files_started + 1
+                stream.write(
+                    f"... [report truncated: total patch limit of {max_total_bytes} bytes reached, "
+                    f"{remaining} file(s) not shown in full]\n"
+                )
+        
+        stream.write("```\n")
+    
+    def _write_patches(
+        self,
+        snapshot: DiffSnapshot,
+        stream: TextIO,
+        max_file_bytes: Optional[int],
+        max_total_bytes: Optional[int],
+    ) -> Tuple[int, bool]:
+        """
+        Copy patch text into the report line by line as it is read.
+        
+        Returns:
+            Tuple of (files_started, total_limit_reached)
+        """
+        current = None
+        files_started = 0
+        file_bytes = 0
+        skipped_bytes = 0
+        total_bytes = 0
+        total_reached = False
+        
+        for change, line in snapshot.iter_patch_lines():
+            if change is not current:
+                if skipped_bytes:
+                    stream.write(self._truncation_marker(current, skipped_bytes, max_file_bytes))
+                current = change
+                files_started += 1
+                file_bytes = 0
+                skipped_bytes = 0
+            
+            if max_file_bytes is not None and file_bytes + len(line) > max_file_bytes:
+                skipped_bytes += len(line)
+                continue
+            
+            if max_total_bytes is not None and total_bytes + len(line) > max_total_bytes:
+                total_reached = True
+                break
+            
+            stream.write(line.decode('utf-8', errors='ignore'))
+            file_bytes += len(line)
+            total_bytes += len(line)
+        
+        if skipped_bytes:
+            stream.write(self._truncation_marker(current, skipped_bytes, max_file_bytes))
+        
+        return files_started, total_reached
+    
+    @staticmethod
+    def _patch_batches(snapshot: DiffSnapshot) -> Iterator[Tuple[List[FileChange], List[List[bytes]]]]:
+        """Group the patch stream into whole files, batched to about RENDER_BATCH_BYTES."""
+        changes: List[FileChange] = []
+        patches: List[List[bytes]] = []
+        batch_bytes = 0
+        
+        for change, line in snapshot.iter_patch_lines():
+            if not changes or change is not changes[-1]:
+                if batch_bytes >= RENDER_BATCH_BYTES:
+                    yield changes, patches
+                    changes, patches, batch_bytes = [], [], 0
+                changes.append(change)
+                patches.append([])
+            patches[-1].append(line)
+            batch_bytes += len(line)
+        
+        if changes:
+            yield changes, patches
+    
+    def _write_patches_parallel(
+        self,
+        snapshot: DiffSnapshot,
+        stream: TextIO,
+        max_file_bytes: Optional[int],
+        max_total_bytes: Optional[int],
+    ) -> Tuple[int, bool]:
+        """
+        Decode patches on a pool of render_workers processes.
+        
+        Whole files are sent to the workers in batches while the patch stream
+        is still being read. Results are written in submission order and the
+        total byte limit is applied here, so the report is byte-identical to
+        _write_patches(). At most two batches per worker are in flight.
+        
+        Returns:
+            Tuple of (files_started, total_limit_reached)
+        """
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        
+        keep_lines = max_total_bytes is not None
+        batches = self._patch_batches(snapshot)
+        pending = deque()
+        files_started = 0
+        total_bytes = 0
+        
+        with ProcessPoolExecutor(max_workers=self.render_workers) as pool:
+            def submit() -> None:
+                batch = next(batches, None)
+                if batch is not None:
+                    changes, patches = batch
+                    pending.append((changes, pool.submit(_render_patches, patches, max_file_bytes, keep_lines)))
+            
+            try:
+                for _ in range(self.render_workers * 2):
+                    submit()
+                
+                while pending:
+                    changes, future = pending.popleft()
+                    rendered = future.result()
+                    submit()
+                    
+                    for change, (text, kept_bytes, skipped_bytes, lines) in zip(changes, rendered):
+                        files_started += 1
+                        
+                        if max_total_bytes is None or total_bytes + kept_bytes <= max_total_bytes:
+                            stream.write(text)
+                            total_bytes += kept_bytes
+                        else:
+                            # The limit falls inside this file: cut it where the serial loop would
+                            skipped_bytes = 0
+                            for length, line in lines:
+                                if line is None:
+                                    skipped_bytes += length
+                                    continue
+                                if total_bytes + length > max_total_bytes:
+                                    if skipped_bytes:
+                                        stream.write(self._truncation_marker(change, skipped_bytes, max_file_bytes))
+                                    return files_started, True
+                                stream.write(line)
+                                total_bytes += length
+                        
+                        if skipped_bytes:
+                            stream.write(self._truncation_marker(change, skipped_bytes, max_file_bytes))
+            finally:
+                for _, future in pending:
+                    future.cancel()
+                batches.close()
+        
+        return files_started, False
+    
+    @staticmethod
+    def _truncation_marker(change: FileChange, skipped_bytes: int, limit: int) -> str:
+        """Build the marker written in place of a truncated file patch."""
+        return (
+            f"... [truncated {change.display_path}: {skipped_bytes} more bytes not shown, "
+            f"per-file limit is {limit} bytes]\n"
+        )
+    
+    @_timed("diff_records", generator=True)
+    def iter_diff_records(
+        self,
+        from_commit: str,
+        to_commit: str,
+        patches: bool = False,
+        max_file_bytes: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        """
+        Describe the changes between two commits as JSON-serializable records.
+        
+        One "file" record is yielded per changed file, followed by a
+        "schema_change" record per changed DTO schema. With patches, file
+        records are yielded as their patch is read from the single streaming
+        `git diff`, so only one file's patch is held in memory at a time.
+        
+        Args:
+            from_commit: Starting commit hash
+            to_commit: Ending commit hash
+            patches: Include each file's patch text
+            max_file_bytes: Patch bytes to include per file (defaults to config)
+        
+        Yields:
+            Records with a "type" key
+        """
+        limits = self.config.get("report", {})
+        if max_file_bytes is None:
+            max_file_bytes = limits.get("max_file_bytes")
+        
+        snapshot = self.get_diff_snapshot(from_commit, to_commit)
+        summarized = {id(c) for c in snapshot.summarized()}
+        
+        def record(change: FileChange, patch: Optional[List[bytes]] = None) -> Dict:
+            insertions, deletions = (None, None) if id(change) in summarized else snapshot.stats(change)
+            entry = {
+                "type": "file",
+                "change_type": CHANGE_TYPE_NAMES.get(change.change_type, change.change_type),
+                "path": change.path,
+                "old_path": change.a_path if change.a_path != change.path else None,
+                "category": change.category,
+                "insertions": insertions,
+                "deletions": deletions,
+                "binary": bool(change.binary),
+                "old_size": change.a_size,
+                "new_size": change.b_size,
+                "old_blob": change.a_blob,
+                "new_blob": change.b_blob,
+            }
+            if patches:
+                text = b"".join(patch or [])
+                entry["patch_truncated"] = max_file_bytes is not None and len(text) > max_file_bytes
+                entry["patch"] = text[:max_file_bytes].decode('utf-8', errors='replace')
+            return entry
+        
+        if patches:
+            written = set()
+            current, lines, size = None, [], 0
+            
+            for change, line in snapshot.iter_patch_lines():
+                if change is not current:
+                    if current is not None:
+                        yield record(current, lines)
+                        written.add(id(current))
+                    current, lines, size = change, [], 0
+                
+                # Keep one line past the limit so truncation can be detected
+                if max_file_bytes is None or size <= max_file_bytes:
+                    lines.append(line)
+                    size += len(line)
+            
+            if current is not None:
+                yield record(current, lines)
+                written.add(id(current))
+            
+            # Summarized files and pure mode changes have no patch
+            for change in snapshot:
+                if id(change) not in written:
+                    yield record(change)
+        else:
+            for change in snapshot:
+                yield record(change)
+        
+        if limits.get("schema_changes", True):
+            for change in self.get_schema_changes(from_commit, to_commit):
+                yield {"type": "schema_change", **change}
+    
+    @_timed("stream_diff_report")
+    def stream_diff_report(
+        self,
+        from_commit: str,
+        to_commit: str,
+        output_file: Optional[str] = None,
+        max_file_bytes: Optional[int] = None,
+        max_total_bytes: Optional[int] = None,
+        stream: Optional[TextIO] = None,
+    ) -> None:
+        """
+        Write a diff report straight to a file or stdout without buffering it.
+        
+        Args:
+            from_commit: Starting commit hash
+            to_commit: Ending commit hash
+            output_file: File to write the report to, or None for stream
+            max_file_bytes: Patch bytes to include per file (defaults to config)
+            max_total_bytes: Patch bytes to include overall (defaults to config)
+            stream: Where the report goes without output_file (defaults to stdout)
+        """
+        try:
+            if output_file:
+                with open(output_file, 'w') as f:
+                    self.write_diff_report(from_commit, to_commit, f, max_file_bytes, max_total_bytes)
+                print(f"Diff report saved to {output_file}")
+            else:
+                stream = stream or sys.stdout
+                self.write_diff_report(from_commit, to_commit, stream, max_file_bytes, max_total_bytes)
+                stream.flush()
+            
+        except Exception as e:
+            print(f"Error generating diff report: {e}")
+    
+    @_timed("generate_diff_report")
+    def generate_diff_report(
+        self,
+        from_commit: str,
+        to_commit: str,
+        output_file: str = None,
+        max_file_bytes: Optional[int] = None,
+        max_total_bytes: Optional[int] = None,
+    ) -> str:
+        """
+        Generate a detailed diff report between two commits.
+        
+        Args:
+            from_commit: Starting commit hash
+            to_commit: Ending commit hash
+            output_file: Optional file to save the report
+            max_file_bytes: Patch bytes to include per file (defaults to config)
+            max_total_bytes: Patch bytes to include overall (defaults to config)
+            
+        Returns:
+            The diff report as a string
+        """
+        try:
+            buffer = io.StringIO()
+            self.write_diff_report(from_commit, to_commit, buffer, max_file_bytes, max_total_bytes)
+            report = buffer.getvalue()
+            
+            # Save to file if requested
+            if output_file:
+                with self.timings.span("write_file"), open(output_file, 'w') as f:
+                    f.write(report)
+                print(f"Diff report saved to {output_file}")
+            
+            return report
+            
+        except Exception as e:
+            error_msg = f"Error generating diff report: {e}"
+            print(error_msg)
+            return error_msg
+    
+    @_timed("ls_tree")
+    def _list_tracked_blobs(self, commit: str) -> Dict[str, Tuple[str, str]]:
+        """
+        List the blob id of every tracked upstream file at a commit.
+        
+        Only tree objects are read; no blob content or patch text is loaded.
+        
+        Returns:
+            Dictionary mapping upstream path to (blob_sha, category)
+        """
+        output = self._get_backend().run("ls-tree", "-r", "-z", "--full-tree", commit, "--", *self.path_filter.prefixes)
+        blobs = {}
+        
+        for record in output.split("\0"):
+            if not record:
+                continue
+            
+            info, path = record.split("\t", 1)
+            _mode, object_type, sha = info.split()
+            if object_type != "blob":
+                continue
+            
+            category = self.path_filter.category(path)
+            if category:
+                blobs[path] = (sha, category)
+        
+        return blobs
+    
+    def tracked_tree(self, commit: str) -> Dict[str, Tuple[str, str]]:
+        """
+        Tracked blobs at a commit, listed at most once per commit.
+        
+        Returns:
+            Dictionary mapping upstream path to (blob_sha, category), shared
+            with later callers
+        """
+        sha = self._get_backend().resolve(commit)
+        if sha not in self._trees:
+            self._trees[sha] = self._list_tracked_blobs(sha)
+        return self._trees[sha]
     
-    def check_for_updates(self) -> Tuple[bool, Optional[str], List[str]]:
+    @_timed("diff_matrix")
+    def diff_matrix(self, base: str, targets: List[str]) -> Dict:
         """
-        Check if there are updates available from upstream.
+        Compare one base commit with several targets from cached tree listings.
+        
+        Each tree is listed once with `git ls-tree` (see tracked_tree()) and
+        every comparison is a dictionary walk over the listings, so no tree
+        diff or patch is computed per pair. A file deleted and added under
+        another path with the same blob id counts as renamed. Refs missing
+        from the clone, such as release tags, are fetched first.
+        
+        Args:
+            base: Commit or tag to compare from, usually last_sync_commit
+            targets: Commits or tags to compare with the base
         
         Returns:
-            Tuple of (has_updates, new_commit_hash, list_of_new_commits)
+            Dictionary with the resolved "base", one "targets" entry per target
+            (ref, sha and counts per change type) and "files" mapping each
+            path changed in any target to its category and its change type
+            per target ref
         """
-        try:
-            repo = self._get_repo()
-            
-            # Fetch latest changes
-            print("Fetching latest changes from upstream...")
-            repo.remotes.origin.fetch()
-            
-            current_commit = self.config["tracking"]["current_commit"]
-            latest_commit = repo.head.commit.hexsha
-            
-            if current_commit == latest_commit:
-                return False, None, []
+        self.fetch_refs([base, *targets])
+        base_tree = self.tracked_tree(base)
+        result = {"base": self._get_backend().resolve(base), "targets": [], "files": {}}
+        
+        for ref in targets:
+            tree = self.tracked_tree(ref)
+            changes = {}
+            for path, (blob, _) in base_tree.items():
+                if path not in tree:
+                    changes[path] = "deleted"
+                elif tree[path][0] != blob:
+                    changes[path] = "modified"
+            for path in tree.keys() - base_tree.keys():
+                changes[path] = "added"
             
-            # Get list of commits between current and latest
-            commits = list(repo.iter_commits(f"{current_commit}..{latest_commit}"))
-            commit_messages = [f"{c.hexsha[:8]} - {c.message.strip()}" for c in commits]
+            deleted_blobs = {base_tree[path][0]: path for path, kind in changes.items() if kind == "deleted"}
+            for path, kind in list(changes.items()):
+                if kind == "added" and tree[path][0] in deleted_blobs:
+                    changes[path] = "renamed"
+                    del changes[deleted_blobs.pop(tree[path][0])]
             
-            return True, latest_commit, commit_messages
+            counts = {name: 0 for name in CHANGE_TYPE_NAMES.values()}
+            for path, kind in changes.items():
+                counts[kind] += 1
+                category = (tree.get(path) or base_tree[path])[1]
+                result["files"].setdefault(path, {"category": category, "changes": {}})["changes"][ref] = kind
             
-        except Exception as e:
-            print(f"Error checking for updates: {e}")
-            return False, None, []
+            result["targets"].append({"ref": ref, "sha": self._get_backend().resolve(ref), "counts": counts})
+        
+        return result
     
-    def get_file_changes(self, from_commit: str, to_commit: str) -> Dict[str, List[str]]:
+    def write_diff_matrix(self, base: str, targets: List[str], stream: TextIO) -> None:
+        """Write the diff matrix as Markdown: totals per target, then a file table per category."""
+        matrix = self.diff_matrix(base, targets)
+        letters = {"added": "A", "modified": "M", "deleted": "D", "renamed": "R"}
+        
+        stream.write("# Upstream Diff Matrix\n")
+        stream.write(f"Base: {base} ({matrix['base'][:8]})\n")
+        stream.write(f"Repository: {self.config['repository']['name']}\n\n")
+        
+        stream.write("| Target | Commit | Changed | Added | Modified | Deleted | Renamed |\n")
+        stream.write("|---|---|---:|---:|---:|---:|---:|\n")
+        for target in matrix["targets"]:
+            counts = target["counts"]
+            stream.write(
+                f"| {target['ref']} | {target['sha'][:8]} | {sum(counts.values())} | {counts['added']} "
+                f"| {counts['modified']} | {counts['deleted']} | {counts['renamed']} |\n"
+            )
+        stream.write("\n")
+        
+        by_category: Dict[str, List[str]] = {}
+        for path, entry in sorted(matrix["files"].items()):
+            by_category.setdefault(entry["category"], []).append(path)
+        
+        for category, paths in sorted(by_category.items()):
+            stream.write(f"## {category} ({len(paths)})\n")
+            stream.write(f"| File | {' | '.join(targets)} |\n|---|{'---|' * len(targets)}\n")
+            for path in paths:
+                changes = matrix["files"][path]["changes"]
+                cells = " | ".join(letters.get(changes.get(ref), "") for ref in targets)
+                stream.write(f"| {path} | {cells} |\n")
+            stream.write("\n")
+        
+        if not matrix["files"]:
+            stream.write("No tracked files differ from the base in any target.\n")
+    
+    def _local_path(self, category: str, upstream_path: str) -> Optional[str]:
         """
-        Get the list of files changed between two commits.
+        Map an upstream path to its local counterpart.
         
-        Returns:
-            Dictionary with categories of changed files
+        Each category may define a `local` map of upstream path prefixes to
+        local prefixes; the longest matching prefix wins, so single renamed
+        files can be listed next to whole directories. Paths without an
+        existing local file are not ported and map to None.
         """
-        repo = self._get_repo()
+        spec = self.config["files"]["categories"].get(category, {})
+        mapping = spec.get("local", {}) if isinstance(spec, dict) else {}
         
-        try:
-            # Get the diff between commits
-            diff = repo.commit(from_commit).diff(repo.commit(to_commit))
-            
-            changes = {
-                "modified": [],
-                "added": [],
-                "deleted": [],
-                "renamed": []
-            }
+        for prefix in sorted(mapping, key=len, reverse=True):
+            if upstream_path.startswith(prefix):
+                local_path = mapping[prefix] + upstream_path[len(prefix):]
+                if (self.config_path.parent / local_path).exists():
+                    return local_path
+                return None
+        
+        return None
+    
+    def _load_manifest(self) -> Dict:
+        """Load the upstream-to-local file manifest."""
+        if not self.manifest_path.exists():
+            raise FileNotFoundError(
+                f"Manifest {self.manifest_path} not found, create it with --build-manifest"
+            )
+        
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+    
+    @_timed("build_manifest")
+    def build_manifest(self, commit: Optional[str] = None) -> Dict:
+        """
+        Record the upstream blob id and local counterpart of every tracked file.
+        
+        Args:
+            commit: Upstream commit to snapshot (defaults to last_sync_commit)
             
-            for item in diff:
-                file_path = item.a_path or item.b_path
-                
-                if item.change_type == 'M':
-                    changes["modified"].append(file_path)
-                elif item.change_type == 'A':
-                    changes["added"].append(file_path)
-                elif item.change_type == 'D':
-                    changes["deleted"].append(file_path)
-                elif item.change_type == 'R':
-                    changes["renamed"].append(f"{item.a_path} -> {item.b_path}")
+        Returns:
+            The manifest that was written
+        """
+        commit = self._get_backend().resolve(commit or self.config["tracking"]["last_sync_commit"])
+        
+        manifest = {
+            "commit": commit,
+            "generated": datetime.now().isoformat(),
+            "files": {
+                path: {
+                    "local": self._local_path(category, path),
+                    "blob": sha,
+                    "category": category,
+                }
+                for path, (sha, category) in sorted(self._list_tracked_blobs(commit).items())
+            },
+        }
+        
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        
+        print(f"Manifest saved to {self.manifest_path} ({len(manifest['files'])} files at {commit[:8]})")
+        return manifest
+    
+    @_timed("check_manifest")
+    def check_manifest(self, to_commit: Optional[str] = None) -> Dict[str, List[Dict]]:
+        """
+        Compare the manifest with the tracked blobs at another commit.
+        
+        Args:
+            to_commit: Upstream commit to compare against (defaults to HEAD)
             
-            return changes
+        Returns:
+            Dictionary with "changed", "deleted" and "added" entries, each
+            carrying upstream path, local path, category and both blob ids
+        """
+        manifest = self._load_manifest()
+        to_commit = to_commit or self.get_current_commit()
+        current = self._list_tracked_blobs(to_commit)
+        
+        changes = {"changed": [], "deleted": [], "added": []}
+        
+        for path, entry in manifest["files"].items():
+            new_blob = current.get(path, (None, None))[0]
+            if new_blob == entry["blob"]:
+                continue
             
-        except Exception as e:
-            print(f"Error getting file changes: {e}")
-            return {"modified": [], "added": [], "deleted": [], "renamed": []}
+            changes["changed" if new_blob else "deleted"].append({
+                "upstream": path,
+                "local": entry["local"],
+                "category": entry["category"],
+                "old_blob": entry["blob"],
+                "new_blob": new_blob,
+            })
+        
+        for path, (sha, category) in sorted(current.items()):
+            if path not in manifest["files"]:
+                changes["added"].append({
+                    "upstream": path,
+                    "local": self._local_path(category, path),
+                    "category": category,
+                    "old_blob": None,
+                    "new_blob": sha,
+                })
+        
+        return changes
     
-    def generate_diff_report(self, from_commit: str, to_commit: str, output_file: str = None) -> str:
+    @_timed("drift")
+    def drift(self, commit: Optional[str] = None, category: Optional[str] = None) -> Dict:
         """
-        Generate a detailed diff report between two commits.
+        Compare every ported file with its upstream source after normalization.
+        
+        Both sides go through normalize_php(), so namespace and import
+        rewrites, comments and formatting do not count as drift. Normalized
+        hashes are cached: local files by mtime and size, upstream files by
+        blob id, and scores by the pair of hashes. A repeat run only reads the
+        files that changed since the last one.
         
         Args:
-            from_commit: Starting commit hash
-            to_commit: Ending commit hash
-            output_file: Optional file to save the report
+            commit: Upstream commit to compare with (defaults to last_sync_commit)
+            category: Only compare files of this category
             
         Returns:
-            The diff report as a string
+            Dictionary with the resolved "commit", the compared "files" (local
+            and upstream path, category and divergence "score", most diverged
+            first) and how many local and upstream files were "hashed" afresh
         """
-        repo = self._get_repo()
+        backend = self._get_backend()
+        commit = backend.resolve(commit or self.config["tracking"]["last_sync_commit"])
+        cache_path = self.config_path.parent / self.config.get("drift", {}).get(
+            "cache_path", f".upstream-drift{self._name_suffix()}.json"
+        )
+        cache = {}
+        if cache_path.exists():
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        if cache.get("version") != DRIFT_CACHE_VERSION:
+            cache = {}
         
-        try:
-            # Get the diff
-            diff = repo.commit(from_commit).diff(repo.commit(to_commit), create_patch=True)
-            
-            report_lines = [
-                f"# Upstream Diff Report",
-                f"Generated: {datetime.now().isoformat()}",
-                f"From commit: {from_commit}",
-                f"To commit: {to_commit}",
-                f"Repository: {self.config['repository']['name']}",
-                "",
-                "## Summary",
-                f"Total files changed: {len(diff)}",
-                ""
-            ]
-            
-            # Add file changes summary
-            changes = self.get_file_changes(from_commit, to_commit)
-            for change_type, files in changes.items():
-                if files:
-                    report_lines.append(f"### {change_type.title()} Files ({len(files)})")
-                    for file in files:
-                        report_lines.append(f"- {file}")
-                    report_lines.append("")
-            
-            # Add detailed diff
-            report_lines.append("## Detailed Diff")
-            report_lines.append("```diff")
-            
-            for item in diff:
-                if item.diff:
-                    report_lines.append(item.diff.decode('utf-8', errors='ignore'))
-            
-            report_lines.append("```")
-            
-            report = "\n".join(report_lines)
+        local_cache, upstream_cache, score_cache = cache.get("local", {}), cache.get("upstream", {}), cache.get("scores", {})
+        seen = {"version": DRIFT_CACHE_VERSION, "local": {}, "upstream": {}, "scores": {}}
+        hashed = {"local": 0, "upstream": 0}
+        # Files modified this recently may change again within the same mtime tick
+        racy_after = time.time_ns() - 2 * 10 ** 9
+        files = []
+        
+        for path, (blob, file_category) in sorted(self._list_tracked_blobs(commit).items()):
+            if category and file_category != category:
+                continue
+            local_path = self._local_path(file_category, path)
+            if not local_path:
+                continue
             
-            # Save to file if requested
-            if output_file:
-                with open(output_file, 'w') as f:
-                    f.write(report)
-                print(f"Diff report saved to {output_file}")
+            local_file = self.config_path.parent / local_path
+            stat = local_file.stat()
+            local_lines = upstream_lines = None
             
-            return report
+            entry = local_cache.get(local_path)
+            if entry and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+                local_hash = entry[2]
+            else:
+                local_lines = normalize_php(local_file.read_text(errors="replace"))
+                local_hash = _normalized_hash(local_lines)
+                hashed["local"] += 1
+            if stat.st_mtime_ns < racy_after:
+                seen["local"][local_path] = [stat.st_mtime_ns, stat.st_size, local_hash]
             
-        except Exception as e:
-            error_msg = f"Error generating diff report: {e}"
-            print(error_msg)
-            return error_msg
+            upstream_hash = upstream_cache.get(blob)
+            if not upstream_hash:
+                upstream_lines = normalize_php(backend.read_blob(blob).decode(errors="replace"))
+                upstream_hash = _normalized_hash(upstream_lines)
+                hashed["upstream"] += 1
+            seen["upstream"][blob] = upstream_hash
+            
+            pair = f"{local_hash}:{upstream_hash}"
+            if local_hash == upstream_hash:
+                score = 0.0
+            elif pair in score_cache:
+                score = score_cache[pair]
+            else:
+                if local_lines is None:
+                    local_lines = normalize_php(local_file.read_text(errors="replace"))
+                if upstream_lines is None:
+                    upstream_lines = normalize_php(backend.read_blob(blob).decode(errors="replace"))
+                score = divergence_score(local_lines, upstream_lines)
+            if score:
+                seen["scores"][pair] = score
+            
+            files.append({"local": local_path, "upstream": path, "category": file_category, "score": score})
+        
+        if seen != cache:
+            _write_json_atomic(cache_path, seen)
+        
+        files.sort(key=lambda entry: (-entry["score"], entry["local"]))
+        return {"commit": commit, "files": files, "hashed": hashed}
+    
+    def print_drift(self, commit: Optional[str] = None, category: Optional[str] = None) -> None:
+        """Print the drift of every ported file, most diverged first."""
+        result = self.drift(commit, category)
+        diverged = [entry for entry in result["files"] if entry["score"]]
+        
+        print(f"Drift against upstream {result['commit'][:8]} (namespaces, imports, comments and whitespace ignored)")
+        if diverged:
+            print("  score  local file")
+            for entry in diverged:
+                renamed = "" if entry["upstream"] == entry["local"] else f"  (upstream {entry['upstream']})"
+                print(f"  {entry['score']:.3f}  {entry['local']}{renamed}")
+        
+        identical = len(result["files"]) - len(diverged)
+        print(f"{len(diverged)} diverged, {identical} identical after normalization")
+        print(f"Rehashed {result['hashed']['local']} local and {result['hashed']['upstream']} upstream files")
     
     def update_tracking(self, new_commit: str) -> None:
-        """Update the tracking information with a new commit."""
-        self.config["tracking"]["current_commit"] = new_commit
-        self.config["tracking"]["last_checked"] = datetime.now().isoformat()
-        self._save_config()
+        """
+        Update the tracking information with a new commit.
+        
+        With a journal the update is appended to it as a sync record;
+        otherwise the tracking block in the config file is rewritten.
+        """
+        if self.journal:
+            state = self.journal.append({
+                "type": "sync",
+                "upstream": self.config["repository"]["name"],
+                "from_commit": self.config["tracking"]["current_commit"],
+                "to_commit": new_commit,
+            })
+            self.config["tracking"]["current_commit"] = new_commit
+            self.config["tracking"]["last_checked"] = state["last_checked"]
+        else:
+            self.config["tracking"]["current_commit"] = new_commit
+            self.config["tracking"]["last_checked"] = datetime.now().isoformat()
+            self._save_config()
         print(f"Updated tracking to commit: {new_commit[:8]}")
     
+    def record_check(self, new_commit: Optional[str], commits: int) -> None:
+        """
+        Append the outcome of an update check to the journal, if enabled.
+        
+        Args:
+            new_commit: Latest upstream commit when updates were found
+            commits: Number of new commits listed
+        """
+        if not self.journal:
+            return
+        
+        current_commit = self.config["tracking"]["current_commit"]
+        self.journal.append({
+            "type": "check",
+            "upstream": self.config["repository"]["name"],
+            "from_commit": current_commit,
+            "to_commit": new_commit or current_commit,
+            "has_updates": new_commit is not None,
+            "commits": commits,
+            "files": len(self.get_diff_snapshot(current_commit, new_commit)) if new_commit else 0,
+            "error": self.check_error,
+            "timings": {
+                "seconds": {path: round(span["seconds"], 4) for path, span in self.timings.spans.items() if "/" not in path},
+                **self.timings.totals,
+            },
+        })
+    
     def status(self) -> None:
         """Display current status information."""
         print("=== Upstream Tracking Status ===")
@@ -207,6 +3770,672 @@ class UpstreamTracker:
         
         if self.config['sync_status']['pending_changes']:
             print(f"Pending changes: {len(self.config['sync_status']['pending_changes'])}")
+        
+        if self.journal:
+            state = self.journal.state(self.config["repository"]["name"]) or {}
+            last_check = state.get("last_check")
+            if last_check and last_check["has_updates"]:
+                print(
+                    f"Last check: updates available at {last_check['to_commit'][:8]} "
+                    f"({last_check['commits']} commit(s), {last_check['files']} file(s))"
+                )
+            elif last_check:
+                print("Last check: up to date")
+            print(f"Last sync: {state.get('last_sync') or 'Never'}")
+        
+        if self.last_modified_path:
+            try:
+                self.print_last_modified()
+            except (OSError, ValueError) as e:
+                print(f"Last modified: unavailable ({e})")
+    
+    def print_history(self, limit: Optional[int] = None) -> None:
+        """Print the journal's check and sync records for this upstream, newest first."""
+        if not self.journal:
+            print("Sync journal is not enabled")
+            return
+        
+        for record in self.journal.history(self.config["repository"]["name"], limit):
+            if record["type"] == "sync":
+                print(f"{record['time']}  sync   {record['from_commit'][:8]} -> {record['to_commit'][:8]}")
+            elif record.get("error"):
+                print(f"{record['time']}  check  failed: {record['error']}")
+            elif record["has_updates"]:
+                print(
+                    f"{record['time']}  check  {record['from_commit'][:8]} -> {record['to_commit'][:8]}: "
+                    f"{record['commits']} commit(s), {record['files']} file(s)"
+                )
+            else:
+                print(f"{record['time']}  check  up to date at {record['from_commit'][:8]}")
+
+
+def _write_report(
+    tracker: UpstreamTracker,
+    args,
+    from_commit: str,
+    to_commit: str,
+    stdout: Optional[TextIO] = None,
+) -> None:
+    """
+    Write the diff report for a range as selected on the command line.
+    
+    Args:
+        stdout: Stream for a report written with --output '-', as yielded by _report_stdout()
+    """
+    if args.shards:
+        tracker.write_sharded_report(from_commit, to_commit, args.shards, args.expand)
+        return
+    
+    output_file = args.output or f"diff-{from_commit[:8]}-to-{to_commit[:8]}.md"
+    
+    if args.summary:
+        if output_file == "-":
+            tracker.write_report_index(from_commit, to_commit, stdout or sys.stdout)
+        else:
+            with open(output_file, 'w') as f:
+                tracker.write_report_index(from_commit, to_commit, f)
+            print(f"Report index saved to {output_file}")
+    elif args.stream or output_file == "-":
+        tracker.stream_diff_report(
+            from_commit, to_commit,
+            None if output_file == "-" else output_file,
+            args.max_file_bytes, args.max_total_bytes,
+            stream=stdout,
+        )
+    else:
+        tracker.generate_diff_report(
+            from_commit, to_commit, output_file,
+            args.max_file_bytes, args.max_total_bytes,
+        )
+
+
+RECORD_SECTIONS = [
+    # (record type, key in the JSON document, whether the key holds a list)
+    ("report", "report", False),
+    ("commit", "commits", True),
+    ("affected", "affected", True),
+    ("file", "files", True),
+    ("schema_change", "schema_changes", True),
+    ("summary", "summary", False),
+]
+
+
+def write_records(records: Iterable[Dict], stream: TextIO, output_format: str = "ndjson") -> Dict[str, int]:
+    """
+    Write report records as NDJSON or as a single JSON document.
+    
+    NDJSON gets one line per record, flushed as soon as it is produced. The
+    JSON document has one key per RECORD_SECTIONS entry and is written
+    incrementally too, so records must arrive grouped in that order; lists
+    without records are written empty. Both end with a "summary" record
+    counting the records of each type.
+    
+    Args:
+        records: Records with a "type" key
+        stream: Text stream to write to
+        output_format: "ndjson" or "json"
+    
+    Returns:
+        Number of records written per type
+    """
+    order = [kind for kind, _, _ in RECORD_SECTIONS]
+    counts: Dict[str, int] = {}
+    section = -1
+    
+    def enter(kind: str) -> None:
+        # Close the open list and write keys up to the section of `kind`
+        nonlocal section
+        target = order.index(kind)
+        _, _, is_list = RECORD_SECTIONS[target]
+        if target < section or (target == section and not is_list):
+            raise ValueError(f"{kind} record out of order after {order[section]} records")
+        
+        if target == section:
+            stream.write(",\n")
+            return
+        if section >= 0 and RECORD_SECTIONS[section][2]:
+            stream.write("]")
+        for i in range(section + 1, target + 1):
+            _, key, listed = RECORD_SECTIONS[i]
+            stream.write(f"{',' if i else ''}\n{json.dumps(key)}: ")
+            if i < target:
+                stream.write("[]" if listed else "null")
+            elif listed:
+                stream.write("[\n")
+        section = target
+    
+    def write(record: Dict) -> None:
+        if output_format == "json":
+            enter(record["type"])
+            stream.write(json.dumps(record))
+        else:
+            stream.write(json.dumps(record) + "\n")
+            stream.flush()
+    
+    if output_format == "json":
+        stream.write("{")
+    
+    for record in records:
+        write(record)
+        counts[record["type"]] = counts.get(record["type"], 0) + 1
+    
+    write({"type": "summary", "counts": dict(counts)})
+    if output_format == "json":
+        stream.write("\n}\n")
+    
+    return counts
+
+
+@contextmanager
+def _records_output(args) -> Iterator[TextIO]:
+    """
+    Open the destination of --format json/ndjson records.
+    
+    Records go to --output, or to stdout when it is unset or '-'; progress
+    messages are moved to stderr meanwhile so stdout carries only records.
+    """
+    if args.output and args.output != "-":
+        with open(args.output, 'w') as f:
+            yield f
+        print(f"Report saved to {args.output}")
+    else:
+        stdout = sys.stdout
+        with redirect_stdout(sys.stderr):
+            yield stdout
+
+
+@contextmanager
+def _report_stdout(args) -> Iterator[Optional[TextIO]]:
+    """
+    Keep stdout for a Markdown report written with --output '-'.
+    
+    Yields the real stdout in that case, with progress messages moved to
+    stderr meanwhile as _records_output does for records, and None when
+    the report goes to a file.
+    """
+    if args.output == "-" and not args.shards:
+        stdout = sys.stdout
+        with redirect_stdout(sys.stderr):
+            yield stdout
+    else:
+        yield None
+
+
+def _report_record(tracker: UpstreamTracker, from_commit: str, to_commit: str, **fields) -> Dict:
+    """The leading record describing what a report covers."""
+    return {
+        "type": "report",
+        "upstream": tracker.config["repository"]["name"],
+        "generated": datetime.now().isoformat(),
+        "from_commit": from_commit,
+        "to_commit": to_commit,
+        **fields,
+    }
+
+
+def _check_records(tracker: UpstreamTracker, args) -> Iterator[Dict]:
+    """Records for --check with a machine-readable --format."""
+    current_commit = tracker.config["tracking"]["current_commit"]
+    has_updates, new_commit, listing = tracker.check_for_updates(args.max_commits, args.since)
+    # Records carry full commits from iter_log() below, so the short listing is not read
+    getattr(listing, "close", lambda: None)()
+    yield _report_record(tracker, current_commit, new_commit or current_commit, has_updates=has_updates)
+    
+    if not has_updates:
+        tracker.record_check(None, 0)
+        return
+    
+    count = 0
+    for commit in tracker.iter_log(current_commit, new_commit, args.max_commits, args.since):
+        yield {"type": "commit", **commit}
+        count += 1
+    
+    if tracker.manifest_path.exists():
+        for change_type, entries in tracker.check_manifest(new_commit).items():
+            for entry in entries:
+                yield {"type": "affected", "change_type": change_type, **entry}
+    
+    yield from tracker.iter_diff_records(current_commit, new_commit, args.patches, args.max_file_bytes)
+    tracker.record_check(new_commit, count)
+
+
+def _diff_records(tracker: UpstreamTracker, args) -> Iterator[Dict]:
+    """Records for --diff with a machine-readable --format."""
+    from_commit, to_commit = args.diff
+    yield _report_record(tracker, from_commit, to_commit)
+    
+    for commit in tracker.iter_log(from_commit, to_commit, args.max_commits, args.since):
+        yield {"type": "commit", **commit}
+    
+    yield from tracker.iter_diff_records(from_commit, to_commit, args.patches, args.max_file_bytes)
+
+
+def _print_manifest_changes(changes: Dict[str, List[Dict]], stream: TextIO = None) -> None:
+    """Print the local files affected by upstream changes."""
+    stream = stream or sys.stdout
+    to_port = [e for entries in changes.values() for e in entries if e["local"]]
+    unported = [(change_type, e) for change_type, entries in changes.items() for e in entries if not e["local"]]
+    
+    print(f"Files to re-port ({len(to_port)}):", file=stream)
+    for entry in to_port:
+        print(f"  {entry['local']} <- {entry['upstream']} [{entry['category']}]", file=stream)
+    
+    if unported:
+        print(f"Upstream files without a local counterpart ({len(unported)}):", file=stream)
+        for change_type, entry in unported:
+            print(f"  {entry['upstream']} [{entry['category']}] ({change_type})", file=stream)
+
+
+def upstream_names(config_path: str) -> List[str]:
+    """List the upstream repositories configured in a config file."""
+    if not Path(config_path).exists():
+        raise FileNotFoundError(f"Configuration file {config_path} not found")
+    
+    with open(config_path, 'r') as f:
+        document = json.load(f)
+    
+    upstreams = document.get("upstreams")
+    if upstreams is None:
+        return [document["repository"]["name"]]
+    return [entry["repository"]["name"] for entry in upstreams]
+
+
+def tracker_overrides(args) -> Dict:
+    """
+    Collect the command-line settings that override the config of every tracker.
+    
+    Returns:
+        Dictionary mapping UpstreamTracker attribute to its value
+    """
+    overrides = {}
+    if args.no_cache:
+        overrides["cache"] = None
+    if args.backend:
+        overrides["backend_name"] = args.backend
+    if args.render_workers:
+        overrides["render_workers"] = args.render_workers
+    if args.max_blob_bytes is not None:
+        overrides["max_blob_bytes"] = args.max_blob_bytes
+    return overrides
+
+
+def _create_tracker(config_path: str, upstream: Optional[str], overrides: Optional[Dict] = None) -> UpstreamTracker:
+    """Create a tracker with command-line overrides applied."""
+    tracker = UpstreamTracker(config_path, upstream)
+    for attribute, value in (overrides or {}).items():
+        setattr(tracker, attribute, value)
+    return tracker
+
+
+def _check_one_upstream(
+    config_path: str,
+    name: str,
+    max_commits: Optional[int],
+    since: Optional[str],
+    max_file_bytes: Optional[int],
+    max_total_bytes: Optional[int],
+    overrides: Optional[Dict] = None,
+) -> Dict:
+    """
+    Check one upstream and render its report section to a temporary file.
+    
+    Runs in a worker thread; git work happens in subprocesses, so several
+    upstreams make progress at the same time. The section is always written
+    section by section to the file, as with --stream.
+    """
+    result = {
+        "name": name,
+        "has_updates": False,
+        "current_commit": None,
+        "new_commit": None,
+        "commits": [],
+        "affected": None,
+        "report_file": None,
+        "error": None,
+        "timings": None,
+    }
+    tracker = None
+    
+    try:
+        tracker = _create_tracker(config_path, name, overrides)
+        result["current_commit"] = tracker.config["tracking"]["current_commit"]
+        has_updates, new_commit, commits = tracker.check_for_updates(max_commits, since)
+        result["new_commit"] = new_commit
+        
+        if has_updates:
+            result["has_updates"] = True
+            result["commits"] = list(commits)
+            
+            if tracker.manifest_path.exists():
+                result["affected"] = tracker.check_manifest(new_commit)
+            
+            with tempfile.NamedTemporaryFile('w', suffix=".md", delete=False) as f:
+                result["report_file"] = f.name
+                tracker.write_diff_report(
+                    result["current_commit"], new_commit, f,
+                    max_file_bytes, max_total_bytes, heading_level=3,
+                )
+        
+        tracker.record_check(new_commit if has_updates else None, len(result["commits"]))
+    
+    except Exception as e:
+        result["error"] = str(e)
+    
+    finally:
+        if tracker:
+            result["timings"] = tracker.timings
+            tracker.close()
+    
+    return result
+
+
+def check_all_upstreams(
+    config_path: str,
+    max_workers: Optional[int] = None,
+    max_commits: Optional[int] = None,
+    since: Optional[str] = None,
+    max_file_bytes: Optional[int] = None,
+    max_total_bytes: Optional[int] = None,
+    overrides: Optional[Dict] = None,
+) -> List[Dict]:
+    """
+    Check every configured upstream concurrently.
+    
+    Upstreams are fetched and diffed on a bounded thread pool, so total wall
+    time approaches that of the slowest upstream rather than the sum.
+    `overrides` (from tracker_overrides()) is applied to every tracker.
+    
+    Returns:
+        One result per upstream, in config order; rendered report sections are
+        left in temporary files named by "report_file"
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    names = upstream_names(config_path)
+    
+    with ThreadPoolExecutor(max_workers=max_workers or min(4, len(names))) as pool:
+        return list(pool.map(
+            lambda name: _check_one_upstream(
+                config_path, name, max_commits, since, max_file_bytes, max_total_bytes, overrides
+            ),
+            names,
+        ))
+
+
+def write_combined_report(results: List[Dict], stream: TextIO) -> None:
+    """Write one Markdown report with a section per upstream."""
+    stream.write("# Upstream Check Report\n")
+    stream.write(f"Generated: {datetime.now().isoformat()}\n")
+    stream.write(f"Upstreams: {len(results)}\n\n")
+    
+    for result in results:
+        stream.write(f"## {result['name']}\n")
+        
+        if result["error"]:
+            stream.write(f"Error: {result['error']}\n\n")
+            continue
+        if not result["has_updates"]:
+            stream.write("Up to date\n\n")
+            continue
+        
+        stream.write(f"Updates available: {result['current_commit'][:8]} -> {result['new_commit'][:8]}\n\n")
+        stream.write(f"### New Commits ({len(result['commits'])})\n")
+        for commit in result["commits"]:
+            stream.write(f"- {commit}\n")
+        stream.write("\n")
+        
+        if result["affected"] is not None:
+            _print_manifest_changes(result["affected"], stream)
+            stream.write("\n")
+        
+        if result["report_file"]:
+            with open(result["report_file"], 'r') as f:
+                shutil.copyfileobj(f, stream)
+            os.unlink(result["report_file"])
+            stream.write("\n")
+
+
+COMMANDS: Dict[str, Callable] = {}
+ALL_UPSTREAM_COMMANDS: Dict[str, Callable] = {}
+
+
+def command(name: str, all_upstreams: bool = False) -> Callable:
+    """
+    Register a CLI command handler.
+    
+    Commands are selected by the argparse destination of their flag and
+    checked in registration order. Handlers receive (tracker, args), or just
+    args when registered for configs listing several upstreams; they import
+    git only through the tracker, so config-only commands start fast.
+    
+    Args:
+        name: Argparse destination of the flag selecting the command
+        all_upstreams: Register the handler run across every upstream
+    """
+    def register(handler: Callable) -> Callable:
+        (ALL_UPSTREAM_COMMANDS if all_upstreams else COMMANDS)[name] = handler
+        return handler
+    return register
+
+
+@command("status")
+def _cmd_status(tracker: UpstreamTracker, args) -> None:
+    tracker.status()
+
+
+@command("check")
+def _cmd_check(tracker: UpstreamTracker, args) -> None:
+    if args.format != "markdown":
+        with _records_output(args) as stream:
+            write_records(_check_records(tracker, args), stream, args.format)
+        return
+    
+    with _report_stdout(args) as stdout:
+        print("Checking for upstream updates...")
+        has_updates, new_commit, commits = tracker.check_for_updates(args.max_commits, args.since)
+        
+        count = 0
+        if has_updates:
+            print(f"✓ Updates available! New commit: {new_commit[:8]}")
+            print("New commits:")
+            for commit in commits:
+                print(f"  {commit}", flush=True)
+                count += 1
+            print(f"Listed {count} new commit(s)")
+            
+            if tracker.manifest_path.exists():
+                print()
+                _print_manifest_changes(tracker.check_manifest(new_commit))
+            
+            # Generate diff report
+            current_commit = tracker.config["tracking"]["current_commit"]
+            print(f"\nGenerating diff report from {current_commit[:8]} to {new_commit[:8]}...")
+            
+            _write_report(tracker, args, current_commit, new_commit, stdout)
+            
+        else:
+            if new_commit:
+                print(f"✓ No tracked files changed upstream (latest commit: {new_commit[:8]})")
+            else:
+                print("✓ Repository is up to date")
+    
+    tracker.record_check(new_commit if has_updates else None, count)
+
+
+@command("diff")
+def _cmd_diff(tracker: UpstreamTracker, args) -> None:
+    if args.format != "markdown":
+        with _records_output(args) as stream:
+            write_records(_diff_records(tracker, args), stream, args.format)
+        return
+    
+    from_commit, to_commit = args.diff
+    with _report_stdout(args) as stdout:
+        print(f"Generating diff from {from_commit} to {to_commit}...")
+        _write_report(tracker, args, from_commit, to_commit, stdout)
+
+
+@command("diff_matrix")
+def _cmd_diff_matrix(tracker: UpstreamTracker, args) -> None:
+    if len(args.diff_matrix) < 2:
+        raise ValueError("--diff-matrix needs a base and at least one target")
+    
+    base, *targets = args.diff_matrix
+    if args.output and args.output != "-":
+        with open(args.output, 'w') as f:
+            tracker.write_diff_matrix(base, targets, f)
+        print(f"Diff matrix saved to {args.output}")
+    else:
+        tracker.write_diff_matrix(base, targets, sys.stdout)
+
+
+@command("update")
+def _cmd_update(tracker: UpstreamTracker, args) -> None:
+    tracker.update_tracking(args.update)
+
+
+@command("clear_cache")
+def _cmd_clear_cache(tracker: UpstreamTracker, args) -> None:
+    if tracker.cache:
+        tracker.cache.clear()
+        print(f"Cleared diff cache at {tracker.cache.path}")
+    else:
+        print("Diff cache is not enabled")
+
+
+@command("build_manifest")
+def _cmd_build_manifest(tracker: UpstreamTracker, args) -> None:
+    tracker.build_manifest(args.build_manifest or None)
+
+
+@command("manifest_check")
+def _cmd_manifest_check(tracker: UpstreamTracker, args) -> None:
+    _print_manifest_changes(tracker.check_manifest(args.manifest_check or None))
+
+
+@command("drift")
+def _cmd_drift(tracker: UpstreamTracker, args) -> None:
+    tracker.print_drift(args.drift or None, args.category)
+
+
+@command("history")
+def _cmd_history(tracker: UpstreamTracker, args) -> None:
+    tracker.print_history(args.history or None)
+
+
+@command("query")
+def _cmd_query(tracker: UpstreamTracker, args) -> None:
+    commits = tracker.query_commits(args.file, args.category, args.since, args.until, args.since_sync)
+    
+    if args.format != "markdown":
+        with _records_output(args) as stream:
+            write_records(({"type": "commit", **commit} for commit in commits), stream, args.format)
+        return
+    
+    for commit in commits:
+        date = datetime.fromtimestamp(commit["time"]).strftime("%Y-%m-%d")
+        print(f"{commit['sha'][:8]} {date} {commit['subject']}")
+        for change in commit["files"]:
+            old_path = f"{change['old_path']} -> " if change["old_path"] else ""
+            print(f"    {change['change_type']:<8} {old_path}{change['path']} [{change['category']}]")
+    print(f"{len(commits)} matching commit(s)")
+
+
+@command("reindex")
+def _cmd_reindex(tracker: UpstreamTracker, args) -> None:
+    if tracker.commit_index:
+        tracker.commit_index.clear()
+    added = tracker.update_commit_index()
+    print(f"Indexed {added} commit(s) in {tracker.commit_index.path}")
+
+
+@command("watch")
+def _cmd_watch(tracker: UpstreamTracker, args) -> None:
+    interval = args.interval or tracker.config.get("watch", {}).get("interval", 300)
+    print(f"Watching {tracker.config['repository']['name']} every {interval}s (Ctrl+C to stop)", file=sys.stderr)
+    
+    def on_change(head: str) -> None:
+        print(f"{datetime.now().isoformat()} upstream head moved to {head[:8]}", file=sys.stderr)
+        _cmd_check(tracker, args)
+    
+    try:
+        tracker.watch(on_change, interval)
+    except KeyboardInterrupt:
+        print("Stopped watching", file=sys.stderr)
+
+
+@command("status", all_upstreams=True)
+def _cmd_status_all(args) -> None:
+    for name in upstream_names(args.config):
+        UpstreamTracker(args.config, name).status()
+        print()
+
+
+@command("check", all_upstreams=True)
+def _cmd_check_all(args) -> None:
+    if args.format != "markdown":
+        raise ValueError(f"--format {args.format} reports one upstream at a time, select one with --upstream")
+    
+    print("Checking all upstreams for updates...")
+    results = check_all_upstreams(
+        args.config, args.jobs, args.max_commits, args.since,
+        args.max_file_bytes, args.max_total_bytes, tracker_overrides(args),
+    )
+    
+    _report_timings({r["name"]: r["timings"] for r in results if r["timings"]}, args)
+    
+    for result in results:
+        if result["error"]:
+            print(f"✗ {result['name']}: {result['error']}")
+        elif result["has_updates"]:
+            print(f"✓ {result['name']}: {len(result['commits'])} new commit(s), now at {result['new_commit'][:8]}")
+        else:
+            print(f"✓ {result['name']}: up to date")
+    
+    if any(result["has_updates"] or result["error"] for result in results):
+        output_file = args.output or f"upstream-report-{datetime.now():%Y%m%d}.md"
+        if output_file == "-":
+            write_combined_report(results, sys.stdout)
+        else:
+            with open(output_file, 'w') as f:
+                write_combined_report(results, f)
+            print(f"Combined report saved to {output_file}")
+
+
+@command("clear_cache", all_upstreams=True)
+def _cmd_clear_cache_all(args) -> None:
+    # The cache is shared, so any upstream's tracker can clear it
+    tracker = UpstreamTracker(args.config, upstream_names(args.config)[0])
+    _cmd_clear_cache(tracker, args)
+
+
+def _report_timings(timings: Dict[str, Timings], args) -> None:
+    """
+    Output the spans recorded while running a command.
+    
+    --timings prints a summary per tracker to stderr; --profile FILE.json
+    writes all spans as Chrome trace events (viewable in chrome://tracing or
+    Perfetto). Other --profile files are written by the cProfile hook in main().
+    """
+    if args.timings:
+        for label, recorded in timings.items():
+            print(f"=== Timings: {label} ===", file=sys.stderr)
+            recorded.write_summary(sys.stderr)
+    
+    if args.profile and args.profile.endswith(".json"):
+        events = [event for recorded in timings.values() for event in recorded.events]
+        with open(args.profile, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Trace written to {args.profile}", file=sys.stderr)
+
+
+def _selected_command(args) -> Optional[str]:
+    """Name of the first registered command whose flag was given."""
+    for name in COMMANDS:
+        value = getattr(args, name)
+        if value is not None and value is not False:
+            return name
+    return None
 
 
 def main():
@@ -215,57 +4444,82 @@ def main():
     
     parser = argparse.ArgumentParser(description="Upstream synchronization tool")
     parser.add_argument("--config", default="upstream.json", help="Configuration file path")
+    parser.add_argument("--upstream", metavar="NAME", help="Upstream to operate on when several are configured")
+    parser.add_argument("--jobs", type=int, help="Upstreams to check in parallel (default: up to 4)")
     parser.add_argument("--check", action="store_true", help="Check for upstream updates")
     parser.add_argument("--status", action="store_true", help="Show current status")
     parser.add_argument("--diff", nargs=2, metavar=("FROM", "TO"), help="Generate diff between commits")
+    parser.add_argument("--diff-matrix", nargs="+", metavar="REF", help="Compare a base ref with several targets: BASE TARGET [TARGET ...]")
     parser.add_argument("--update", metavar="COMMIT", help="Update tracking to specific commit")
-    parser.add_argument("--output", help="Output file for diff report")
+    parser.add_argument("--history", nargs="?", type=int, const=0, metavar="N", help="Show the last N checks and syncs from the journal (default: all)")
+    parser.add_argument("--build-manifest", nargs="?", const="", metavar="COMMIT", help="Record tracked upstream files (defaults to last sync commit)")
+    parser.add_argument("--manifest-check", nargs="?", const="", metavar="COMMIT", help="List local files affected by upstream changes (defaults to HEAD)")
+    parser.add_argument("--drift", nargs="?", const="", metavar="COMMIT", help="Score how far ported files diverge from upstream (defaults to last sync commit)")
+    parser.add_argument("--query", action="store_true", help="List upstream commits from the commit index, filtered by --file, --category, --since, --until or --since-sync")
+    parser.add_argument("--watch", action="store_true", help="Keep running and check whenever the upstream head moves")
+    parser.add_argument("--interval", type=float, metavar="SECONDS", help="Seconds between --watch polls (default: watch.interval or 300)")
+    parser.add_argument("--reindex", action="store_true", help="Rebuild the commit index from the full upstream history")
+    parser.add_argument("--file", metavar="PATH", help="Local or upstream file changed by the commits listed with --query")
+    parser.add_argument("--category", help="File category changed by the commits listed with --query, or compared by --drift")
+    parser.add_argument("--until", help="Only list commits before this date with --query")
+    parser.add_argument("--since-sync", action="store_true", help="Only list commits not yet synced (not reachable from the tracked commit) with --query")
+    parser.add_argument("--max-commits", type=int, help="List at most this many new commits with --check")
+    parser.add_argument("--since", help="Only list new commits after this date with --check or --query")
+    parser.add_argument("--backend", choices=sorted(GIT_BACKENDS), help="Git backend to use (defaults to repository.backend)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk diff cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Remove all cached diff results")
+    parser.add_argument("--output", help="Output file for diff report ('-' for stdout with --stream or json/ndjson)")
+    parser.add_argument("--format", choices=["markdown", "json", "ndjson"], default="markdown", help="Report format for --check and --diff (default: markdown)")
+    parser.add_argument("--patches", action="store_true", help="Include patch text in json/ndjson file records")
+    parser.add_argument("--summary", action="store_true", help="Write only the diffstat index for --check and --diff, without generating patches")
+    parser.add_argument("--shards", metavar="DIR", help="Write a diffstat index.md plus one patch file per changed file into DIR")
+    parser.add_argument("--expand", action="append", metavar="PATH", help="With --shards, only write the patch of this local or upstream file (repeatable)")
+    parser.add_argument("--stream", action="store_true", help="Write the diff report incrementally instead of buffering it")
+    parser.add_argument("--max-file-bytes", type=int, help="Maximum patch bytes to include per file")
+    parser.add_argument("--max-total-bytes", type=int, help="Maximum patch bytes to include in the report")
+    parser.add_argument("--max-blob-bytes", type=int, help="Summarize files larger than this instead of diffing them (0 for no limit)")
+    parser.add_argument("--render-workers", type=int, help="Processes decoding patch text for reports (default: report.render_workers or 1)")
+    parser.add_argument("--timings", action="store_true", help="Print time, git processes, bytes read and memory per phase")
+    parser.add_argument("--profile", metavar="FILE", help="Write a trace-event file (.json) or cProfile stats (any other name)")
     
     args = parser.parse_args()
+    name = _selected_command(args)
+    
+    if name is None:
+        parser.print_help()
+        return
+    
+    profiler = None
+    if args.profile and not args.profile.endswith(".json"):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
     
     try:
-        tracker = UpstreamTracker(args.config)
-        
-        if args.status:
-            tracker.status()
-        
-        elif args.check:
-            print("Checking for upstream updates...")
-            has_updates, new_commit, commits = tracker.check_for_updates()
-            
-            if has_updates:
-                print(f"✓ Updates available! New commit: {new_commit[:8]}")
-                print(f"New commits ({len(commits)}):")
-                for commit in commits:
-                    print(f"  {commit}")
-                
-                # Generate diff report
-                current_commit = tracker.config["tracking"]["current_commit"]
-                print(f"\nGenerating diff report from {current_commit[:8]} to {new_commit[:8]}...")
-                
-                output_file = args.output or f"diff-{current_commit[:8]}-to-{new_commit[:8]}.md"
-                tracker.generate_diff_report(current_commit, new_commit, output_file)
-                
-            else:
-                print("✓ Repository is up to date")
-        
-        elif args.diff:
-            from_commit, to_commit = args.diff
-            print(f"Generating diff from {from_commit} to {to_commit}...")
-            
-            output_file = args.output or f"diff-{from_commit[:8]}-to-{to_commit[:8]}.md"
-            tracker.generate_diff_report(from_commit, to_commit, output_file)
+        if not args.upstream and len(upstream_names(args.config)) > 1:
+            if name not in ALL_UPSTREAM_COMMANDS:
+                raise ValueError(f"Several upstreams are configured, select one with --upstream ({', '.join(upstream_names(args.config))})")
+            ALL_UPSTREAM_COMMANDS[name](args)
+            return
         
-        elif args.update:
-            tracker.update_tracking(args.update)
+        tracker = _create_tracker(args.config, args.upstream, tracker_overrides(args))
         
-        else:
-            parser.print_help()
+        try:
+            COMMANDS[name](tracker, args)
+        finally:
+            _report_timings({tracker.config["repository"]["name"]: tracker.timings}, args)
+            tracker.close()
     
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
+    
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"Profile written to {args.profile}", file=sys.stderr)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Cached git repository fixtures for the upstream script tests.
+
+A fixture is a bare repository used as the remote plus a clone of it, built
+from a known commit graph with a single `git fast-import` process. Committer
+dates are fixed, so the same spec always produces the same commit hashes.
+Each spec is built once per test session into a shared cache directory, and
+every test gets its own copy of the cached repositories to mutate freely.
+
+The cache directory is taken from `UPSTREAM_TEST_FIXTURES`, which
+`run_tests.py` sets for the whole session so worker processes share it.
+Without it, a temporary directory is created and removed at exit.
+
+Usage:
+    upstream = FIXTURES.upstream(SPEC, Path(test_dir))
+    new_commit = upstream.push({"src/DTO/User.php": "<?php // v2\\n"}, "Update User")
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+FIXTURES_ENV = "UPSTREAM_TEST_FIXTURES"
+
+# Committer date of the first commit; every later commit is a minute newer
+BASE_TIMESTAMP = 1700000000
+
+
+@dataclass
+class RepoSpec:
+    """
+    A known commit graph on branch `main`.
+
+    `commits` are (message, files) pairs, oldest first. File contents are
+    text or bytes; a file mapped to None is deleted by that commit. The
+    clone is made after the first `cloned` commits, so the remaining ones
+    are only on the remote until fetched. `tags` maps tag names to commit
+    positions.
+    """
+    name: str
+    commits: List[tuple]
+    cloned: Optional[int] = None
+    tags: Dict[str, int] = field(default_factory=dict)
+
+    def key(self) -> str:
+        """Cache directory name, unique to the spec's contents."""
+        encoded = json.dumps(asdict(self), sort_keys=True, default=lambda content: {"bytes": content.hex()})
+        digest = hashlib.sha1(encoded.encode()).hexdigest()
+        return f"{self.name}-{digest[:12]}"
+
+
+@dataclass
+class UpstreamFixture:
+    """A private copy of a cached fixture."""
+    root: Path
+    remote: Path
+    clone: Path
+    commits: List[str]
+    cloned_commit: str
+    tags: Dict[str, str]
+    next_timestamp: int
+
+    def push(
+        self, files: Dict[str, Optional[str]], message: str, parent: Optional[str] = None, merge: Optional[str] = None,
+    ) -> str:
+        """
+        Add a commit on top of the remote's `main`, as if pushed upstream.
+
+        Args:
+            files: Contents to write, None deleting a file
+            message: Commit message
+            parent: Commit to build on instead of the newest one; `main`
+                is then force-updated, as after an upstream force push
+            merge: Second parent, making the new commit a merge
+
+        Returns:
+            The new commit hash
+        """
+        _fast_import(
+            self.remote, [(message, files)], self.next_timestamp,
+            parent=parent or self.commits[-1], merge=merge, force=parent is not None,
+        )
+        self.next_timestamp += 60
+        self.commits.append(_git(self.remote, "rev-parse", "main"))
+        return self.commits[-1]
+
+
+class GitFixtures:
+    """Builds fixtures once per session and hands out copies."""
+
+    def __init__(self, root: Optional[Path] = None):
+        self._root = Path(root) if root is not None else None
+        if self._root is not None:
+            self._root.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def root(self) -> Path:
+        """The session cache directory, created on first use."""
+        if self._root is None:
+            shared = os.environ.get(FIXTURES_ENV)
+            if shared:
+                self._root = Path(shared)
+                self._root.mkdir(parents=True, exist_ok=True)
+            else:
+                self._root = Path(tempfile.mkdtemp(prefix="upstream-fixtures-"))
+                atexit.register(shutil.rmtree, self._root, ignore_errors=True)
+        return self._root
+
+    def upstream(self, spec: RepoSpec, dest: Path) -> UpstreamFixture:
+        """
+        Copy the fixture for a spec into `dest`, building it if needed.
+
+        Args:
+            spec: The commit graph to provide
+            dest: Directory receiving `remote.git` and `upstream`
+
+        Returns:
+            The copied fixture
+        """
+        template = self.root / spec.key()
+        if not template.exists():
+            self._build(spec, template)
+        with open(template / "fixture.json", 'r') as f:
+            built = json.load(f)
+
+        dest.mkdir(parents=True, exist_ok=True)
+        for name in ("remote.git", "upstream"):
+            shutil.copytree(template / name, dest / name, symlinks=True)
+        # The clone's origin still points at the directory it was built in
+        clone_config = dest / "upstream" / ".git" / "config"
+        text = clone_config.read_text().replace(built["origin"], (dest / "remote.git").as_uri())
+        clone_config.write_text(text)
+
+        return UpstreamFixture(
+            root=dest,
+            remote=dest / "remote.git",
+            clone=dest / "upstream",
+            commits=list(built["commits"]),
+            cloned_commit=built["commits"][built["cloned"] - 1],
+            tags={tag: built["commits"][position] for tag, position in spec.tags.items()},
+            next_timestamp=BASE_TIMESTAMP + 60 * len(built["commits"]),
+        )
+
+    def _build(self, spec: RepoSpec, template: Path) -> None:
+        """Build a spec in a scratch directory and move it into the cache."""
+        scratch = Path(tempfile.mkdtemp(prefix=".build-", dir=self.root))
+        remote = scratch / "remote.git"
+        cloned = spec.cloned if spec.cloned is not None else len(spec.commits)
+
+        _git(scratch, "init", "-q", "--bare", str(remote))
+        _git(remote, "symbolic-ref", "HEAD", "refs/heads/main")
+        _git(remote, "config", "uploadpack.allowFilter", "true")
+        _fast_import(remote, spec.commits[:cloned], BASE_TIMESTAMP)
+        _git(scratch, "clone", "-q", "-b", "main", remote.as_uri(), str(scratch / "upstream"))
+        if cloned < len(spec.commits):
+            parent = _git(remote, "rev-parse", "main")
+            _fast_import(remote, spec.commits[cloned:], BASE_TIMESTAMP + 60 * cloned, parent=parent)
+
+        commits = _git(remote, "rev-list", "--reverse", "main").split()
+        for tag, position in spec.tags.items():
+            _git(remote, "tag", tag, commits[position])
+        with open(scratch / "fixture.json", 'w') as f:
+            json.dump({"commits": commits, "cloned": cloned, "origin": remote.as_uri()}, f)
+
+        try:
+            os.rename(scratch, template)
+        except OSError:
+            # Another worker finished the same spec first
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _git(cwd: Path, *args: str) -> str:
+    """Run a git command and return its stripped output."""
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def _quote(path: str) -> str:
+    """C-quote a path for fast-import when it holds quotes, backslashes or control characters."""
+    if not any(char in path for char in '"\\\t\n'):
+        return path
+    escaped = path.replace("\\", "\\\\").replace('"', '\\"').replace("\t", "\\t").replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+def _fast_import(
+    repo: Path, commits: List[tuple], timestamp: int, parent: Optional[str] = None, merge: Optional[str] = None,
+    force: bool = False,
+) -> None:
+    """Write commits onto `main` with one `git fast-import` process."""
+    args = ["git", "fast-import", "--quiet", "--done", *(["--force"] if force else [])]
+    proc = subprocess.Popen(args, cwd=repo, stdin=subprocess.PIPE)
+
+    def data(payload: bytes) -> None:
+        proc.stdin.write(b"data %d\n" % len(payload) + payload + b"\n")
+
+    for number, (message, files) in enumerate(commits):
+        proc.stdin.write(b"commit refs/heads/main\n")
+        proc.stdin.write(b"committer Test <test@example.com> %d +0000\n" % (timestamp + number * 60))
+        data(message.encode())
+        if number == 0 and parent:
+            proc.stdin.write(f"from {parent}\n".encode())
+        if number == 0 and merge:
+            proc.stdin.write(f"merge {merge}\n".encode())
+        for path, content in files.items():
+            path = _quote(path)
+            if content is None:
+                proc.stdin.write(f"D {path}\n".encode())
+                continue
+            proc.stdin.write(f"M 100644 inline {path}\n".encode())
+            data(content if isinstance(content, bytes) else content.encode())
+
+    proc.stdin.write(b"done\n")
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError(f"git fast-import failed in {repo}")
+
+
+FIXTURES = GitFixtures()
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Coverage of real Telegram webhook payloads by the PHP DTOs.
+
+Derives the keys every DTO reads from its PHP source (`fromArray()` and the
+constructor, as parsed by check-upstream.py) and which DTO handles each
+nested object, then streams archived updates and counts every key the DTOs
+would silently drop, with the number of updates it appears in and sample
+JSON paths. Archives are read line by line (NDJSON, optionally gzipped), so
+memory use does not depend on their size; parsing and walking the updates is
+spread over a process pool.
+
+With --upstream, the upstream DTO sources at a commit are parsed as well and
+each dropped key is marked when the upstream class already reads it, so the
+DTOs whose upstream changes would recover the most data can be ported first.
+
+Usage:
+    python scripts/payload-coverage.py archive/updates-*.ndjson.gz
+    python scripts/payload-coverage.py examples/api-samples/*.json --format json
+    python scripts/payload-coverage.py updates.ndjson --jobs 8 --upstream v1.59.0
+"""
+
+import gzip
+import json
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+
+from script_loader import load_script
+
+check_upstream = load_script("check-upstream.py")
+
+
+DEFAULT_SRC = Path(__file__).resolve().parent.parent / "src" / "DTO"
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_SAMPLES = 3
+
+_QUOTED_KEY = r"""\[\s*['"](\w+)['"]\s*\]"""
+# User::fromArray($data['from'])
+_DIRECT = re.compile(rf"(\w+)::fromArray\(\s*\$data\s*{_QUOTED_KEY}\s*\)")
+# array_map(fn ($item) => Photo::fromArray($item), $data['photo'])
+_MAPPED = re.compile(rf"(\w+)::fromArray\(\s*\$\w+\s*\)\s*,\s*\$data\s*{_QUOTED_KEY}")
+# $chatData = Validator::getValue($data, 'chat', ...) or $chatData = $data['chat']
+_ASSIGNED = re.compile(
+    r"""\$(\w+)\s*=\s*(?:Validator::getValue\(\s*\$data\s*,\s*(['"])(\w+)\2|\$data\s*\[\s*(['"])(\w+)\4\s*\])"""
+)
+# Chat::fromArray($chatData) or array_map(fn ($item) => Option::fromArray($item), $optionsData)
+_FROM_VARIABLE = re.compile(r"(\w+)::fromArray\(\s*\$(\w+)\s*\)(?:\s*,\s*\$(\w+))?")
+
+
+def nested_types(source: str, class_name: str) -> Dict[str, str]:
+    """
+    Map the input keys of a DTO to the DTO class that parses their value.
+
+    Recognizes `Class::fromArray($data['key'])`, the same call on a variable
+    assigned from `$data['key']` or `Validator::getValue($data, 'key')`, and
+    `array_map()` over such a value. `self` and `static` stand for the class
+    itself.
+
+    Returns:
+        Dictionary mapping input key to class name
+    """
+    nested = {}
+    variables = {}
+    for match in _ASSIGNED.finditer(source):
+        variables[match.group(1)] = match.group(3) or match.group(5)
+
+    for match in _DIRECT.finditer(source):
+        nested[match.group(2)] = match.group(1)
+    for match in _MAPPED.finditer(source):
+        nested[match.group(2)] = match.group(1)
+    for match in _FROM_VARIABLE.finditer(source):
+        variable = match.group(3) or match.group(2)
+        if variable in variables:
+            nested.setdefault(variables[variable], match.group(1))
+
+    return {key: class_name if cls in ("self", "static") else cls for key, cls in nested.items()}
+
+
+def parse_dto(source: str, file_name: str) -> Optional[Tuple[str, Dict]]:
+    """
+    Derive the expected keys of one DTO source.
+
+    Returns:
+        Tuple of (class name, {"keys", "nested", "file"}), or None if the
+        source defines no class
+    """
+    schema = check_upstream.parse_php_schema(source)
+    if not schema:
+        return None
+    return schema["class"], {
+        "keys": set(schema["input_keys"]),
+        "nested": nested_types(source, schema["class"]),
+        "file": file_name,
+    }
+
+
+def load_dto_schemas(directory: Path) -> Dict[str, Dict]:
+    """Parse every DTO in a directory of PHP sources."""
+    schemas = {}
+    for path in sorted(directory.glob("*.php")):
+        parsed = parse_dto(path.read_text(errors="replace"), os.path.relpath(path))
+        if parsed:
+            schemas[parsed[0]] = parsed[1]
+    return schemas
+
+
+def load_upstream_schemas(config_path: str, ref: str) -> Dict[str, Dict]:
+    """
+    Parse the upstream DTO sources at a commit, without checking them out.
+
+    Tracked PHP files are listed with one `git ls-tree` and read through
+    the tracker's git backend.
+    """
+    tracker = check_upstream.UpstreamTracker(config_path)
+    try:
+        backend = tracker._get_backend()
+        schemas = {}
+        for path, (blob, _category) in sorted(tracker.tracked_tree(ref).items()):
+            if path.endswith(".php"):
+                parsed = parse_dto(backend.read_blob(blob).decode(errors="replace"), path)
+                if parsed:
+                    schemas[parsed[0]] = parsed[1]
+        return schemas
+    finally:
+        tracker.close()
+
+
+def iter_updates(path: Path) -> Iterator[bytes]:
+    """
+    Stream the raw JSON updates of an archive.
+
+    `.json` files hold a single update or a list of them and are read whole;
+    anything else is NDJSON, one update per line, read line by line.
+    Gzipped files (`.gz`) are decompressed on the fly.
+    """
+    opener = gzip.open if path.suffix == ".gz" else open
+    name = path.name[:-3] if path.suffix == ".gz" else path.name
+
+    with opener(path, 'rb') as f:
+        if name.endswith(".json"):
+            data = json.load(f)
+            for update in data if isinstance(data, list) else [data]:
+                yield json.dumps(update).encode()
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+_worker_state: Dict = {}
+
+
+def _init_worker(schemas: Dict[str, Dict], root: str, upstream: Optional[Dict[str, Dict]], samples: int) -> None:
+    """Give a worker process the schemas once instead of with every batch."""
+    _worker_state.update(schemas=schemas, root=root, upstream=upstream or {}, samples=samples)
+
+
+def _walk(value: Dict, cls: str, path: str, schemas: Dict[str, Dict], found: Dict[Tuple[str, str], str]) -> None:
+    """Record the first path of every key a DTO would drop from one update."""
+    schema = schemas.get(cls)
+    if schema is None:
+        return
+
+    for key, child in value.items():
+        child_path = f"{path}.{key}" if path else key
+        if key not in schema["keys"]:
+            found.setdefault((cls, key), child_path)
+            continue
+
+        nested = schema["nested"].get(key)
+        if nested is None:
+            continue
+        if isinstance(child, dict):
+            _walk(child, nested, child_path, schemas, found)
+        elif isinstance(child, list):
+            for item in child:
+                if isinstance(item, dict):
+                    _walk(item, nested, child_path + "[]", schemas, found)
+
+
+def analyze_batch(lines: List[bytes]) -> Dict:
+    """
+    Count the dropped keys in a batch of raw updates.
+
+    Every key is counted once per update it appears in. Runs in a worker
+    process set up by _init_worker() (or in-process after calling it).
+
+    Returns:
+        Partial result with "updates", "invalid", "keys" mapping (dto, key)
+        to [updates, sample paths], and per DTO the updates "affected" by a
+        dropped key and those "recoverable" by porting the upstream class
+    """
+    schemas = _worker_state["schemas"]
+    upstream = _worker_state["upstream"]
+    max_samples = _worker_state["samples"]
+    result = {"updates": 0, "invalid": 0, "keys": {}, "affected": Counter(), "recoverable": Counter()}
+
+    for line in lines:
+        try:
+            update = json.loads(line)
+        except ValueError:
+            result["invalid"] += 1
+            continue
+        if not isinstance(update, dict):
+            result["invalid"] += 1
+            continue
+
+        result["updates"] += 1
+        found: Dict[Tuple[str, str], str] = {}
+        _walk(update, _worker_state["root"], "", schemas, found)
+
+        recoverable: Set[str] = set()
+        for (cls, key), path in found.items():
+            entry = result["keys"].setdefault((cls, key), [0, []])
+            entry[0] += 1
+            if len(entry[1]) < max_samples and path not in entry[1]:
+                entry[1].append(path)
+            if key in upstream.get(cls, {}).get("keys", ()):
+                recoverable.add(cls)
+
+        result["affected"].update({cls for cls, _ in found})
+        result["recoverable"].update(recoverable)
+
+    return result
+
+
+def _merge(total: Dict, part: Dict, max_samples: int) -> None:
+    """Add a batch result into the running total."""
+    total["updates"] += part["updates"]
+    total["invalid"] += part["invalid"]
+    total["affected"].update(part["affected"])
+    total["recoverable"].update(part["recoverable"])
+    for key, (count, samples) in part["keys"].items():
+        entry = total["keys"].setdefault(key, [0, []])
+        entry[0] += count
+        for sample in samples:
+            if len(entry[1]) < max_samples and sample not in entry[1]:
+                entry[1].append(sample)
+
+
+def _batches(paths: Iterable[Path], size: int) -> Iterator[List[bytes]]:
+    """Group the updates of every archive into batches."""
+    batch = []
+    for path in paths:
+        for line in iter_updates(path):
+            batch.append(line)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def check_coverage(
+    paths: List[Path],
+    schemas: Dict[str, Dict],
+    root: str = "TelegramUpdate",
+    jobs: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    samples: int = DEFAULT_SAMPLES,
+    upstream: Optional[Dict[str, Dict]] = None,
+) -> Dict:
+    """
+    Stream archives through the DTO schemas and collect the dropped keys.
+
+    Batches of updates are handed to a process pool with at most two
+    batches per worker in flight, so reading never runs far ahead of the
+    workers and memory stays bounded.
+
+    Args:
+        paths: Archives to read
+        schemas: DTO schemas from load_dto_schemas()
+        root: DTO class every update is parsed with
+        jobs: Worker processes (1 runs in this process)
+        batch_size: Updates per batch handed to a worker
+        samples: Sample paths kept per dropped key
+        upstream: Upstream DTO schemas, to mark keys the upstream class reads
+
+    Returns:
+        Dictionary with "updates", "invalid", "keys" (one entry per dropped
+        key, most frequent first) and "dtos" (one entry per DTO dropping
+        keys, most updates recoverable from upstream first, then most
+        updates affected)
+    """
+    if root not in schemas:
+        raise ValueError(f"Root DTO {root} not found in the parsed sources")
+
+    total = {"updates": 0, "invalid": 0, "keys": {}, "affected": Counter(), "recoverable": Counter()}
+    init_args = (schemas, root, upstream, samples)
+
+    if jobs <= 1:
+        _init_worker(*init_args)
+        for batch in _batches(paths, batch_size):
+            _merge(total, analyze_batch(batch), samples)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=init_args) as pool:
+            pending = []
+            for batch in _batches(paths, batch_size):
+                pending.append(pool.submit(analyze_batch, batch))
+                if len(pending) >= jobs * 2:
+                    _merge(total, pending.pop(0).result(), samples)
+            for future in pending:
+                _merge(total, future.result(), samples)
+
+    upstream = upstream or {}
+    keys = [
+        {
+            "dto": cls,
+            "key": key,
+            "updates": count,
+            "share": count / total["updates"] if total["updates"] else 0.0,
+            "samples": sample_paths,
+            "upstream_reads": key in upstream.get(cls, {}).get("keys", ()) if upstream else None,
+        }
+        for (cls, key), (count, sample_paths) in total["keys"].items()
+    ]
+    keys.sort(key=lambda entry: (-entry["updates"], entry["dto"], entry["key"]))
+
+    dtos = [
+        {
+            "dto": cls,
+            "file": schemas[cls]["file"],
+            "keys": sum(1 for entry in keys if entry["dto"] == cls),
+            "updates_affected": affected,
+            "updates_recoverable": total["recoverable"][cls] if upstream else None,
+        }
+        for cls, affected in total["affected"].items()
+    ]
+    dtos.sort(key=lambda entry: (-(entry["updates_recoverable"] or 0), -entry["updates_affected"], entry["dto"]))
+
+    return {"updates": total["updates"], "invalid": total["invalid"], "keys": keys, "dtos": dtos}
+
+
+def write_report(result: Dict, stream: TextIO) -> None:
+    """Write the coverage result as Markdown."""
+    upstream = any(entry["upstream_reads"] is not None for entry in result["keys"])
+
+    stream.write("# Payload Coverage\n")
+    stream.write(f"Updates: {result['updates']}")
+    stream.write(f" ({result['invalid']} invalid skipped)\n" if result["invalid"] else "\n")
+    stream.write(f"Dropped keys: {len(result['keys'])} in {len(result['dtos'])} DTO(s)\n\n")
+
+    if not result["keys"]:
+        stream.write("Every key in every update is read by a DTO.\n")
+        return
+
+    stream.write("## By DTO\n")
+    stream.write(f"| DTO | Source | Keys | Updates affected |{' Recoverable from upstream |' if upstream else ''}\n")
+    stream.write(f"|---|---|---:|---:|{'---:|' if upstream else ''}\n")
+    for entry in result["dtos"]:
+        row = f"| {entry['dto']} | {entry['file']} | {entry['keys']} | {entry['updates_affected']} |"
+        if upstream:
+            row += f" {entry['updates_recoverable']} |"
+        stream.write(row + "\n")
+    stream.write("\n")
+
+    stream.write("## Dropped Keys\n")
+    stream.write(f"| DTO | Key | Updates | Share |{' Upstream reads |' if upstream else ''} Sample paths |\n")
+    stream.write(f"|---|---|---:|---:|{'---|' if upstream else ''}---|\n")
+    for entry in result["keys"]:
+        row = f"| {entry['dto']} | {entry['key']} | {entry['updates']} | {entry['share']:.1%} |"
+        if upstream:
+            row += f" {'yes' if entry['upstream_reads'] else 'no'} |"
+        samples = ", ".join(f"`{sample}`" for sample in entry["samples"])
+        stream.write(f"{row} {samples} |\n")
+
+
+def main():
+    """Main entry point for the payload coverage checker."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report JSON keys of Telegram updates that the DTOs drop")
+    parser.add_argument("archives", nargs="+", type=Path, help="NDJSON (.ndjson, .jsonl), JSON (.json) or gzipped update archives")
+    parser.add_argument("--src", type=Path, default=DEFAULT_SRC, help=f"Directory of the DTO sources (default: {DEFAULT_SRC})")
+    parser.add_argument("--root", default="TelegramUpdate", help="DTO class parsing each update (default: TelegramUpdate)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Updates per batch handed to a worker")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES, help="Sample paths to keep per dropped key")
+    parser.add_argument("--upstream", nargs="?", const="HEAD", metavar="REF", help="Mark keys read by the upstream DTOs at REF (default: HEAD)")
+    parser.add_argument("--config", default="upstream.json", help="Configuration file locating the upstream clone, for --upstream")
+    parser.add_argument("--format", choices=["markdown", "json"], default="markdown", help="Output format (default: markdown)")
+    parser.add_argument("--output", help="Write the report to this file instead of stdout")
+
+    args = parser.parse_args()
+
+    try:
+        schemas = load_dto_schemas(args.src)
+        upstream = load_upstream_schemas(args.config, args.upstream) if args.upstream else None
+        result = check_coverage(
+            args.archives, schemas, args.root, args.jobs, args.batch_size, args.samples, upstream
+        )
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    stream = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump(result, stream, indent=2)
+            stream.write("\n")
+        else:
+            write_report(result, stream)
+    finally:
+        if args.output:
+            stream.close()
+            print(f"Report saved to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
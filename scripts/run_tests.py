@@ -5,38 +5,156 @@ Test runner for upstream tracking scripts.
 Usage:
     python scripts/run_tests.py
     python scripts/run_tests.py -v  # verbose output
+    python scripts/run_tests.py -j 4  # shard test classes across 4 processes
 """
 
+import argparse
+import io
+import shutil
 import sys
+import tempfile
+import time
 import unittest
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
 
 # Add the scripts directory to the path
 sys.path.insert(0, os.path.dirname(__file__))
 
-def run_tests(verbosity=1):
+from git_fixtures import FIXTURES_ENV
+
+
+def _iter_tests(suite):
+    """Flatten a discovered suite into its test cases."""
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _iter_tests(test)
+        else:
+            yield test
+
+
+def shard_by_class(suite: unittest.TestSuite) -> Tuple[List[List[str]], List[List[str]]]:
+    """
+    Group a suite's tests by test class.
+    
+    Classes stay whole so that class-level fixtures are set up once per class.
+    Load failures (such as a module that cannot be imported) come out as their
+    own shard and are reported like any other error. Classes that set
+    `run_serially = True`, such as those asserting wall-clock budgets, are
+    kept apart so they never compete with other shards for the CPU.
+    
+    Returns:
+        (parallel shards, serial shards), each a list of test id lists in
+        discovery order
+    """
+    shards: Dict[type, List[str]] = {}
+    for test in _iter_tests(suite):
+        shards.setdefault(type(test), []).append(test.id())
+    parallel = [ids for cls, ids in shards.items() if not getattr(cls, "run_serially", False)]
+    serial = [ids for cls, ids in shards.items() if getattr(cls, "run_serially", False)]
+    return parallel, serial
+
+
+def _run_shard(test_ids: List[str], verbosity: int) -> Dict:
+    """Run one shard in a worker process and return its outcome."""
+    stream = io.StringIO()
+    suite = unittest.TestLoader().loadTestsFromNames(test_ids)
+    result = unittest.TextTestResult(unittest.runner._WritelnDecorator(stream), True, verbosity)
+    suite.run(result)
+    result.printErrors()
+    return {
+        "output": stream.getvalue(),
+        "run": result.testsRun,
+        "failures": len(result.failures),
+        "errors": len(result.errors),
+        "skipped": len(result.skipped),
+        "success": result.wasSuccessful(),
+    }
+
+
+def run_parallel(suite: unittest.TestSuite, jobs: int, verbosity: int = 1, stream=sys.stderr) -> bool:
+    """
+    Run a suite with its test classes sharded across worker processes.
+    
+    Shards are handed out one class at a time, so a slow class does not hold
+    back a whole precomputed batch. Each shard's progress and error report is
+    written as one block when it finishes. Serial shards run in this process
+    once the workers are done.
+    
+    Args:
+        suite: The discovered tests
+        jobs: Number of worker processes
+        verbosity: unittest verbosity
+        stream: Where results are written
+    
+    Returns:
+        True if every test passed
+    """
+    start = time.perf_counter()
+    totals = {"run": 0, "failures": 0, "errors": 0, "skipped": 0}
+    success = True
+    
+    parallel, serial = shard_by_class(suite)
+    
+    def collect(outcome: Dict) -> None:
+        nonlocal success
+        stream.write(outcome["output"])
+        for key in totals:
+            totals[key] += outcome[key]
+        success = success and outcome["success"]
+    
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_run_shard, test_ids, verbosity) for test_ids in parallel]
+        for future in as_completed(futures):
+            collect(future.result())
+    for test_ids in serial:
+        collect(_run_shard(test_ids, verbosity))
+    
+    elapsed = time.perf_counter() - start
+    stream.write("\n" + "-" * 70 + "\n")
+    stream.write(f"Ran {totals['run']} tests in {elapsed:.3f}s ({jobs} workers)\n\n")
+    details = [f"{key}={totals[key]}" for key in ("failures", "errors", "skipped") if totals[key]]
+    status = "OK" if success else "FAILED"
+    stream.write(f"{status} ({', '.join(details)})\n" if details else f"{status}\n")
+    return success
+
+
+def run_tests(verbosity=1, jobs=1):
     """Run all tests for the upstream tracking functionality."""
     # Discover and run tests
     loader = unittest.TestLoader()
     start_dir = os.path.dirname(__file__)
     suite = loader.discover(start_dir, pattern='test_*.py')
     
-    runner = unittest.TextTestRunner(verbosity=verbosity)
-    result = runner.run(suite)
+    # One fixture cache for the whole session, shared by the workers
+    fixtures_dir = tempfile.mkdtemp(prefix="upstream-fixtures-")
+    os.environ[FIXTURES_ENV] = fixtures_dir
+    try:
+        if jobs > 1:
+            success = run_parallel(suite, jobs, verbosity)
+        else:
+            runner = unittest.TextTestRunner(verbosity=verbosity)
+            success = runner.run(suite).wasSuccessful()
+    finally:
+        shutil.rmtree(fixtures_dir, ignore_errors=True)
     
     # Return exit code based on test results
-    return 0 if result.wasSuccessful() else 1
+    return 0 if success else 1
 
 if __name__ == '__main__':
-    # Check for verbose flag
-    verbosity = 2 if '-v' in sys.argv or '--verbose' in sys.argv else 1
+    parser = argparse.ArgumentParser(description="Run the upstream tracking tests")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes to shard test classes across (default: CPU count)")
+    args = parser.parse_args()
     
     print("Running upstream tracking tests...")
-    exit_code = run_tests(verbosity)
+    exit_code = run_tests(2 if args.verbose else 1, max(1, args.jobs))
     
     if exit_code == 0:
         print("\n[PASS] All tests passed!")
     else:
         print("\n[FAIL] Some tests failed!")
     
-    sys.exit(exit_code)
\ No newline at end of file
+    sys.exit(exit_code)
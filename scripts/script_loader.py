@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Import the hyphenated scripts in this directory as modules.
+
+File names like `check-upstream.py` are not valid module names, so the
+scripts that build on each other, and their tests, load them by path. Each
+script is loaded once per process and registered in sys.modules under its
+underscored name, so worker processes can unpickle its functions.
+
+Usage:
+    from script_loader import load_script
+    check_upstream = load_script("check-upstream.py")
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+from types import ModuleType
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+
+def load_script(file_name: str) -> ModuleType:
+    """
+    Load a script from this directory, reusing it if already loaded.
+
+    Args:
+        file_name: Script file name, e.g. "check-upstream.py"
+
+    Returns:
+        The module, registered as e.g. "check_upstream"
+    """
+    name = Path(file_name).stem.replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS_DIR / file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
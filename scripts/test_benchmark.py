@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the upstream benchmark harness.
+
+Run with: python -m unittest scripts.test_benchmark
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from script_loader import load_script
+
+benchmark_upstream = load_script("benchmark-upstream.py")
+RepoShape = benchmark_upstream.RepoShape
+
+
+TINY_SHAPE = RepoShape("tiny", commits=4, files=5, file_size=512, changed_per_commit=2, binary_files=1, binary_size=1024)
+
+
+class TestBenchmarkHarness(unittest.TestCase):
+    """Test cases for the repository generator and result comparison."""
+
+    def setUp(self):
+        """Create a temporary directory for generated repositories."""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up generated repositories."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_generate_repo(self):
+        """Test that the generated history matches the requested shape."""
+        path = Path(self.test_dir) / "remote.git"
+        commits = benchmark_upstream.generate_repo(path, TINY_SHAPE)
+
+        self.assertEqual(len(commits), 4)
+        files = subprocess.run(
+            ["git", "ls-tree", "-r", "--name-only", "main"], cwd=path, check=True, capture_output=True, text=True
+        ).stdout.split()
+        self.assertEqual(len(files), 6)
+        self.assertIn("resources/blobs/blob0.bin", files)
+
+        changed = subprocess.run(
+            ["git", "diff", "--name-only", commits[0], commits[1]], cwd=path, check=True, capture_output=True, text=True
+        ).stdout.split()
+        self.assertEqual(len(changed), 2)
+
+        # The same shape always produces the same history
+        again = benchmark_upstream.generate_repo(Path(self.test_dir) / "again.git", TINY_SHAPE)
+        self.assertEqual(commits, again)
+
+    def test_run_benchmarks(self):
+        """Test timing every operation for a shape."""
+        with redirect_stderr(io.StringIO()):
+            results = benchmark_upstream.run_benchmarks([TINY_SHAPE], ["native"], repeat=2, workdir=Path(self.test_dir))
+
+        self.assertEqual(
+            [entry["operation"] for entry in results["results"]],
+            ["check_for_updates", "get_file_changes", "generate_diff_report"],
+        )
+        for entry in results["results"]:
+            self.assertEqual(len(entry["runs"]), 2)
+            self.assertEqual(entry["min"], min(entry["runs"]))
+            self.assertGreater(entry["counters"]["processes"], 0)
+
+        report = results["results"][2]
+        self.assertIn("generate_diff_report/diff_report/patches", report["spans"])
+        self.assertGreater(report["counters"]["bytes_read"], 0)
+        self.assertEqual(results["shapes"][0]["name"], "tiny")
+
+    def test_compare_results(self):
+        """Test that only slowdowns beyond both thresholds are regressions."""
+        def results(**times):
+            return {"results": [
+                {"shape": "small", "backend": "native", "operation": op, "min": t} for op, t in times.items()
+            ]}
+
+        baseline = results(check=1.0, diff=0.002, report=2.0)
+        current = results(check=1.3, diff=0.005, report=2.1, new=9.0)
+
+        regressions = benchmark_upstream.compare_results(current, baseline, threshold=0.25, min_delta=0.01)
+
+        self.assertEqual([r["operation"] for r in regressions], ["check"])
+        self.assertAlmostEqual(regressions[0]["ratio"], 1.3)
+
+
+    def test_main_reports_failures_on_stderr(self):
+        """Test that a missing baseline and regressions go to stderr and exit non-zero."""
+        results = {"results": [{
+            "shape": "tiny", "backend": "native", "operation": "check", "min": 2.0, "median": 2.0,
+            "counters": {"processes": 1, "bytes_read": 0},
+        }]}
+        baseline = Path(self.test_dir) / "baseline.json"
+
+        def run_main(*argv):
+            stdout, stderr = io.StringIO(), io.StringIO()
+            with patch.object(benchmark_upstream, "run_benchmarks", return_value=results), \
+                    patch.object(sys, "argv", ["benchmark-upstream.py", "--shape", "small", *argv]), \
+                    redirect_stdout(stdout), redirect_stderr(stderr), self.assertRaises(SystemExit) as exit_info:
+                benchmark_upstream.main()
+            self.assertEqual(exit_info.exception.code, 1)
+            return stdout.getvalue(), stderr.getvalue()
+
+        stdout, stderr = run_main("--baseline", str(baseline))
+        self.assertIn(f"Error: Baseline {baseline} not found", stderr)
+        self.assertNotIn("Error", stdout)
+
+        baseline.write_text('{"results": [{"shape": "tiny", "backend": "native", "operation": "check", "min": 1.0}]}')
+        stdout, stderr = run_main("--baseline", str(baseline))
+        self.assertIn("1 regression(s)", stderr)
+        self.assertIn("tiny/native/check: 1.0000s -> 2.0000s (2.00x)", stderr)
+        self.assertNotIn("regression", stdout)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the webhook payload coverage checker.
+
+Run with: python -m unittest scripts.test_payload_coverage
+"""
+
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from git_fixtures import FIXTURES, RepoSpec
+from script_loader import load_script
+
+payload_coverage = load_script("payload-coverage.py")
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SAMPLES = sorted((REPO_ROOT / "examples" / "api-samples").glob("*.json"))
+
+UPSTREAM_PHOTO = """<?php
+namespace DefStudio\\Telegraph\\DTO;
+
+class Photo
+{
+    private string $id;
+    private string $uniqueId;
+
+    public static function fromArray(array $data): Photo
+    {
+        $photo = new self();
+        $photo->id = $data['file_id'];
+        $photo->uniqueId = $data['file_unique_id'];
+        $photo->width = $data['width'];
+        $photo->height = $data['height'];
+        $photo->fileSize = $data['file_size'] ?? null;
+
+        return $photo;
+    }
+}
+"""
+
+COVERAGE_HISTORY = RepoSpec("payload-coverage", [
+    ("Add Photo", {"src/DTO/Photo.php": UPSTREAM_PHOTO}),
+])
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 7,
+        "date": 1700000000,
+        "chat": {"id": 1, "type": "private", "emoji_status_custom_emoji_id": "5"},
+        "photo": [
+            {"file_id": "a", "file_unique_id": "ua", "width": 90, "height": 90},
+            {"file_id": "b", "file_unique_id": "ub", "width": 320, "height": 320},
+        ],
+    },
+}
+
+
+class TestNestedTypes(unittest.TestCase):
+    """Nested DTO classes derived from the PHP sources."""
+
+    def test_repository_dtos(self):
+        """Test direct, array_map and variable-assigned fromArray() calls."""
+        schemas = payload_coverage.load_dto_schemas(REPO_ROOT / "src" / "DTO")
+
+        self.assertEqual(schemas["TelegramUpdate"]["nested"]["message"], "Message")
+        self.assertEqual(schemas["TelegramUpdate"]["nested"]["edited_channel_post"], "Message")
+        self.assertEqual(schemas["Message"]["nested"]["chat"], "Chat")
+        self.assertEqual(schemas["Message"]["nested"]["photo"], "Photo")
+        self.assertEqual(schemas["Message"]["nested"]["reply_to_message"], "Message")
+        self.assertEqual(schemas["Poll"]["nested"]["options"], "PollOption")
+        self.assertIn("file_id", schemas["Photo"]["keys"])
+        self.assertEqual(schemas["Photo"]["file"], os.path.relpath(REPO_ROOT / "src" / "DTO" / "Photo.php"))
+
+    def test_self_reference(self):
+        """Test that self and static resolve to the declaring class."""
+        source = """<?php
+class Node
+{
+    public static function fromArray(array $data): self
+    {
+        $parent = isset($data['parent']) ? static::fromArray($data['parent']) : null;
+        $children = array_map(fn ($child) => self::fromArray($child), $data['children'] ?? []);
+        return new self($data['name'], $parent, $children);
+    }
+}
+"""
+        self.assertEqual(payload_coverage.nested_types(source, "Node"), {"parent": "Node", "children": "Node"})
+
+
+class TestPayloadCoverage(unittest.TestCase):
+    """Streaming archives through the DTO schemas."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Parse the repository DTOs once."""
+        cls.schemas = payload_coverage.load_dto_schemas(REPO_ROOT / "src" / "DTO")
+
+    def setUp(self):
+        """Create a directory for archives."""
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        """Clean up the archives."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _keys(self, result):
+        return {(entry["dto"], entry["key"]): entry for entry in result["keys"]}
+
+    def test_api_samples(self):
+        """Test dropped keys and sample paths in the bundled API samples."""
+        result = payload_coverage.check_coverage(SAMPLES, self.schemas)
+        keys = self._keys(result)
+
+        self.assertEqual(result["updates"], len(SAMPLES))
+        self.assertIn("message.photo[].file_unique_id", keys[("Photo", "file_unique_id")]["samples"])
+        self.assertNotIn(("Message", "message_id"), keys)
+        self.assertNotIn(("TelegramUpdate", "message"), keys)
+        self.assertIsNone(keys[("Photo", "file_unique_id")]["upstream_reads"])
+
+    def test_streams_gzip_ndjson_in_parallel(self):
+        """Test gzipped NDJSON, invalid lines and that workers agree with one process."""
+        archive = self.test_dir / "updates.ndjson.gz"
+        with gzip.open(archive, 'wt') as f:
+            for update_id in range(5):
+                f.write(json.dumps(dict(UPDATE, update_id=update_id)) + "\n")
+            f.write("{not json\n\n")
+
+        serial = payload_coverage.check_coverage([archive], self.schemas, batch_size=2)
+        parallel = payload_coverage.check_coverage([archive], self.schemas, jobs=2, batch_size=2)
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual((serial["updates"], serial["invalid"]), (5, 1))
+        photo = self._keys(serial)[("Photo", "file_unique_id")]
+        # Counted once per update, not once per photo size
+        self.assertEqual((photo["updates"], photo["share"]), (5, 1.0))
+        self.assertEqual(photo["samples"], ["message.photo[].file_unique_id"])
+        self.assertEqual(self._keys(serial)[("Chat", "emoji_status_custom_emoji_id")]["samples"],
+                         ["message.chat.emoji_status_custom_emoji_id"])
+        self.assertEqual(serial["dtos"][0]["updates_affected"], 5)
+
+    def test_unknown_root(self):
+        """Test that a root class missing from the sources is an error."""
+        with self.assertRaises(ValueError):
+            payload_coverage.check_coverage(SAMPLES, self.schemas, root="Update")
+
+    def test_upstream_reads(self):
+        """Test that keys already read by the upstream class are marked recoverable."""
+        upstream = FIXTURES.upstream(COVERAGE_HISTORY, self.test_dir / "fixture")
+        config_path = self.test_dir / "upstream.json"
+        with open(config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "test/repo", "local_path": str(upstream.clone)},
+                "tracking": {"current_commit": upstream.commits[0]},
+                "files": {"categories": {"dto_classes": {"include": ["src/DTO/**"]}}},
+            }, f)
+
+        upstream_schemas = payload_coverage.load_upstream_schemas(str(config_path), "HEAD")
+        result = payload_coverage.check_coverage(SAMPLES, self.schemas, upstream=upstream_schemas)
+        keys = self._keys(result)
+
+        self.assertEqual(upstream_schemas["Photo"]["file"], "src/DTO/Photo.php")
+        self.assertTrue(keys[("Photo", "file_unique_id")]["upstream_reads"])
+        self.assertFalse(keys[("Message", "entities")]["upstream_reads"])
+        self.assertEqual(result["dtos"][0]["dto"], "Photo")
+        self.assertEqual(result["dtos"][0]["updates_recoverable"], keys[("Photo", "file_unique_id")]["updates"])
+
+        stream = io.StringIO()
+        payload_coverage.write_report(result, stream)
+        self.assertIn("| Photo | file_unique_id | 2 | 33.3% | yes |", stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the test runner and its cached git fixtures.
+
+Run with: python -m unittest scripts.test_run_tests
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import git_fixtures
+import run_tests
+from git_fixtures import GitFixtures, RepoSpec
+
+
+SPEC = RepoSpec("runner-test", [
+    ("First", {"a.txt": "one\n", "b.txt": "two\n"}),
+    ("Second", {"a.txt": "one v2\n", "b.txt": None}),
+], cloned=1, tags={"v1": 1})
+
+
+def git(cwd, *args):
+    """Run a git command and return its stripped output."""
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+class TestGitFixtures(unittest.TestCase):
+    """Fixtures are built once and copied for every test."""
+
+    def setUp(self):
+        """Create a private cache, in a directory that does not exist yet."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.fixtures = GitFixtures(self.test_dir / "cache")
+
+    def tearDown(self):
+        """Clean up the cache and copies."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_built_once_and_copied(self):
+        """Test that a spec is built once and each copy is independent."""
+        with patch.object(GitFixtures, "_build", wraps=self.fixtures._build) as build:
+            first = self.fixtures.upstream(SPEC, self.test_dir / "first")
+            second = self.fixtures.upstream(SPEC, self.test_dir / "second")
+
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(first.commits, second.commits)
+        self.assertEqual(first.tags, {"v1": first.commits[1]})
+        self.assertEqual(git(first.clone, "rev-parse", "HEAD"), first.cloned_commit)
+        self.assertEqual(git(first.clone, "config", "remote.origin.url"), first.remote.as_uri())
+
+        pushed = first.push({"c.txt": "three\n"}, "Third")
+        self.assertEqual(git(first.remote, "rev-list", "--count", "main"), "3")
+        self.assertEqual(git(first.remote, "log", "-1", "--format=%P %s", pushed), f"{first.commits[1]} Third")
+        self.assertEqual(git(second.remote, "rev-parse", "main"), second.commits[1])
+
+        git(first.clone, "fetch", "-q", "origin")
+        self.assertEqual(git(first.clone, "rev-parse", "origin/main"), pushed)
+
+    def test_binary_contents_rewrites_and_merges(self):
+        """Test bytes in a spec, a force push and a merge commit."""
+        spec = RepoSpec("binary", [("Add logo", {"logo.png": b"\x89PNG\0\xff"})])
+        upstream = self.fixtures.upstream(spec, self.test_dir / "binary")
+        self.assertNotEqual(spec.key(), RepoSpec("binary", [("Add logo", {"logo.png": "\x89PNG"})]).key())
+        self.assertEqual((upstream.clone / "logo.png").read_bytes(), b"\x89PNG\0\xff")
+
+        side = upstream.push({"a.txt": "side\n"}, "Side")
+        rewritten = upstream.push({"b.txt": "main\n"}, "Rewritten", parent=upstream.commits[0])
+        self.assertEqual(git(upstream.remote, "rev-parse", "main"), rewritten)
+
+        merged = upstream.push({}, "Merge side", merge=side)
+        self.assertEqual(git(upstream.remote, "log", "-1", "--format=%P", merged), f"{rewritten} {side}")
+
+    def test_hashes_are_deterministic(self):
+        """Test that separate caches build identical histories."""
+        other = GitFixtures(self.test_dir / "other")
+
+        ours = self.fixtures.upstream(SPEC, self.test_dir / "ours")
+        theirs = other.upstream(SPEC, self.test_dir / "theirs")
+
+        self.assertEqual(ours.commits, theirs.commits)
+        self.assertEqual(git(ours.remote, "ls-tree", "--name-only", "main"), "a.txt")
+
+
+class TestParallelRunner(unittest.TestCase):
+    """Sharding test classes across worker processes."""
+
+    def _suite(self):
+        loader = unittest.TestLoader()
+        return unittest.TestSuite([
+            loader.loadTestsFromName("test_run_tests.TestGitFixtures"),
+            loader.loadTestsFromName("test_upstream.TestDtoSchema"),
+            loader.loadTestsFromName("test_upstream.TestCommandLine.test_command_registry"),
+        ])
+
+    def test_shard_by_class(self):
+        """Test that classes stay whole and serial classes are kept apart."""
+        parallel, serial = run_tests.shard_by_class(self._suite())
+
+        self.assertEqual([len(ids) for ids in parallel], [3, 5])
+        self.assertTrue(all(test_id.startswith("test_upstream.TestDtoSchema.") for test_id in parallel[1]))
+        self.assertEqual(serial, [["test_upstream.TestCommandLine.test_command_registry"]])
+
+    def test_run_parallel(self):
+        """Test that results from every worker are merged."""
+        stream = io.StringIO()
+
+        with patch.dict(os.environ, {git_fixtures.FIXTURES_ENV: tempfile.mkdtemp()}):
+            try:
+                success = run_tests.run_parallel(self._suite(), 2, stream=stream)
+            finally:
+                shutil.rmtree(os.environ[git_fixtures.FIXTURES_ENV], ignore_errors=True)
+
+        self.assertTrue(success, stream.getvalue())
+        self.assertIn("Ran 9 tests in", stream.getvalue())
+        self.assertTrue(stream.getvalue().endswith("OK\n"))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -5,9 +5,13 @@ Unit tests for the upstream tracking functionality.
 Run with: python -m unittest scripts.test_upstream
 """
 
+import io
 import json
 import os
+import re
+import subprocess
 import tempfile
+import time
 import unittest
 from pathlib import Path
 from unittest.mock import Mock, patch, MagicMock
@@ -16,15 +20,59 @@ from unittest.mock import Mock, patch, MagicMock
 import sys
 sys.path.insert(0, os.path.dirname(__file__))
 
-try:
-    from check_upstream import UpstreamTracker
-except ImportError:
-    # Handle the case where the module name has hyphens
-    import importlib.util
-    spec = importlib.util.spec_from_file_location("check_upstream", "scripts/check-upstream.py")
-    check_upstream = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(check_upstream)
-    UpstreamTracker = check_upstream.UpstreamTracker
+from git_fixtures import BASE_TIMESTAMP, FIXTURES, RepoSpec
+from script_loader import load_script
+
+# The module name has a hyphen, so it is loaded by path
+check_upstream = load_script("check-upstream.py")
+UpstreamTracker = check_upstream.UpstreamTracker
+PathFilter = check_upstream.PathFilter
+DiffCache = check_upstream.DiffCache
+GIT_BACKENDS = check_upstream.GIT_BACKENDS
+
+
+def mock_git_process(output):
+    """Build a stand-in for a streaming git process such as `git diff`."""
+    process = Mock()
+    process.stdout = io.BytesIO(output)
+    return process
+
+
+GIT_ENV = dict(
+    os.environ,
+    GIT_AUTHOR_NAME="Test", GIT_AUTHOR_EMAIL="test@example.com",
+    GIT_COMMITTER_NAME="Test", GIT_COMMITTER_EMAIL="test@example.com",
+)
+
+
+def run_git(cwd, *args):
+    """Run a git command for test setup and return its stripped output."""
+    return subprocess.run(
+        ["git", *args], cwd=cwd, env=GIT_ENV, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+# A remote holding one commit, cloned as the upstream
+SINGLE_COMMIT = RepoSpec("single-commit", [("Add User", {"src/DTO/User.php": "<?php // v1\n"})])
+
+# An add, modify, delete and rename, all cloned
+BACKEND_HISTORY = RepoSpec("backend-history", [
+    ("Initial", {"src/DTO/User.php": "<?php // user\n", "src/DTO/Old.php": "<?php // old\n" * 20,
+                 "src/Enums/Gone.php": "<?php\n"}),
+    ("Second", {"src/Enums/Gone.php": None, "src/DTO/Old.php": None, "src/DTO/Renamed.php": "<?php // old\n" * 20,
+                "src/DTO/User.php": "<?php // user v2\n", "src/DTO/New.php": "<?php // new\n"}),
+])
+
+# Cloned at the first commit; the remote is three commits ahead
+UPSTREAM_HISTORY = RepoSpec("upstream-history", [
+    ("Initial import", {"src/DTO/User.php": "<?php\nclass User\n{\n    public int $id;\n}\n",
+                        "src/Enums/ChatActions.php": "<?php\nenum ChatActions {}\n",
+                        "README.md": "# telegraph\n"}),
+    ("Add username to User", {"src/DTO/User.php": "<?php\nclass User\n{\n    public int $id;\n"
+                                                  "    public string $username;\n}\n"}),
+    ("Add Chat DTO", {"src/DTO/Chat.php": "<?php\nclass Chat\n{\n}\n", "README.md": "# telegraph v2\n"}),
+    ("Drop ChatActions", {"src/Enums/ChatActions.php": None}),
+], cloned=1, tags={"v1.0.0": 0, "v1.1.0": 3})
 
 
 class TestUpstreamTracker(unittest.TestCase):
@@ -197,31 +245,50 @@ class TestUpstreamTracker(unittest.TestCase):
     @patch('pathlib.Path.exists')
     def test_check_for_updates_with_updates(self, mock_exists, mock_repo_class):
         """Test checking for updates when new commits are available."""
-        # Mock commits
-        mock_commit1 = Mock()
-        mock_commit1.hexsha = "new123456789"
-        mock_commit1.message = "New feature added"
-        
-        mock_commit2 = Mock()
-        mock_commit2.hexsha = "new987654321"
-        mock_commit2.message = "Bug fix"
-        
         # Mock the repository
         mock_repo = Mock()
         mock_repo.head.commit.hexsha = "new123456789"  # Different from config
         mock_repo.remotes.origin.fetch = Mock()
-        mock_repo.iter_commits.return_value = [mock_commit1, mock_commit2]
+        mock_repo.git.log.side_effect = lambda *args, **kwargs: (
+            mock_git_process(b"new123456789\nNew feature added\n\n\0new987654321\nBug fix\n\nDetails\n")
+            if kwargs.get("as_process") else "new123456789"
+        )
         mock_repo_class.return_value = mock_repo
         mock_exists.return_value = True
         
         tracker = UpstreamTracker(str(self.config_path))
         has_updates, new_commit, commits = tracker.check_for_updates()
         
+        # Only the relevance check runs before the commits are iterated
+        mock_repo.git.log.assert_called_once_with("-1", "--format=%H", "abc123456789..new123456789", "--")
+        commits = list(commits)
+        
         self.assertTrue(has_updates)
         self.assertEqual(new_commit, "new123456789")
         self.assertEqual(len(commits), 2)
-        self.assertIn("New feature added", commits[0])
+        self.assertEqual(commits[0], "new12345 - New feature added")
         self.assertIn("Bug fix", commits[1])
+        mock_repo.git.log.assert_called_with(
+            "abc123456789..new123456789", "-z", "--format=%H%n%B", "--", as_process=True
+        )
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_iter_commits_limits(self, mock_exists, mock_repo_class):
+        """Test that --max-commits and --since are passed to the batched log query."""
+        mock_repo = Mock()
+        mock_repo.git.log.return_value = mock_git_process(b"new123456789\nOnly one\n")
+        mock_repo_class.return_value = mock_repo
+        mock_exists.return_value = True
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        commits = list(tracker.iter_commits("abc123", "def456", max_commits=1, since="2025-11-01"))
+        
+        self.assertEqual(commits, ["new12345 - Only one"])
+        mock_repo.git.log.assert_called_once_with(
+            "abc123..def456", "-z", "--format=%H%n%B", "--max-count=1", "--since=2025-11-01", "--",
+            as_process=True,
+        )
     
     @patch('git.Repo')
     @patch('pathlib.Path.exists')
@@ -267,7 +334,11 @@ class TestUpstreamTracker(unittest.TestCase):
         """Test generating diff report."""
         # Mock diff item
         mock_diff_item = Mock()
-        mock_diff_item.diff = b"@@ -1,3 +1,3 @@\n-old line\n+new line\n"
+        mock_diff_item.change_type = 'M'
+        mock_diff_item.a_path = 'test.php'
+        mock_diff_item.b_path = 'test.php'
+        mock_diff_item.a_blob.hexsha = "1" * 40
+        mock_diff_item.b_blob.hexsha = "2" * 40
         
         # Mock commits and diff
         mock_commit1 = Mock()
@@ -277,20 +348,365 @@ class TestUpstreamTracker(unittest.TestCase):
         
         mock_repo = Mock()
         mock_repo.commit.side_effect = [mock_commit1, mock_commit2]
+        patch_text = b"diff --git a/test.php b/test.php\n@@ -1,3 +1,3 @@\n-old line\n+new line\n"
+        mock_repo.git.diff.side_effect = lambda *args, **kwargs: (
+            mock_git_process(patch_text) if kwargs.get("as_process") else "1\t1\ttest.php\0"
+        )
+        mock_repo.odb.stream.side_effect = lambda sha: io.BytesIO(b"<?php\n")
+        mock_repo.git.cat_file.return_value = f"{'1' * 40} 6\n{'2' * 40} 6"
+        mock_repo_class.return_value = mock_repo
+        mock_exists.return_value = True
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        report = tracker.generate_diff_report("abc123", "def456")
+        
+        self.assertIn("# Upstream Diff Report", report)
+        self.assertIn("From commit: abc123", report)
+        self.assertIn("To commit: def456", report)
+        self.assertIn("Total files changed: 1", report)
+        self.assertIn("Modified Files (1)", report)
+        self.assertIn("- test.php", report)
+        self.assertIn("+new line", report)
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_diff_snapshot_shared_between_consumers(self, mock_exists, mock_repo_class):
+        """Test that the tree diff is computed once per commit pair."""
+        mock_diff_item = Mock()
+        mock_diff_item.change_type = 'A'
+        mock_diff_item.a_path = 'src/DTO/NewClass.php'
+        mock_diff_item.b_path = 'src/DTO/NewClass.php'
+        mock_diff_item.a_blob = None
+        mock_diff_item.b_blob.hexsha = "2" * 40
+        patch_text = b"diff --git a/src/DTO/NewClass.php b/src/DTO/NewClass.php\n@@ -0,0 +1 @@\n+<?php\n"
+        
+        mock_commit1 = Mock()
+        mock_commit2 = Mock()
+        mock_commit1.diff.return_value = [mock_diff_item]
+        
+        mock_repo = Mock()
+        mock_repo.commit.side_effect = [mock_commit1, mock_commit2]
+        mock_repo.git.diff.side_effect = lambda *args, **kwargs: (
+            mock_git_process(patch_text) if kwargs.get("as_process") else "1\t0\tsrc/DTO/NewClass.php\0"
+        )
+        mock_repo.odb.stream.side_effect = lambda sha: io.BytesIO(b"<?php\n")
+        mock_repo.git.cat_file.return_value = f"{'2' * 40} 6"
+        mock_repo_class.return_value = mock_repo
+        mock_exists.return_value = True
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        changes = tracker.get_file_changes("abc123", "def456")
+        tracker.generate_diff_report("abc123", "def456")
+        snapshot = tracker.get_diff_snapshot("abc123", "def456")
+        
+        self.assertEqual(changes['added'], ['src/DTO/NewClass.php'])
+        self.assertEqual(mock_repo.commit.call_count, 2)
+        self.assertEqual(mock_commit1.diff.call_count, 1)
+        self.assertIsNone(snapshot.changes[0].a_blob)
+        self.assertEqual(snapshot.patch(snapshot.changes[0]), patch_text)
+    
+    def _mock_snapshot_repo(self, mock_repo_class, paths, patch_text):
+        """Wire a mocked repository whose range changes the given paths."""
+        items = []
+        for path in paths:
+            item = Mock()
+            item.change_type = 'M'
+            item.a_path = path
+            item.b_path = path
+            item.a_blob = None
+            item.b_blob = None
+            items.append(item)
+        
+        mock_commit = Mock()
+        mock_commit.diff.return_value = items
+        mock_repo = Mock()
+        mock_repo.commit.return_value = mock_commit
+        mock_repo.git.diff.side_effect = lambda *args, **kwargs: mock_git_process(patch_text)
         mock_repo_class.return_value = mock_repo
+        return mock_repo
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_write_diff_report_per_file_limit(self, mock_exists, mock_repo_class):
+        """Test that oversized file patches are cut with a truncation marker."""
+        mock_exists.return_value = True
+        self._mock_snapshot_repo(
+            mock_repo_class,
+            ['src/DTO/Message.php', 'src/DTO/User.php'],
+            b"diff --git a/src/DTO/Message.php b/src/DTO/Message.php\n" + b"+line\n" * 100 +
+            b"diff --git a/src/DTO/User.php b/src/DTO/User.php\n+short\n",
+        )
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        stream = io.StringIO()
+        tracker.write_diff_report("abc123", "def456", stream, max_file_bytes=80)
+        report = stream.getvalue()
+        
+        self.assertIn("[truncated src/DTO/Message.php:", report)
+        self.assertLess(report.count("+line"), 10)
+        self.assertIn("+short", report)
+        self.assertTrue(report.endswith("```\n"))
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_write_diff_report_total_limit_from_config(self, mock_exists, mock_repo_class):
+        """Test that the total byte cap is read from config and stops the patch stream."""
         mock_exists.return_value = True
+        self._mock_snapshot_repo(
+            mock_repo_class,
+            ['a.php', 'b.php', 'c.php'],
+            b"diff --git a/a.php b/a.php\n+aaaa\n"
+            b"diff --git a/b.php b/b.php\n+bbbb\n"
+            b"diff --git a/c.php b/c.php\n+cccc\n",
+        )
+        self.sample_config["report"] = {"max_total_bytes": 40}
+        with open(self.config_path, 'w') as f:
+            json.dump(self.sample_config, f)
         
         tracker = UpstreamTracker(str(self.config_path))
+        stream = io.StringIO()
+        tracker.write_diff_report("abc123", "def456", stream)
+        report = stream.getvalue()
+        
+        self.assertIn("+aaaa", report)
+        self.assertNotIn("+cccc", report)
+        self.assertIn("[report truncated: total patch limit of 40 bytes reached, 2 file(s)", report)
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_stream_diff_report_to_file(self, mock_exists, mock_repo_class):
+        """Test that the streaming writer produces the same report as the buffered one."""
+        mock_exists.return_value = True
+        patch_text = b"diff --git a/a.php b/a.php\n+aaaa\n"
+        self._mock_snapshot_repo(mock_repo_class, ['a.php'], patch_text)
+        output_file = Path(self.test_dir) / "report.md"
         
-        with patch.object(tracker, 'get_file_changes', return_value={'modified': ['test.php'], 'added': [], 'deleted': [], 'renamed': []}):
+        tracker = UpstreamTracker(str(self.config_path))
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.stream_diff_report("abc123", "def456", str(output_file))
             report = tracker.generate_diff_report("abc123", "def456")
+        
+        streamed = output_file.read_text()
+        output_file.unlink()
+        
+        strip_timestamp = lambda text: [l for l in text.splitlines() if not l.startswith("Generated:")]
+        self.assertEqual(strip_timestamp(streamed), strip_timestamp(report))
+    
+    def test_path_filter_categories(self):
+        """Test category globs, excludes and generated pathspecs."""
+        path_filter = PathFilter({
+            "dto_classes": {"count": 45, "include": ["src/DTO/**/*.php"]},
+            "support": {"include": ["src/Support/**"], "exclude": ["src/Support/Testing/**"]},
+            "enums": 5,
+        })
+        
+        self.assertEqual(path_filter.category("src/DTO/Message.php"), "dto_classes")
+        self.assertEqual(path_filter.category("src/DTO/Nested/Thing.php"), "dto_classes")
+        self.assertIsNone(path_filter.category("src/DTO/README.md"))
+        self.assertEqual(path_filter.category("src/Support/Helpers.php"), "support")
+        self.assertIsNone(path_filter.category("src/Support/Testing/Fakes/Fake.php"))
+        self.assertIsNone(path_filter.category("src/Models/TelegraphBot.php"))
+        self.assertEqual(path_filter.pathspecs, [
+            ":(glob)src/DTO/**/*.php",
+            ":(glob)src/Support/**",
+            ":(glob,exclude)src/Support/Testing/**",
+        ])
+        self.assertFalse(PathFilter({"enums": 5}))
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_diff_snapshot_uses_category_pathspecs(self, mock_exists, mock_repo_class):
+        """Test that category globs are pushed into git and untracked changes are dropped."""
+        mock_exists.return_value = True
+        self.sample_config["files"]["categories"] = {
+            "dto_classes": {"count": 45, "include": ["src/DTO/**/*.php"]},
+        }
+        with open(self.config_path, 'w') as f:
+            json.dump(self.sample_config, f)
+        
+        tracked = Mock(change_type='M', a_path='src/DTO/User.php', b_path='src/DTO/User.php')
+        untracked = Mock(change_type='M', a_path='src/DTO/notes.txt', b_path='src/DTO/notes.txt')
+        mock_commit = Mock()
+        mock_commit.diff.return_value = [tracked, untracked]
+        mock_repo = Mock()
+        mock_repo.commit.return_value = mock_commit
+        mock_repo_class.return_value = mock_repo
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        snapshot = tracker.get_diff_snapshot("abc123", "def456")
+        
+        mock_commit.diff.assert_called_once_with(mock_commit, paths=[":(glob)src/DTO/**/*.php"])
+        self.assertEqual([c.path for c in snapshot], ['src/DTO/User.php'])
+        self.assertEqual(snapshot.changes[0].category, 'dto_classes')
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_check_for_updates_limits_rev_walk_to_tracked_paths(self, mock_exists, mock_repo_class):
+        """Test that the relevance check and the new-commit walk only follow tracked paths."""
+        mock_exists.return_value = True
+        self.sample_config["files"]["categories"] = {
+            "enums": {"count": 5, "include": ["src/Enums/*.php"]},
+        }
+        with open(self.config_path, 'w') as f:
+            json.dump(self.sample_config, f)
+        
+        mock_repo = Mock()
+        mock_repo.head.commit.hexsha = "new123456789"
+        mock_repo.git.log.return_value = ""
+        mock_repo_class.return_value = mock_repo
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        with patch('sys.stdout', new_callable=io.StringIO):
+            has_updates, new_commit, commits = tracker.check_for_updates()
+            commits = list(commits)
+        
+        mock_repo.git.log.assert_called_once_with(
+            "-1", "--format=%H", "abc123456789..new123456789", "--", ":(glob)src/Enums/*.php",
+        )
+        # Upstream moved, but not on a tracked path
+        self.assertFalse(has_updates)
+        self.assertEqual(new_commit, "new123456789")
+        self.assertEqual(commits, [])
+        
+        mock_repo.git.log.reset_mock()
+        mock_repo.git.log.return_value = mock_git_process(b"")
+        list(tracker.iter_commits("abc123456789", "new123456789"))
+        mock_repo.git.log.assert_called_once_with(
+            "abc123456789..new123456789", "-z", "--format=%H%n%B",
+            "--", ":(glob)src/Enums/*.php",
+            as_process=True,
+        )
+    
+    def _ls_tree_output(self, blobs):
+        """Format (path, sha) pairs like `git ls-tree -r -z`."""
+        return "".join(f"100644 blob {sha}\t{path}\0" for path, sha in blobs)
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_manifest_reports_affected_local_files(self, mock_exists, mock_repo_class):
+        """Test blob-id comparison between the manifest and a later tree listing."""
+        mock_exists.return_value = True
+        self.sample_config["files"]["categories"] = {
+            "dto_classes": {
+                "count": 45,
+                "include": ["src/DTO/**/*.php"],
+                "local": {"src/DTO/": "src/DTO/"},
+            },
+        }
+        with open(self.config_path, 'w') as f:
+            json.dump(self.sample_config, f)
+        
+        mock_repo = Mock()
+        mock_repo.commit.return_value.hexsha = "abc123456789"
+        mock_repo.git.ls_tree.side_effect = [
+            self._ls_tree_output([
+                ("src/DTO/Message.php", "a" * 40),
+                ("src/DTO/User.php", "b" * 40),
+                ("src/DTO/Gone.php", "c" * 40),
+                ("src/Models/Bot.php", "d" * 40),
+            ]),
+            self._ls_tree_output([
+                ("src/DTO/Message.php", "e" * 40),
+                ("src/DTO/User.php", "b" * 40),
+                ("src/DTO/Story.php", "f" * 40),
+            ]),
+        ]
+        mock_repo_class.return_value = mock_repo
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        with patch('sys.stdout', new_callable=io.StringIO):
+            manifest = tracker.build_manifest()
+        changes = tracker.check_manifest("def456")
+        
+        saved_manifest = json.loads(tracker.manifest_path.read_text())
+        tracker.manifest_path.unlink()
+        
+        mock_repo.git.ls_tree.assert_any_call("-r", "-z", "--full-tree", "abc123456789", "--", "src/DTO")
+        self.assertEqual(saved_manifest, manifest)
+        self.assertEqual(sorted(manifest["files"]), ["src/DTO/Gone.php", "src/DTO/Message.php", "src/DTO/User.php"])
+        self.assertEqual(manifest["files"]["src/DTO/Message.php"]["local"], "src/DTO/Message.php")
+        self.assertEqual([e["upstream"] for e in changes["changed"]], ["src/DTO/Message.php"])
+        self.assertEqual(changes["changed"][0]["new_blob"], "e" * 40)
+        self.assertEqual([e["upstream"] for e in changes["deleted"]], ["src/DTO/Gone.php"])
+        self.assertEqual([e["upstream"] for e in changes["added"]], ["src/DTO/Story.php"])
+    
+    def test_local_path_mapping(self):
+        """Test that the longest upstream prefix wins and unported files map to None."""
+        self.sample_config["files"]["categories"] = {
+            "exceptions": {
+                "include": ["src/Exceptions/*.php"],
+                "local": {
+                    "src/Exceptions/": "src/Exceptions/",
+                    "src/Exceptions/TelegraphException.php": "src/Exceptions/TelegramException.php",
+                },
+            },
+        }
+        with open(self.config_path, 'w') as f:
+            json.dump(self.sample_config, f)
+        local_file = Path(self.test_dir) / "src" / "Exceptions" / "TelegramException.php"
+        local_file.parent.mkdir(parents=True)
+        local_file.write_text("<?php\n")
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        try:
+            self.assertEqual(
+                tracker._local_path("exceptions", "src/Exceptions/TelegraphException.php"),
+                "src/Exceptions/TelegramException.php",
+            )
+            self.assertIsNone(tracker._local_path("exceptions", "src/Exceptions/StorageException.php"))
+        finally:
+            local_file.unlink()
+            local_file.parent.rmdir()
+            local_file.parent.parent.rmdir()
+    
+    def test_manifest_changes_list_unported_files(self):
+        """Test that changed and deleted upstream files without a local port are still listed."""
+        def entry(upstream, local):
+            return {"upstream": upstream, "local": local, "category": "dto_classes", "old_blob": None, "new_blob": None}
+        
+        stream = io.StringIO()
+        check_upstream._print_manifest_changes({
+            "changed": [entry("src/DTO/User.php", "src/DTO/User.php"), entry("src/DTO/Poll.php", None)],
+            "deleted": [entry("src/DTO/Gone.php", None)],
+            "added": [entry("src/DTO/Story.php", None)],
+        }, stream)
+        
+        self.assertEqual(stream.getvalue(), (
+            "Files to re-port (1):\n"
+            "  src/DTO/User.php <- src/DTO/User.php [dto_classes]\n"
+            "Upstream files without a local counterpart (3):\n"
+            "  src/DTO/Poll.php [dto_classes] (changed)\n"
+            "  src/DTO/Gone.php [dto_classes] (deleted)\n"
+            "  src/DTO/Story.php [dto_classes] (added)\n"
+        ))
+    
+    @patch('git.Repo')
+    @patch('pathlib.Path.exists')
+    def test_diff_cache_serves_warm_runs(self, mock_exists, mock_repo_class):
+        """Test that a second run over the same resolved range never diffs again."""
+        mock_exists.return_value = True
+        self.sample_config["cache"] = {"path": "cache"}
+        with open(self.config_path, 'w') as f:
+            json.dump(self.sample_config, f)
+        
+        patch_text = b"diff --git a/a.php b/a.php\n+aaaa\n"
+        mock_repo = self._mock_snapshot_repo(mock_repo_class, ['a.php'], patch_text)
+        mock_repo.commit.return_value.hexsha = "f" * 40
+        
+        try:
+            cold = UpstreamTracker(str(self.config_path)).generate_diff_report("abc123", "def456")
+            mock_repo.commit.return_value.diff.reset_mock()
+            mock_repo.git.diff.reset_mock()
             
-            self.assertIn("# Upstream Diff Report", report)
-            self.assertIn("From commit: abc123", report)
-            self.assertIn("To commit: def456", report)
-            self.assertIn("Total files changed: 1", report)
-            self.assertIn("Modified Files (1)", report)
-            self.assertIn("- test.php", report)
+            warm = UpstreamTracker(str(self.config_path)).generate_diff_report("abc123", "def456")
+            
+            mock_repo.commit.return_value.diff.assert_not_called()
+            mock_repo.git.diff.assert_not_called()
+            self.assertIn("+aaaa", warm)
+            self.assertEqual(cold.split("\n")[2:], warm.split("\n")[2:])
+        finally:
+            import shutil
+            shutil.rmtree(Path(self.test_dir) / "cache")
     
     def test_update_tracking(self):
         """Test updating tracking information."""
@@ -333,67 +749,2078 @@ class TestUpstreamTracker(unittest.TestCase):
             sys.stdout = sys.__stdout__
 
 
-class TestUpstreamTrackerIntegration(unittest.TestCase):
-    """Integration tests that require actual git operations."""
+class TestDiffCache(unittest.TestCase):
+    """Test cases for the on-disk diff cache."""
     
     def setUp(self):
-        """Set up test fixtures."""
+        """Set up a cache in a temporary directory."""
         self.test_dir = tempfile.mkdtemp()
-        self.config_path = Path(self.test_dir) / "test_upstream.json"
+        self.cache = DiffCache(Path(self.test_dir) / "cache", max_bytes=250)
+    
+    def tearDown(self):
+        """Clean up the cache directory."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_json_round_trip(self):
+        """Test storing and reading back a JSON entry."""
+        key = DiffCache.key("diff", "a" * 40, "b" * 40)
         
-        # Create a minimal config for integration tests
+        self.assertIsNone(self.cache.get_json(key))
+        self.cache.put_json(key, {"commits": ["abc12345 - Fix"]})
+        self.assertEqual(self.cache.get_json(key), {"commits": ["abc12345 - Fix"]})
+        self.assertNotEqual(key, DiffCache.key("diff", "a" * 40, "c" * 40))
+    
+    def test_evicts_least_recently_used(self):
+        """Test that writes beyond max_bytes evict the oldest-read entries."""
+        for name in ("first", "second"):
+            self.cache.put_json(name, {"data": "x" * 90})
+        
+        # Age both entries, then read "first" so "second" becomes the LRU entry
+        for name in ("first", "second"):
+            os.utime(self.cache.path / f"{name}.json", (1000, 1000))
+        self.cache.get_json("first")
+        self.cache.put_json("third", {"data": "x" * 90})
+        
+        self.assertIsNotNone(self.cache.get_json("first"))
+        self.assertIsNone(self.cache.get_json("second"))
+        self.assertIsNotNone(self.cache.get_json("third"))
+    
+    def test_concurrent_eviction(self):
+        """Test that entries removed by another tracker mid-eviction are skipped."""
+        for name in ("first", "second", "third"):
+            self.cache.put_json(name, {"data": "x"})
+        listed = sorted(os.scandir(self.cache.path), key=lambda entry: entry.name)
+        
+        # "first" was measured before it vanished, "second" vanishes before being measured
+        listed[0].stat()
+        for entry in listed[:2]:
+            os.unlink(entry.path)
+        
+        self.cache.max_bytes = 0
+        with patch.object(check_upstream.os, "scandir", return_value=iter(listed)):
+            self.cache.evict()
+        
+        self.assertEqual(list(self.cache.path.iterdir()), [])
+    
+    def test_abandoned_writer_leaves_no_entry(self):
+        """Test that an incomplete write is discarded."""
+        with self.assertRaises(RuntimeError):
+            with self.cache.writer("partial", ".patch") as f:
+                f.write(b"diff --git a/a b/a\n")
+                raise RuntimeError("consumer stopped")
+        
+        self.assertIsNone(self.cache.get_path("partial", ".patch"))
+        self.assertEqual(list(self.cache.path.iterdir()), [])
+
+
+
+def append_journal_records(path, upstream, count):
+    """Append records from a separate process, for the concurrency test."""
+    journal = check_upstream.SyncJournal(Path(path))
+    for i in range(count):
+        journal.append({"type": "sync", "upstream": upstream, "from_commit": "a" * 40, "to_commit": f"{i:040d}"})
+
+
+class TestSyncJournal(unittest.TestCase):
+    """Test cases for the append-only sync journal."""
+    
+    def setUp(self):
+        """Set up a journal and a journal-enabled config in a temporary directory."""
+        self.test_dir = tempfile.mkdtemp()
+        self.journal = check_upstream.SyncJournal(Path(self.test_dir) / "journal.ndjson")
+        self.config_path = Path(self.test_dir) / "upstream.json"
         self.config = {
-            "repository": {
-                "name": "test/repo",
-                "url": "https://github.com/test/repo",
-                "local_path": str(Path(self.test_dir) / "test_repo")
-            },
-            "tracking": {
-                "current_commit": "abc123456789",
-                "last_checked": None,
-                "last_sync_commit": "abc123456789",
-                "created": "2025-11-07"
-            },
-            "files": {"extracted_count": 10},
-            "sync_status": {"up_to_date": True, "pending_changes": [], "conflicts": []}
+            "repository": {"name": "defstudio/telegraph", "local_path": self.test_dir},
+            "tracking": {"current_commit": "a" * 40, "last_checked": None},
+            "files": {"extracted_count": 118},
+            "sync_status": {"up_to_date": True, "pending_changes": []},
+            "journal": {"path": "journal.ndjson"},
         }
-        
         with open(self.config_path, 'w') as f:
-            json.dump(self.config, f, indent=2)
+            json.dump(self.config, f)
     
     def tearDown(self):
-        """Clean up test files."""
+        """Clean up the journal directory."""
         import shutil
         shutil.rmtree(self.test_dir, ignore_errors=True)
     
-    def test_error_handling_missing_repo(self):
-        """Test error handling when repository doesn't exist."""
+    def test_state_and_history(self):
+        """Test the indexed latest state and newest-first history."""
+        self.journal.append({"type": "sync", "upstream": "a", "from_commit": "1" * 40, "to_commit": "2" * 40})
+        self.journal.append({
+            "type": "check", "upstream": "b", "from_commit": "5" * 40, "to_commit": "6" * 40,
+            "has_updates": True, "commits": 3, "files": 7,
+        })
+        self.journal.append({"type": "check", "upstream": "a", "from_commit": "2" * 40, "error": "offline"})
+        self.journal.append({"type": "sync", "upstream": "a", "from_commit": "2" * 40, "to_commit": "3" * 40})
+        
+        state = self.journal.state("a")
+        self.assertEqual(state["current_commit"], "3" * 40)
+        self.assertNotIn("last_check", state)
+        self.assertEqual(self.journal.state("b")["last_check"], {
+            "to_commit": "6" * 40, "has_updates": True, "commits": 3, "files": 7,
+        })
+        self.assertIsNone(self.journal.state("c"))
+        
+        with patch.object(check_upstream.SyncJournal, "_rebuild_index") as rebuild:
+            self.journal.state("a")
+        rebuild.assert_not_called()
+        
+        history = list(self.journal.history("a"))
+        self.assertEqual([r["type"] for r in history], ["sync", "check", "sync"])
+        self.assertEqual(history[0]["to_commit"], "3" * 40)
+        self.assertEqual(len(list(self.journal.history(limit=2))), 2)
+        
+        # Small blocks split records across reads
+        lines = list(self.journal._reverse_lines(block_size=16))
+        self.assertEqual([json.loads(line)["upstream"] for line in lines], ["a", "a", "b", "a"])
+    
+    def test_stale_index_is_rebuilt(self):
+        """Test that an index not matching the journal is replayed from it."""
+        self.journal.append({"type": "sync", "upstream": "a", "from_commit": "1" * 40, "to_commit": "2" * 40})
+        
+        # A record appended by a run that died before updating the index
+        with open(self.journal.path, 'a') as f:
+            f.write(json.dumps({"type": "sync", "upstream": "a", "time": "t", "from_commit": "2" * 40, "to_commit": "4" * 40}) + "\n")
+        
+        self.assertEqual(self.journal.state("a")["current_commit"], "4" * 40)
+        with open(self.journal.index_path, 'r') as f:
+            self.assertEqual(json.load(f)["records"], 2)
+    
+    def test_failed_check_does_not_stick(self):
+        """Test that a successful check after a failed one is recorded without the old error."""
         tracker = UpstreamTracker(str(self.config_path))
         
-        # Try to check for updates with non-existent repo
-        has_updates, new_commit, commits = tracker.check_for_updates()
+        with patch.object(tracker, "fetch_upstream", side_effect=[RuntimeError("offline"), "a" * 40]), \
+                patch('sys.stdout', new_callable=io.StringIO):
+            tracker.check_for_updates()
+            tracker.record_check(None, 0)
+            self.assertEqual(tracker.check_error, "offline")
+            
+            tracker.check_for_updates()
+            tracker.record_check(None, 0)
         
-        # Should handle the error gracefully
-        self.assertFalse(has_updates)
-        self.assertIsNone(new_commit)
-        self.assertEqual(commits, [])
+        self.assertIsNone(tracker.check_error)
+        history = list(self.journal.history("defstudio/telegraph"))
+        self.assertEqual([record["error"] for record in history], [None, "offline"])
+        state = self.journal.state("defstudio/telegraph")
+        self.assertEqual(state["last_check"]["has_updates"], False)
+        self.assertEqual(state["last_checked"], history[0]["time"])
     
-    def test_json_operations(self):
-        """Test JSON file reading and writing operations."""
+    def test_threads_repair_stale_index(self):
+        """Test that threads reading a stale index rebuild it under the lock without clashing."""
+        from concurrent.futures import ThreadPoolExecutor
+        self.journal.append({"type": "sync", "upstream": "a", "from_commit": "1" * 40, "to_commit": "2" * 40})
+        
+        for round_number in range(20):
+            with open(self.journal.path, 'a') as f:
+                f.write(json.dumps({"type": "sync", "upstream": "a", "time": "t", "from_commit": "2" * 40,
+                                    "to_commit": f"{round_number:040d}"}) + "\n")
+            
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                states = list(pool.map(
+                    lambda _: check_upstream.SyncJournal(self.journal.path).state("a"), range(4)
+                ))
+            
+            self.assertEqual({state["current_commit"] for state in states}, {f"{round_number:040d}"})
+        
+        self.assertEqual(sorted(os.listdir(self.test_dir)), ["journal.ndjson", "journal.ndjson.index", "upstream.json"])
+    
+    def test_concurrent_appends(self):
+        """Test that appends from several processes are all kept and indexed."""
+        import multiprocessing
+        workers = [
+            multiprocessing.Process(target=append_journal_records, args=(str(self.journal.path), f"u{i}", 25))
+            for i in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        
+        with open(self.journal.path, 'r') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 100)
+        with open(self.journal.index_path, 'r') as f:
+            self.assertEqual(json.load(f)["records"], 100)
+        self.assertEqual(self.journal.state("u3")["current_commit"], f"{24:040d}")
+    
+    def test_tracker_uses_journal(self):
+        """Test that updates go to the journal and later runs read them back."""
         tracker = UpstreamTracker(str(self.config_path))
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.update_tracking("b" * 40)
         
-        # Modify and save config
-        original_commit = tracker.config["tracking"]["current_commit"]
-        new_commit = "def987654321"
+        with open(self.config_path, 'r') as f:
+            self.assertEqual(json.load(f), self.config)
         
-        tracker.config["tracking"]["current_commit"] = new_commit
-        tracker._save_config()
+        tracker = UpstreamTracker(str(self.config_path))
+        self.assertEqual(tracker.config["tracking"]["current_commit"], "b" * 40)
+        self.assertIsNotNone(tracker.config["tracking"]["last_checked"])
         
-        # Create new tracker instance to test loading
-        tracker2 = UpstreamTracker(str(self.config_path))
+        with patch('sys.stdout', new_callable=io.StringIO) as output:
+            tracker.status()
+            tracker.print_history()
+        self.assertIn("Current commit: bbbbbbbb", output.getvalue())
+        self.assertIn("Last sync: ", output.getvalue())
+        self.assertIn("sync   aaaaaaaa -> bbbbbbbb", output.getvalue())
+    
+    def test_save_config_keeps_concurrent_changes(self):
+        """Test that saving tracking re-reads the file instead of overwriting it."""
+        del self.config["journal"]
+        with open(self.config_path, 'w') as f:
+            json.dump(self.config, f)
+        tracker = UpstreamTracker(str(self.config_path))
         
-        self.assertEqual(tracker2.config["tracking"]["current_commit"], new_commit)
-        self.assertNotEqual(tracker2.config["tracking"]["current_commit"], original_commit)
+        # Another run changes the file after this tracker loaded it
+        self.config["files"]["extracted_count"] = 120
+        with open(self.config_path, 'w') as f:
+            json.dump(self.config, f)
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.update_tracking("c" * 40)
+        
+        with open(self.config_path, 'r') as f:
+            saved = json.load(f)
+        self.assertEqual(saved["files"]["extracted_count"], 120)
+        self.assertEqual(saved["tracking"]["current_commit"], "c" * 40)
+        self.assertEqual(os.listdir(self.test_dir), ["upstream.json"])
+
+
+USER_DTO_V1 = """<?php
+
+namespace DefStudio\\Telegraph\\DTO;
+
+class User implements Arrayable
+{
+    private int $id;
+    private ?string $username = null;
+    private string $firstName; // "first_name" in the API
+
+    public static function fromArray(array $data): User
+    {
+        $user = new self();
+        $user->id = $data['id'];
+        $user->firstName = $data['first_name'];
+        if (isset($data["username"])) {
+            $user->username = $data["username"];
+        }
+        return $user;
+    }
+
+    public function toArray(): array
+    {
+        return array_filter([
+            'id' => $this->id,
+            'first_name' => $this->firstName,
+            'username' => $this->username,
+        ], fn ($value) => $value !== null);
+    }
+}
+"""
+
+USER_DTO_V2 = (
+    USER_DTO_V1
+    .replace("private int $id;", "private string $id;\n    private bool $isBot = false;")
+    .replace("    private ?string $username = null;\n", "")
+    .replace("$user->firstName = $data['first_name'];", "$user->firstName = $data['first_name'];\n        $user->isBot = $data['is_bot'] ?? false;")
+    .replace("'username' => $this->username,", "'is_bot' => $this->isBot,")
+)
+
+USER_DTO_HISTORY = RepoSpec("user-dto-history", [
+    ("Add User", {"src/DTO/User.php": USER_DTO_V1}),
+    ("Change User", {"src/DTO/User.php": USER_DTO_V2}),
+])
+
+
+class TestDtoSchema(unittest.TestCase):
+    """Structural schema extraction and diffing for PHP DTO classes."""
+    
+    def test_parse_php_schema(self):
+        """Test extracting properties and array keys from a DTO class."""
+        schema = check_upstream.parse_php_schema(USER_DTO_V1)
+        
+        self.assertEqual(schema["class"], "User")
+        self.assertEqual(schema["properties"], {"id": "int", "username": "string|null", "firstName": "string"})
+        self.assertEqual(schema["input_keys"], ["first_name", "id", "username"])
+        self.assertEqual(schema["output_keys"], ["first_name", "id", "username"])
+        self.assertIsNone(check_upstream.parse_php_schema("<?php\n// class Nothing\nreturn [];\n"))
+    
+    def test_promoted_constructor_properties(self):
+        """Test reading properties promoted in the constructor."""
+        schema = check_upstream.parse_php_schema((Path(__file__).resolve().parent.parent / "src" / "DTO" / "Chat.php").read_text())
+        
+        self.assertEqual(schema["properties"]["title"], "string|null")
+        self.assertEqual(schema["properties"]["isForum"], "bool")
+        self.assertIn("is_direct_messages", schema["input_keys"])
+    
+    def test_diff_schemas(self):
+        """Test reporting added, removed and retyped fields."""
+        old = check_upstream.parse_php_schema(USER_DTO_V1)
+        new = check_upstream.parse_php_schema(USER_DTO_V2)
+        changes = check_upstream.diff_schemas(old, new)
+        
+        self.assertEqual(changes["status"], "modified")
+        self.assertEqual(changes["added"], {"isBot": "bool"})
+        self.assertEqual(changes["removed"], {"username": "string|null"})
+        self.assertEqual(changes["retyped"], {"id": ["int", "string"]})
+        self.assertEqual(changes["input_keys_added"], ["is_bot"])
+        self.assertEqual(changes["input_keys_removed"], [])
+        self.assertEqual(changes["output_keys_added"], ["is_bot"])
+        self.assertEqual(changes["output_keys_removed"], ["username"])
+        
+        self.assertIsNone(check_upstream.diff_schemas(old, old))
+        self.assertEqual(check_upstream.diff_schemas(None, new)["status"], "added")
+    
+    def test_parallel_parsing_matches_serial(self):
+        """Test that the process pool returns the same schemas in order."""
+        sources = [USER_DTO_V1.replace("class User", f"class User{i}") for i in range(20)]
+        
+        self.assertGreaterEqual(len(sources), check_upstream.SCHEMA_PARALLEL_THRESHOLD)
+        self.assertEqual(
+            check_upstream.parse_php_schemas(sources, max_workers=2),
+            [check_upstream.parse_php_schema(source) for source in sources],
+        )
+    
+    def test_schema_changes_in_report_are_cached_by_blob(self):
+        """Test the report section and that known blobs are not parsed again."""
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(__import__("shutil").rmtree, test_dir, True)
+        root = Path(test_dir)
+        upstream = FIXTURES.upstream(USER_DTO_HISTORY, root / "fixture")
+        first = upstream.commits[0]
+        
+        config_path = root / "upstream.json"
+        with open(config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "defstudio/telegraph", "local_path": str(upstream.clone), "backend": "native"},
+                "tracking": {"current_commit": first},
+                "cache": {"enabled": True, "path": str(root / "cache")},
+            }, f)
+        
+        tracker = UpstreamTracker(str(config_path))
+        report = tracker.generate_diff_report(first, "HEAD")
+        tracker.close()
+        
+        self.assertIn("## Schema Changes (1)\n### User (src/DTO/User.php)\n", report)
+        self.assertIn("- added property `$isBot: bool`", report)
+        self.assertIn("- retyped property `$id`: `int` -> `string`", report)
+        self.assertIn("- removed output key `username`", report)
+        self.assertLess(report.index("## Schema Changes"), report.index("## Detailed Diff"))
+        
+        tracker = UpstreamTracker(str(config_path))
+        with patch.object(check_upstream, "parse_php_schema") as parse:
+            changes = tracker.get_schema_changes(first, "HEAD")
+        tracker.close()
+        
+        parse.assert_not_called()
+        self.assertEqual(changes[0]["added"], {"isBot": "bool"})
+
+
+class TestTimings(unittest.TestCase):
+    """Per-phase spans and counters recorded by the tracker."""
+    
+    def setUp(self):
+        """Copy an upstream history with two commits."""
+        self.test_dir = tempfile.mkdtemp()
+        root = Path(self.test_dir)
+        upstream = FIXTURES.upstream(USER_DTO_HISTORY, root / "fixture")
+        self.first_commit = upstream.commits[0]
+        
+        self.config_path = root / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "defstudio/telegraph", "local_path": str(upstream.clone), "backend": "native"},
+                "tracking": {"current_commit": self.first_commit},
+            }, f)
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_spans_nest_and_count(self):
+        """Test that counters are attributed to every open span."""
+        timings = check_upstream.Timings()
+        
+        with timings.span("outer"):
+            timings.add(processes=2, bytes_read=10)
+            with timings.span("inner"):
+                timings.add(processes=1, bytes_read=5)
+        with timings.span("outer"):
+            pass
+        
+        self.assertEqual(timings.spans["outer"]["calls"], 2)
+        self.assertEqual(timings.spans["outer"]["processes"], 3)
+        self.assertEqual(timings.spans["outer/inner"]["bytes_read"], 5)
+        self.assertEqual(timings.totals, {"processes": 3, "bytes_read": 15})
+        self.assertEqual([e["cat"] for e in timings.events], ["outer/inner", "outer", "outer"])
+        
+        stream = io.StringIO()
+        timings.write_summary(stream)
+        self.assertEqual([line.split()[0] for line in stream.getvalue().splitlines()[1:]], ["outer", "inner", "total"])
+    
+    def test_generator_span_closes_while_suspended(self):
+        """Test that a timed generator's span covers only its own stretches, once per call."""
+        class Walker:
+            def __init__(self):
+                self.timings = check_upstream.Timings()
+            
+            @check_upstream._timed("walk", generator=True)
+            def walk(self):
+                self.timings.add(processes=1)
+                yield 1
+                yield 2
+        
+        walker = Walker()
+        timings = walker.timings
+        items = walker.walk()
+        next(items)
+        with timings.span("consumer"):
+            pass
+        items.close()
+        list(walker.walk())
+        
+        self.assertEqual(sorted(timings.spans), ["consumer", "walk"])
+        self.assertEqual(timings.spans["walk"]["calls"], 2)
+        self.assertEqual(timings.spans["walk"]["processes"], 2)
+    
+    def test_json_check_span_tree(self):
+        """Test that --check --format json records its phases side by side, not under a stale rev_walk."""
+        trace_path = Path(self.test_dir) / "trace.json"
+        argv = [
+            "check-upstream.py", "--config", str(self.config_path), "--check", "--format", "json",
+            "--output", str(Path(self.test_dir) / "report.json"), "--no-cache", "--profile", str(trace_path),
+        ]
+        
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=io.StringIO), \
+                patch('sys.stderr', new_callable=io.StringIO):
+            check_upstream.main()
+        
+        with open(trace_path, 'r') as f:
+            paths = {e["cat"] for e in json.load(f)["traceEvents"]}
+        self.assertIn("check_for_updates", paths)
+        self.assertIn("rev_walk", paths)
+        self.assertIn("diff_records", paths)
+        self.assertIn("diff_records/tree_diff", paths)
+        self.assertFalse([path for path in paths if "rev_walk/" in path], sorted(paths))
+    
+    def test_tracker_records_phases(self):
+        """Test that a report run records each phase for both backends."""
+        for backend in GIT_BACKENDS:
+            tracker = UpstreamTracker(str(self.config_path))
+            tracker.backend_name = backend
+            tracker.generate_diff_report(self.first_commit, "HEAD")
+            tracker.close()
+            
+            spans = tracker.timings.summary()
+            for phase in ("tree_diff", "schema", "schema/read_blobs", "schema/parse", "patches"):
+                self.assertIn(f"generate_diff_report/diff_report/{phase}", spans, backend)
+            
+            patches = spans["generate_diff_report/diff_report/patches"]
+            self.assertEqual(patches["processes"], 1, backend)
+            self.assertGreater(patches["bytes_read"], len(USER_DTO_V2) // 2, backend)
+            self.assertGreaterEqual(tracker.timings.totals["processes"], 2, backend)
+    
+    def test_cli_timings_and_trace(self):
+        """Test --timings output and the --profile trace-event file."""
+        trace_path = Path(self.test_dir) / "trace.json"
+        argv = [
+            "check-upstream.py", "--config", str(self.config_path), "--diff", self.first_commit, "HEAD",
+            "--output", str(Path(self.test_dir) / "report.md"), "--timings", "--profile", str(trace_path),
+        ]
+        
+        with patch('sys.argv', argv), patch('sys.stdout', new_callable=io.StringIO), \
+                patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            check_upstream.main()
+        
+        self.assertIn("=== Timings: defstudio/telegraph ===", stderr.getvalue())
+        self.assertRegex(stderr.getvalue(), r"\n    patches +1 ")
+        
+        with open(trace_path, 'r') as f:
+            events = json.load(f)["traceEvents"]
+        self.assertIn("generate_diff_report/diff_report/patches", [e["cat"] for e in events])
+        self.assertTrue(all(e["ph"] == "X" and e["dur"] >= 0 for e in events))
+
+
+# Sixty files of varied sizes, rewritten with non-ASCII text and invalid UTF-8
+RENDERING_HISTORY = RepoSpec("rendering-history", [
+    ("Add DTOs", {
+        f"src/DTO/Dto{i}.php": "".join(f"line {n} of {i}\n" for n in range(i * 40)) for i in range(60)
+    }),
+    ("Change DTOs", {
+        f"src/DTO/Dto{i}.php": "".join(f"línea {n} de {i} ✓\n" for n in range(i * 40)).encode() + b"\xff\xfe tail\n"
+        for i in range(60)
+    }),
+])
+
+
+class TestParallelRendering(unittest.TestCase):
+    """Reports rendered by worker processes must match the serial path."""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Copy an upstream range touching many files of varied sizes."""
+        cls.test_dir = tempfile.mkdtemp()
+        root = Path(cls.test_dir)
+        upstream = FIXTURES.upstream(RENDERING_HISTORY, root / "fixture")
+        cls.first_commit = upstream.commits[0]
+        
+        cls.config_path = root / "upstream.json"
+        with open(cls.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "defstudio/telegraph", "local_path": str(upstream.clone), "backend": "native"},
+                "tracking": {"current_commit": cls.first_commit},
+                "report": {"schema_changes": False},
+            }, f)
+    
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(cls.test_dir, ignore_errors=True)
+    
+    def _render(self, workers, max_file_bytes=None, max_total_bytes=None):
+        tracker = UpstreamTracker(str(self.config_path))
+        tracker.render_workers = workers
+        stream = io.StringIO()
+        with patch.object(check_upstream, "RENDER_BATCH_BYTES", 4096):
+            tracker.write_diff_report(self.first_commit, "HEAD", stream, max_file_bytes, max_total_bytes)
+        tracker.close()
+        # The generation timestamp is the only line allowed to differ
+        return re.sub(r"Generated: .*\n", "", stream.getvalue())
+    
+    def test_parallel_output_is_identical(self):
+        """Test identical reports with and without per-file and total limits."""
+        for limits in [(None, None), (2000, None), (None, 150000), (3000, 50000), (50, 10)]:
+            serial = self._render(1, *limits)
+            self.assertEqual(self._render(3, *limits), serial, limits)
+        
+        self.assertIn("... [truncated src/DTO/Dto59.php", self._render(3, 3000, None))
+        self.assertIn("... [report truncated: total patch limit of 50000 bytes reached", self._render(3, 3000, 50000))
+
+
+# Text, binary (by NUL byte and by attribute) and large files
+BINARY_HISTORY = RepoSpec("binary-history", [
+    ("Add files", {
+        ".gitattributes": "*.lock -diff\n",
+        "src/DTO/User.php": "<?php // v1\n",
+        "resources/logo.png": b"\x89PNG\0" + bytes(range(256)) * 4,
+        "resources/deps.lock": "a\n",
+        "resources/fixtures.json": "[1]\n" * 100,
+    }),
+    ("Change files", {
+        "src/DTO/User.php": "<?php // v2\n",
+        "resources/logo.png": b"\x89PNG\0" + bytes(range(256)) * 8,
+        "resources/deps.lock": "b\n",
+        "resources/fixtures.json": "[2]\n" * 3000,
+        "resources/icon.gif": b"GIF89a\0\0",
+    }),
+])
+
+
+class TestBinaryAndLargeFiles(unittest.TestCase):
+    """Binary and oversized files are summarized instead of diffed."""
+    
+    def setUp(self):
+        """Copy an upstream range changing text, binary and large files."""
+        self.test_dir = tempfile.mkdtemp()
+        root = Path(self.test_dir)
+        upstream = FIXTURES.upstream(BINARY_HISTORY, root / "fixture")
+        self.first_commit = upstream.commits[0]
+        
+        self.config_path = root / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "defstudio/telegraph", "local_path": str(upstream.clone)},
+                "tracking": {"current_commit": self.first_commit},
+                "report": {"max_blob_bytes": 4096, "schema_changes": False},
+            }, f)
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_summarized_files_are_not_diffed(self):
+        """Test detection by NUL bytes, diff attributes and size on both backends."""
+        for backend in sorted(check_upstream.GIT_BACKENDS):
+            tracker = UpstreamTracker(str(self.config_path))
+            tracker.backend_name = backend
+            tracker.cache = None
+            snapshot = tracker.get_diff_snapshot(self.first_commit, "HEAD")
+            
+            summarized = {change.path: change for change in snapshot.summarized()}
+            self.assertEqual(
+                sorted(summarized), ["resources/deps.lock", "resources/fixtures.json", "resources/icon.gif", "resources/logo.png"], backend,
+            )
+            self.assertTrue(summarized["resources/logo.png"].binary)
+            self.assertTrue(summarized["resources/deps.lock"].binary)
+            self.assertFalse(summarized["resources/fixtures.json"].binary)
+            self.assertEqual(summarized["resources/fixtures.json"].b_size, 12000)
+            
+            patched = {change.path for change, _ in snapshot.iter_patch_lines()}
+            self.assertEqual(patched, {"src/DTO/User.php"}, backend)
+            
+            stream = io.StringIO()
+            tracker.write_diff_report(self.first_commit, "HEAD", stream)
+            report = stream.getvalue()
+            tracker.close()
+            
+            self.assertIn("## Binary and Large Files (4)\n", report)
+            logo = summarized["resources/logo.png"]
+            self.assertIn(
+                f"- resources/logo.png (binary): 1.0 KiB -> 2.0 KiB, +1.0 KiB (`{logo.a_blob[:12]} -> {logo.b_blob[:12]}`)\n",
+                report,
+            )
+            self.assertIn("- resources/icon.gif (binary): new, 8 B (`", report)
+            self.assertIn("- resources/fixtures.json (large): 400 B -> 11.7 KiB, +11.3 KiB", report)
+            self.assertNotIn("diff --git a/resources", report)
+            self.assertIn("+<?php // v2", report)
+    
+    def test_paths_stay_off_the_command_line(self):
+        """Test that classification and patches do not list files as arguments."""
+        for backend_name in sorted(check_upstream.GIT_BACKENDS):
+            tracker = UpstreamTracker(str(self.config_path))
+            tracker.backend_name = backend_name
+            tracker.cache = None
+            snapshot = tracker.get_diff_snapshot(self.first_commit, "HEAD")
+            backend = tracker._get_backend()
+            calls = []
+            
+            def recorded(method):
+                def call(command, *args, **kwargs):
+                    calls.append((command, args, kwargs))
+                    return method(command, *args, **kwargs)
+                return call
+            
+            with patch.object(backend, 'run', recorded(backend.run)), \
+                    patch.object(backend, 'stream', recorded(backend.stream)):
+                self.assertEqual(len(snapshot.summarized()), 4, backend_name)
+                patched = {change.path for change, _ in snapshot.iter_patch_lines()}
+                snapshot.stats(snapshot.changes[0])
+            tracker.close()
+            
+            self.assertEqual(patched, {"src/DTO/User.php"}, backend_name)
+            # One numstat for binary status and stats, one size lookup, one patch stream
+            self.assertEqual([command for command, _, _ in calls], ["diff", "cat-file", "diff"], backend_name)
+            self.assertIn("--numstat", calls[0][1])
+            self.assertEqual(calls[0][2]["config"], {"core.bigFileThreshold": "4096"})
+            logo = next(change for change in snapshot if change.path == "resources/logo.png")
+            self.assertIn(f"{logo.b_blob}\n", calls[1][2]["input"])
+            for command, args, kwargs in calls:
+                self.assertFalse([arg for arg in args if "resources/" in arg], (backend_name, command))
+            self.assertEqual(calls[2][2]["config"], {"core.bigFileThreshold": "4096"})
+    
+    def test_missing_blob_sizes_are_unknown(self):
+        """Test that blobs missing from the object store are reported with unknown sizes."""
+        tracker = UpstreamTracker(str(self.config_path))
+        tracker.cache = None
+        backend = tracker._get_backend()
+        snapshot = tracker.get_diff_snapshot(self.first_commit, "HEAD")
+        logo = next(change for change in snapshot if change.path == "resources/logo.png")
+        icon = next(change for change in snapshot if change.path == "resources/icon.gif")
+        blob_sizes = backend.blob_sizes
+        
+        def partial_sizes(shas):
+            sizes = blob_sizes(shas)
+            return {sha: size for sha, size in sizes.items() if sha not in (logo.b_blob, icon.b_blob)}
+        
+        stream = io.StringIO()
+        with patch.object(backend, 'blob_sizes', side_effect=partial_sizes):
+            tracker.write_diff_report(self.first_commit, "HEAD", stream)
+        tracker.close()
+        
+        report = stream.getvalue()
+        self.assertIn("## Binary and Large Files (4)\n", report)
+        self.assertIn("- resources/logo.png (binary): 1.0 KiB -> unknown, change unknown (`", report)
+        self.assertIn("- resources/icon.gif (binary): new, unknown (`", report)
+    
+    def test_limit_can_be_disabled(self):
+        """Test that without a size limit only binary files are summarized."""
+        tracker = UpstreamTracker(str(self.config_path))
+        tracker.max_blob_bytes = 0
+        snapshot = tracker.get_diff_snapshot(self.first_commit, "HEAD")
+        
+        self.assertEqual(
+            sorted(change.path for change in snapshot.summarized()),
+            ["resources/deps.lock", "resources/icon.gif", "resources/logo.png"],
+        )
+        self.assertEqual(snapshot.stats(next(c for c in snapshot if c.path == "resources/fixtures.json")), (3000, 100))
+        tracker.close()
+
+
+RECORD_HISTORY = RepoSpec("record-history", [
+    ("Add User", {"src/DTO/User.php": USER_DTO_V1, "src/logo.png": b"\x89PNG\0v1"}),
+    ("Rename username\n\nWith a body", {
+        "src/DTO/User.php": USER_DTO_V2,
+        "src/DTO/Chat.php": "<?php\n" + "// line\n" * 1000,
+        "src/logo.png": b"\x89PNG\0v2",
+    }),
+])
+
+
+class TestRecordOutput(unittest.TestCase):
+    """JSON and NDJSON reports for CI consumers."""
+    
+    def setUp(self):
+        """Copy an upstream range with a DTO change, a new file and a binary."""
+        self.test_dir = tempfile.mkdtemp()
+        root = Path(self.test_dir)
+        upstream = FIXTURES.upstream(RECORD_HISTORY, root / "fixture")
+        self.first_commit, self.second_commit = upstream.commits
+        
+        self.config_path = root / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "defstudio/telegraph", "local_path": str(upstream.clone)},
+                "tracking": {"current_commit": self.first_commit},
+                "files": {"categories": {"dto_classes": {"count": 2, "include": ["src/**"]}}},
+            }, f)
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_write_records_json_document(self):
+        """Test that records are grouped by type and missing lists are empty."""
+        stream = io.StringIO()
+        counts = check_upstream.write_records(
+            [{"type": "report", "to_commit": "abc"}, {"type": "file", "path": "a"}, {"type": "file", "path": "b"}],
+            stream, "json",
+        )
+        document = json.loads(stream.getvalue())
+        
+        self.assertEqual(counts, {"report": 1, "file": 2})
+        self.assertEqual(list(document), ["report", "commits", "affected", "files", "schema_changes", "summary"])
+        self.assertEqual(document["commits"], [])
+        self.assertEqual([f["path"] for f in document["files"]], ["a", "b"])
+        self.assertEqual(document["summary"]["counts"], {"report": 1, "file": 2})
+        
+        with self.assertRaises(ValueError):
+            check_upstream.write_records([{"type": "file"}, {"type": "commit"}], io.StringIO(), "json")
+    
+    def test_diff_records(self):
+        """Test file records with stats, categories, sizes and capped patches."""
+        tracker = UpstreamTracker(str(self.config_path))
+        records = list(tracker.iter_diff_records(self.first_commit, self.second_commit, patches=True, max_file_bytes=4000))
+        tracker.close()
+        self.assertIn("diff_records", tracker.timings.spans)
+        self.assertNotIn("stream_diff_report", tracker.timings.spans)
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.stream_diff_report(self.first_commit, self.second_commit, str(Path(self.test_dir) / "report.md"))
+        tracker.close()
+        self.assertGreater(tracker.timings.spans["stream_diff_report"]["seconds"], 0)
+        self.assertTrue(any(path.startswith("stream_diff_report/") for path in tracker.timings.spans))
+        
+        files = {r["path"]: r for r in records if r["type"] == "file"}
+        self.assertEqual(sorted(files), ["src/DTO/Chat.php", "src/DTO/User.php", "src/logo.png"])
+        
+        chat = files["src/DTO/Chat.php"]
+        self.assertEqual((chat["change_type"], chat["insertions"], chat["deletions"]), ("added", 1001, 0))
+        self.assertEqual(chat["category"], "dto_classes")
+        self.assertTrue(chat["patch_truncated"])
+        self.assertEqual(len(chat["patch"]), 4000)
+        
+        user = files["src/DTO/User.php"]
+        self.assertFalse(user["patch_truncated"])
+        self.assertIn("+++ b/src/DTO/User.php", user["patch"])
+        
+        logo = files["src/logo.png"]
+        self.assertTrue(logo["binary"])
+        self.assertEqual((logo["insertions"], logo["patch"], logo["new_size"]), (None, "", 7))
+        
+        schema = [r for r in records if r["type"] == "schema_change"]
+        self.assertEqual([r["path"] for r in schema], ["src/DTO/User.php"])
+        self.assertEqual(records[-1]["type"], "schema_change")
+    
+    def test_ndjson_cli_keeps_stdout_clean(self):
+        """Test that --format ndjson writes only records to stdout."""
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT_PATH), "--config", str(self.config_path),
+             "--diff", self.first_commit, self.second_commit, "--format", "ndjson", "--no-cache"],
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        
+        records = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual(
+            [r["type"] for r in records],
+            ["report", "commit", "file", "file", "file", "schema_change", "summary"],
+        )
+        self.assertEqual(records[1], {"type": "commit", "sha": self.second_commit, "message": "Rename username\n\nWith a body"})
+        self.assertNotIn("patch", records[2])
+        self.assertEqual(records[-1]["counts"]["file"], 3)
+
+
+# Commits a minute apart from BASE_TIMESTAMP, the last one renaming an enum
+COMMIT_INDEX_HISTORY = RepoSpec("commit-index-history", [
+    ("Add User and Role", {"src/DTO/User.php": "<?php // v1\n", "src/Enums/Role.php": "<?php\n", "README.md": "a\n"}),
+    ("Change User", {"src/DTO/User.php": "<?php // v2\n"}),
+    ("Change README", {"README.md": "b\n"}),
+    ("Rename Role", {"src/Enums/Role.php": None, "src/Enums/Status.php": "<?php\n"}),
+])
+
+
+class TestCommitIndex(unittest.TestCase):
+    """The SQLite commit index answers history questions without walking it."""
+    
+    def setUp(self):
+        """Copy an upstream history touching DTOs, enums and untracked files."""
+        self.test_dir = tempfile.mkdtemp()
+        root = Path(self.test_dir)
+        self.upstream = FIXTURES.upstream(COMMIT_INDEX_HISTORY, root / "fixture")
+        self.repo = self.upstream.clone
+        self.commits = list(self.upstream.commits)
+        
+        self.config_path = root / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "defstudio/telegraph", "local_path": str(self.repo)},
+                "tracking": {"current_commit": self.commits[1]},
+                "files": {"categories": {
+                    "dto_classes": {"count": 1, "include": ["src/DTO/**/*.php"], "local": {"src/DTO/": "lib/DTO/"}},
+                    "enums": {"count": 1, "include": ["src/Enums/*.php"]},
+                }},
+                "commit_index": {"enabled": True, "path": "index.sqlite"},
+            }, f)
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def _push(self, files, message, parent=None, merge=None):
+        """Push a commit upstream and move the clone to it."""
+        commit = self.upstream.push(files, message, parent, merge)
+        run_git(self.repo, "fetch", "-q", "origin")
+        run_git(self.repo, "reset", "-q", "--hard", "origin/main")
+        self.commits.append(commit)
+        return commit
+    
+    def _shas(self, commits):
+        return [self.commits.index(commit["sha"]) for commit in commits]
+    
+    def test_queries(self):
+        """Test lookups by local file, upstream path, category and dates."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        # Only commits touching tracked paths are indexed
+        self.assertEqual(tracker.update_commit_index(), 3)
+        
+        self.assertEqual(self._shas(tracker.query_commits(path="lib/DTO/User.php")), [1, 0])
+        self.assertEqual(self._shas(tracker.query_commits(path="src/Enums/Role.php")), [3, 0])
+        
+        enums = tracker.query_commits(category="enums")
+        self.assertEqual(self._shas(enums), [3, 0])
+        self.assertEqual(enums[0]["files"], [{
+            "change_type": "renamed", "path": "src/Enums/Status.php", "old_path": "src/Enums/Role.php", "category": "enums",
+        }])
+        self.assertEqual(enums[0]["subject"], "Rename Role")
+        
+        since, until = f"@{BASE_TIMESTAMP + 30}", f"@{BASE_TIMESTAMP + 90}"
+        self.assertEqual(self._shas(tracker.query_commits(since=since, until=until)), [1])
+        self.assertEqual(self._shas(tracker.query_commits(since_sync=True)), [3])
+        self.assertEqual(tracker.query_commits(category="enums", since=f"@{BASE_TIMESTAMP + 600}"), [])
+        tracker.close()
+    
+    def test_index_failure_does_not_hide_updates(self):
+        """Test that a check still reports updates when the index cannot be updated."""
+        import sqlite3
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch.object(tracker, "fetch_upstream", return_value=self.commits[3]), \
+                patch.object(tracker, "update_commit_index", side_effect=sqlite3.OperationalError("database is locked")), \
+                patch('sys.stderr', new_callable=io.StringIO) as errors:
+            has_updates, new_commit, commits = tracker.check_for_updates()
+        
+        self.assertTrue(has_updates)
+        self.assertEqual(new_commit, self.commits[3])
+        self.assertIsNone(tracker.check_error)
+        self.assertIn("Error updating the commit index: database is locked", errors.getvalue())
+        tracker.close()
+    
+    def test_since_sync_includes_merged_older_commits(self):
+        """Test that a branch committed before the sync but merged after it counts as new."""
+        side = self._push({"src/DTO/Chat.php": "<?php // chat\n"}, "Add Chat", parent=self.commits[0])
+        synced = self._push({"src/Enums/Status.php": "<?php // v2\n"}, "Change Status", parent=self.commits[3])
+        self._push({"src/Enums/Status.php": "<?php // v3\n"}, "Change Status again")
+        self._push({"src/DTO/Chat.php": "<?php // chat\n"}, "Merge Chat", merge=side)
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        # Synced after the side branch was committed, before it was merged
+        tracker.config["tracking"]["current_commit"] = synced
+        
+        self.assertEqual(self._shas(tracker.query_commits(since_sync=True)), [6, 4])
+        self.assertEqual(self._shas(tracker.query_commits(since_sync=True, category="dto_classes")), [4])
+        tracker.close()
+    
+    def test_incremental_update_and_rewrite(self):
+        """Test that later updates read only new commits and survive rewritten history."""
+        tracker = UpstreamTracker(str(self.config_path))
+        tracker.update_commit_index()
+        
+        self._push({"src/DTO/User.php": "<?php // v3\n"}, "Change User again")
+        self.assertEqual(tracker.update_commit_index(), 1)
+        self.assertEqual(tracker.update_commit_index(), 0)
+        self.assertEqual(self._shas(tracker.query_commits(category="dto_classes")), [4, 1, 0])
+        
+        # Upstream force-pushed: the indexed head is no longer an ancestor
+        self._push({"src/DTO/User.php": "<?php // v4\n"}, "Rewrite User", parent=self.commits[1])
+        self.assertEqual(tracker.update_commit_index(), 3)
+        self.assertEqual(self._shas(tracker.query_commits()), [5, 1, 0])
+        tracker.close()
+    
+    def test_query_command(self):
+        """Test the --query command output."""
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT_PATH), "--config", str(self.config_path), "--query", "--category", "enums"],
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertRegex(result.stdout, rf"{self.commits[3][:8]} \d{{4}}-\d{{2}}-\d{{2}} Rename Role\n")
+        self.assertIn("    renamed  src/Enums/Role.php -> src/Enums/Status.php [enums]\n", result.stdout)
+        self.assertIn("2 matching commit(s)", result.stdout)
+
+
+UPSTREAM_USER = """<?php
+
+namespace DefStudio\\Telegraph\\DTO;
+
+use Illuminate\\Contracts\\Support\\Arrayable;
+use Illuminate\\Support\\Collection;
+
+class User implements Arrayable
+{
+    use HasStorage;
+
+    private int $id;
+    private Collection $photos;
+
+    public function id(): int
+    {
+        return $this->id;
+    }
+}
+"""
+
+LOCAL_USER = """<?php
+
+declare(strict_types=1);
+
+/**
+ * Inspired by: defstudio/telegraph (https://github.com/defstudio/telegraph)
+ */
+
+namespace Telegram\\Objects\\DTO;
+
+use Telegram\\Objects\\Contracts\\Arrayable;
+
+class User implements Arrayable
+{
+    use HasStorage;
+
+    private int $id;
+    private \\Illuminate\\Support\\Collection $photos;
+
+    // Kept as in upstream
+    public function id(): int { return $this->id; }
+}
+"""
+
+DRIFT_HISTORY = RepoSpec("drift-history", [
+    ("Add DTOs", {
+        "src/DTO/User.php": UPSTREAM_USER,
+        "src/DTO/Chat.php": UPSTREAM_USER.replace("User", "Chat"),
+        "src/DTO/Poll.php": UPSTREAM_USER.replace("User", "Poll"),
+    }),
+])
+
+
+class TestDrift(unittest.TestCase):
+    """Local ports compared with upstream sources after normalization."""
+    
+    def setUp(self):
+        """Copy an upstream with three DTOs and write their local ports."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        upstream = FIXTURES.upstream(DRIFT_HISTORY, self.test_dir / "fixture")
+        self.commit = upstream.commits[0]
+        
+        self.ports = self.test_dir / "src" / "DTO"
+        self.ports.mkdir(parents=True)
+        self._write("User.php", LOCAL_USER)
+        self._write("Chat.php", LOCAL_USER.replace("User", "Chat").replace("private int $id;", "private int $id;\n    private string $title;"))
+        
+        self.config_path = self.test_dir / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "test/repo", "local_path": str(upstream.clone), "backend": "native"},
+                "tracking": {"current_commit": self.commit, "last_sync_commit": self.commit},
+                "files": {"categories": {"dto_classes": {"include": ["src/DTO/**"], "local": {"src/DTO/": "src/DTO/"}}}},
+            }, f)
+    
+    def tearDown(self):
+        """Clean up the fixture and ports."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def _write(self, name, content, age=60):
+        """Write a local port with an mtime safely in the past."""
+        path = self.ports / name
+        path.write_text(content)
+        past = time.time() - age
+        os.utime(path, (past, past))
+    
+    def test_normalize_php(self):
+        """Test that namespace, imports, comments and whitespace are ignored."""
+        upstream = check_upstream.normalize_php(UPSTREAM_USER)
+        
+        self.assertEqual(upstream, [
+            "class User implements Arrayable {", "use HasStorage;", "private int $id;", "private Collection $photos;",
+            "public function id(): int {", "return $this->id;", "}", "}",
+        ])
+        self.assertEqual(check_upstream.normalize_php(LOCAL_USER), upstream)
+        self.assertEqual(check_upstream.divergence_score(upstream, upstream), 0.0)
+        self.assertEqual(check_upstream.divergence_score(upstream, []), 1.0)
+    
+    def test_drift_scores_and_cache(self):
+        """Test per-file scores and that a repeat run only rehashes changed files."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        result = tracker.drift()
+        
+        self.assertEqual(result["commit"], self.commit)
+        self.assertEqual([entry["local"] for entry in result["files"]], ["src/DTO/Chat.php", "src/DTO/User.php"])
+        chat, user = result["files"]
+        self.assertGreater(chat["score"], 0)
+        self.assertEqual(user["score"], 0.0)
+        self.assertEqual(result["hashed"], {"local": 2, "upstream": 2})
+        
+        again = tracker.drift()
+        self.assertEqual(again["files"], result["files"])
+        self.assertEqual(again["hashed"], {"local": 0, "upstream": 0})
+        
+        self._write("User.php", LOCAL_USER.replace("$this->id;", "$this->id + 1;"))
+        third = tracker.drift(category="dto_classes")
+        self.assertEqual(third["hashed"], {"local": 1, "upstream": 0})
+        self.assertGreater(next(e for e in third["files"] if e["local"] == "src/DTO/User.php")["score"], 0)
+        self.assertEqual(tracker.drift(category="enums")["files"], [])
+        tracker.close()
+
+
+class TestShardedReport(unittest.TestCase):
+    """Diffstat index with per-file patch shards."""
+    
+    def setUp(self):
+        """Copy a history with an add, modify, delete and rename."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        upstream = FIXTURES.upstream(BACKEND_HISTORY, self.test_dir / "fixture")
+        self.first, self.second = upstream.commits
+        self.config_path = self.test_dir / "upstream.json"
+        self.config = {
+            "repository": {"name": "test/repo", "local_path": str(upstream.clone), "backend": "native"},
+            "tracking": {"current_commit": self.first},
+            "files": {"categories": {
+                "dto_classes": {"include": ["src/DTO/**"], "local": {"src/DTO/": "lib/Dto/"}},
+                "enums": {"include": ["src/Enums/**"]},
+            }},
+            "report": {"schema_changes": False, "shard_categories": ["dto_classes"]},
+        }
+        with open(self.config_path, 'w') as f:
+            json.dump(self.config, f)
+        self.shards = self.test_dir / "report"
+    
+    def tearDown(self):
+        """Clean up the fixture and shards."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_index_skips_patch_generation(self):
+        """Test numstat counts per file and category without running git diff for patches."""
+        tracker = UpstreamTracker(str(self.config_path))
+        stream = io.StringIO()
+        
+        with patch.object(check_upstream.DiffSnapshot, "iter_patch_lines", side_effect=AssertionError("patch read")):
+            tracker.write_report_index(self.first, self.second, stream)
+        
+        index = stream.getvalue()
+        self.assertIn("Total files changed: 4 (+2 -2)", index)
+        self.assertIn("| dto_classes | 3 | 2 | 1 |\n| enums | 1 | 0 | 1 |", index)
+        self.assertIn("| src/DTO/Old.php -> src/DTO/Renamed.php | renamed | 0 | 0 |\n", index)
+        self.assertIn("| src/DTO/User.php | modified | 1 | 1 |\n", index)
+        self.assertNotIn("Patch", index)
+        self.assertNotIn("```diff", index)
+        tracker.close()
+    
+    def test_shards_for_configured_categories(self):
+        """Test one shard per file of the shard categories, linked from the index."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch('sys.stdout', new_callable=io.StringIO) as output:
+            tracker.write_sharded_report(self.first, self.second, str(self.shards))
+        
+        self.assertIn("3 patch shard(s) written", output.getvalue())
+        self.assertEqual(
+            sorted(p.name for p in self.shards.iterdir()),
+            ["index.md", "src__DTO__New.php.diff", "src__DTO__Renamed.php.diff", "src__DTO__User.php.diff"],
+        )
+        user = (self.shards / "src__DTO__User.php.diff").read_text()
+        self.assertTrue(user.startswith("diff --git a/src/DTO/User.php b/src/DTO/User.php\n"))
+        self.assertIn("+<?php // user v2\n", user)
+        self.assertIn("rename from src/DTO/Old.php", (self.shards / "src__DTO__Renamed.php.diff").read_text())
+        
+        index = (self.shards / "index.md").read_text()
+        self.assertIn("| src/DTO/User.php | modified | 1 | 1 | [diff](src__DTO__User.php.diff) |", index)
+        self.assertIn("| src/Enums/Gone.php | deleted | 0 | 1 | |", index)
+        tracker.close()
+    
+    def test_expand_on_demand(self):
+        """Test expanding single files, given by local or upstream path."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.write_sharded_report(self.first, self.second, str(self.shards), ["lib/Dto/User.php"])
+        self.assertEqual(sorted(p.name for p in self.shards.iterdir()), ["index.md", "src__DTO__User.php.diff"])
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.write_sharded_report(self.first, self.second, str(self.shards), ["src/Enums/Gone.php"])
+        
+        self.assertIn("-<?php", (self.shards / "src__Enums__Gone.php.diff").read_text())
+        index = (self.shards / "index.md").read_text()
+        # Shards written by earlier runs stay linked
+        self.assertIn("[diff](src__DTO__User.php.diff)", index)
+        self.assertIn("[diff](src__Enums__Gone.php.diff)", index)
+        self.assertIn("| src/DTO/New.php | added | 1 | 0 | |", index)
+        tracker.close()
+    
+    def test_report_on_stdout_keeps_progress_off_it(self):
+        """Test that with --output - stdout carries only the report."""
+        for extra in (["--summary"], ["--stream"], []):
+            result = subprocess.run(
+                [sys.executable, str(SCRIPT_PATH), "--config", str(self.config_path),
+                 "--diff", self.first, self.second, "--output", "-", "--no-cache", *extra],
+                capture_output=True, text=True, cwd=self.test_dir,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertTrue(result.stdout.startswith("# Upstream Diff Report\n"), (extra, result.stdout[:200]))
+            self.assertIn("Generating diff from", result.stderr)
+            self.assertIn("src/DTO/User.php", result.stdout)
+        self.assertFalse((self.test_dir / "-").exists())
+
+
+MATRIX_HISTORY = RepoSpec("matrix-history", [
+    ("Base", {"src/DTO/User.php": "<?php // user\n", "src/DTO/Old.php": "<?php // old\n" * 20,
+              "src/Enums/Gone.php": "<?php\n", "README.md": "# readme\n"}),
+    ("Change User", {"src/DTO/User.php": "<?php // user v2\n", "README.md": "# readme v2\n"}),
+    ("Rename Old, add Chat", {"src/DTO/Old.php": None, "src/DTO/New.php": "<?php // old\n" * 20,
+                              "src/DTO/Chat.php": "<?php // chat\n"}),
+    ("Drop Gone", {"src/Enums/Gone.php": None}),
+], tags={"v1.0.0": 0, "v1.1.0": 1, "v2.0.0": 3})
+
+
+class TestDiffMatrix(unittest.TestCase):
+    """One base compared with several release tags."""
+    
+    def setUp(self):
+        """Copy a tagged history and point a config at it."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.upstream = FIXTURES.upstream(MATRIX_HISTORY, self.test_dir / "fixture")
+        self.config_path = self.test_dir / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "test/repo", "local_path": str(self.upstream.clone), "backend": "native"},
+                "tracking": {"current_commit": self.upstream.commits[0]},
+                "files": {"categories": {
+                    "dto_classes": {"include": ["src/DTO/**"]},
+                    "enums": {"include": ["src/Enums/**"]},
+                }},
+            }, f)
+    
+    def tearDown(self):
+        """Clean up the fixture."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_matrix(self):
+        """Test per-target change types computed from one listing per tree."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        # The tags only exist upstream until the matrix fetches them
+        with patch('sys.stderr', new_callable=io.StringIO) as errors:
+            matrix = tracker.diff_matrix("v1.0.0", ["v1.1.0", "v2.0.0"])
+        self.assertIn("Fetching v1.0.0, v1.1.0, v2.0.0 from upstream...", errors.getvalue())
+        
+        self.assertEqual(matrix["base"], self.upstream.commits[0])
+        self.assertEqual([t["sha"] for t in matrix["targets"]], [self.upstream.commits[1], self.upstream.commits[3]])
+        self.assertEqual(matrix["targets"][1]["counts"], {"modified": 1, "added": 1, "deleted": 1, "renamed": 1})
+        self.assertEqual(matrix["files"], {
+            "src/DTO/User.php": {"category": "dto_classes", "changes": {"v1.1.0": "modified", "v2.0.0": "modified"}},
+            "src/DTO/New.php": {"category": "dto_classes", "changes": {"v2.0.0": "renamed"}},
+            "src/DTO/Chat.php": {"category": "dto_classes", "changes": {"v2.0.0": "added"}},
+            "src/Enums/Gone.php": {"category": "enums", "changes": {"v2.0.0": "deleted"}},
+        })
+        # One fetch for all three tags, then one listing per tree
+        self.assertEqual(tracker.timings.summary()["diff_matrix"]["processes"], 5)
+        
+        # Trees listed once are reused by later comparisons
+        stream = io.StringIO()
+        tracker.write_diff_matrix("v1.0.0", ["v2.0.0", "v1.1.0"], stream)
+        self.assertEqual(tracker.timings.summary()["diff_matrix"]["processes"], 5)
+        
+        report = stream.getvalue()
+        self.assertIn("| v2.0.0 | " + self.upstream.commits[3][:8] + " | 4 | 1 | 1 | 1 | 1 |", report)
+        self.assertIn("## dto_classes (3)\n| File | v2.0.0 | v1.1.0 |\n|---|---|---|\n| src/DTO/Chat.php | A |  |", report)
+        self.assertIn("| src/DTO/User.php | M | M |", report)
+        self.assertIn("## enums (1)", report)
+        
+        with patch('sys.stderr', new_callable=io.StringIO), self.assertRaisesRegex(ValueError, "Unknown revision v9.9.9"):
+            tracker.diff_matrix("v1.0.0", ["v9.9.9"])
+        tracker.close()
+
+
+LAST_MODIFIED_HISTORY = RepoSpec("last-modified-history", [
+    ("Base", {"src/DTO/User.php": "<?php // user\n", "src/DTO/Chat.php": "<?php // chat\n",
+              "README.md": "# readme\n"}),
+    ("Change User", {"src/DTO/User.php": "<?php // user v2\n"}),
+    ("Change Chat", {"src/DTO/Chat.php": "<?php // chat v2\n", "README.md": "# readme v2\n"}),
+    ("Add Poll", {"src/Enums/Poll.php": "<?php // poll\n"}),
+])
+
+
+class TestLastModified(unittest.TestCase):
+    """Last-touching commits of every tracked file from one history walk."""
+    
+    def setUp(self):
+        """Copy an upstream history and point a config at it."""
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.upstream = FIXTURES.upstream(LAST_MODIFIED_HISTORY, self.test_dir / "fixture")
+        self.config_path = self.test_dir / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                "repository": {"name": "test/repo", "local_path": str(self.upstream.clone), "backend": "native"},
+                "tracking": {"current_commit": self.upstream.commits[3], "last_checked": None},
+                "files": {"extracted_count": 3, "categories": {
+                    "dto_classes": {"include": ["src/DTO/**"]},
+                    "enums": {"include": ["src/Enums/**"]},
+                }},
+                "sync_status": {"up_to_date": True, "pending_changes": []},
+                "last_modified": {"enabled": True, "show": 1},
+            }, f)
+    
+    def tearDown(self):
+        """Clean up the fixture."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_single_walk_stops_when_resolved(self):
+        """Test that the walk stops at the commit resolving the last path."""
+        commits = self.upstream.commits
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        index = tracker.update_last_modified()
+        
+        self.assertEqual(index["commit"], commits[3])
+        self.assertEqual(index["files"], {
+            "src/DTO/Chat.php": {"commit": commits[2], "time": 1700000120, "category": "dto_classes"},
+            "src/DTO/User.php": {"commit": commits[1], "time": 1700000060, "category": "dto_classes"},
+            "src/Enums/Poll.php": {"commit": commits[3], "time": 1700000180, "category": "enums"},
+        })
+        # The base commit is never read
+        self.assertEqual(index["commits_read"], 3)
+        self.assertTrue(tracker.last_modified_path.exists())
+        self.assertEqual(tracker.update_last_modified()["commits_read"], 0)
+        tracker.close()
+    
+    def test_stopped_walk_reaps_git_log(self):
+        """Test that the git log abandoned by the early stop is killed and waited for."""
+        tracker = UpstreamTracker(str(self.config_path))
+        backend = tracker._get_backend()
+        started = []
+        stream = backend.stream
+        
+        def recording_stream(*args, **kwargs):
+            started.append(stream(*args, **kwargs))
+            return started[-1]
+        
+        with patch.object(backend, 'stream', side_effect=recording_stream):
+            tracker.update_last_modified()
+        tracker.close()
+        
+        proc = started[0].proc
+        while hasattr(proc, "proc"):
+            proc = proc.proc
+        self.assertIsNotNone(proc.returncode)
+    
+    def test_incremental_update(self):
+        """Test that new commits are walked on their own and deleted files dropped."""
+        tracker = UpstreamTracker(str(self.config_path))
+        tracker.update_last_modified()
+        tracker.close()
+        
+        newest = self.upstream.push({"src/DTO/User.php": "<?php // user v3\n", "src/DTO/Chat.php": None}, "Drop Chat")
+        run_git(self.upstream.clone, "fetch", "-q", "origin")
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        index = tracker.update_last_modified(newest)
+        
+        self.assertEqual(index["commits_read"], 1)
+        self.assertEqual(sorted(index["files"]), ["src/DTO/User.php", "src/Enums/Poll.php"])
+        self.assertEqual(index["files"]["src/DTO/User.php"]["commit"], newest)
+        self.assertEqual(index["files"]["src/Enums/Poll.php"]["commit"], self.upstream.commits[3])
+        
+        # Going back to an older commit is not incremental, so the index is rebuilt
+        rebuilt = tracker.update_last_modified(self.upstream.commits[3])
+        self.assertEqual(sorted(rebuilt["files"]), ["src/DTO/Chat.php", "src/DTO/User.php", "src/Enums/Poll.php"])
+        tracker.close()
+    
+    def test_check_refreshes_index(self):
+        """Test that --check indexes the tracked commit and skips the walk once indexed."""
+        commits = self.upstream.commits
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch.object(tracker, 'fetch_upstream', return_value=commits[3]), \
+                patch('sys.stdout', new_callable=io.StringIO):
+            tracker.check_for_updates()
+        self.assertEqual(tracker.load_last_modified()["commit"], commits[3])
+        
+        with patch.object(tracker, 'fetch_upstream', return_value=commits[3]), \
+                patch.object(tracker, 'update_last_modified', side_effect=AssertionError("index walked again")), \
+                patch('sys.stdout', new_callable=io.StringIO):
+            tracker.check_for_updates()
+        tracker.close()
+    
+    def test_update_leaves_index_to_check(self):
+        """Test that --update only records the commit, even without the clone."""
+        tracker = UpstreamTracker(str(self.config_path))
+        tracker.update_last_modified()
+        tracker.close()
+        import shutil
+        shutil.rmtree(self.upstream.clone)
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        with patch('sys.stdout', new_callable=io.StringIO), \
+                patch('sys.stderr', new_callable=io.StringIO) as errors:
+            tracker.update_tracking("f" * 40)
+        tracker.close()
+        
+        self.assertEqual(tracker.config["tracking"]["current_commit"], "f" * 40)
+        self.assertEqual(errors.getvalue(), "")
+        self.assertEqual(tracker.load_last_modified()["commit"], self.upstream.commits[3])
+    
+    def test_status_lists_stalest_and_freshest(self):
+        """Test that --status shows both ends of the stored index without running git."""
+        tracker = UpstreamTracker(str(self.config_path))
+        tracker.update_last_modified()
+        tracker.close()
+        import shutil
+        shutil.rmtree(self.upstream.clone)
+        
+        tracker = UpstreamTracker(str(self.config_path))
+        with patch.object(tracker, '_get_backend', side_effect=AssertionError("status ran git")), \
+                patch('sys.stdout', new_callable=io.StringIO) as output:
+            tracker.status()
+        
+        commits = self.upstream.commits
+        self.assertIn(f"Last modified (3 tracked files at {commits[3][:8]}):", output.getvalue())
+        self.assertRegex(output.getvalue(), rf" Stalest:\n  \S+  {commits[1][:8]}  src/DTO/User.php\n")
+        self.assertRegex(output.getvalue(), rf" Freshest:\n  \S+  {commits[3][:8]}  src/Enums/Poll.php\n")
+    
+    def test_status_before_indexing(self):
+        """Test that --status without a stored index says so instead of building one."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch.object(tracker, '_get_backend', side_effect=AssertionError("status ran git")), \
+                patch('sys.stdout', new_callable=io.StringIO) as output:
+            tracker.status()
+        
+        self.assertIn("Current commit: ", output.getvalue())
+        self.assertIn("Last modified: not indexed yet", output.getvalue())
+        self.assertFalse(tracker.last_modified_path.exists())
+
+
+def fetch_fixture(dest, backend="gitpython", name="test/repo"):
+    """
+    Copy the single-commit upstream into dest with a config in fetch mode.
+    
+    Returns:
+        Tuple of (UpstreamFixture, upstream config block), the config not yet written
+    """
+    upstream = FIXTURES.upstream(SINGLE_COMMIT, dest)
+    config = {
+        "repository": {"name": name, "url": "", "local_path": str(upstream.clone), "backend": backend},
+        "tracking": {
+            "current_commit": upstream.cloned_commit,
+            "last_checked": None,
+            "last_sync_commit": upstream.cloned_commit,
+        },
+        "fetch": {"branch": "main", "ls_remote_check": True, "single_branch": True, "filter": "blob:none"},
+        "files": {"extracted_count": 1, "categories": {"dto_classes": {"include": ["src/DTO/**"]}}},
+        "sync_status": {"up_to_date": True, "pending_changes": [], "conflicts": []},
+    }
+    return upstream, config
+
+
+class TestUpstreamFetch(unittest.TestCase):
+    """Fetch modes tested against a local bare repository used as the remote."""
+    
+    backend = "gitpython"
+    
+    def setUp(self):
+        """Copy a bare remote with one commit and its clone as the upstream."""
+        self.test_dir = tempfile.mkdtemp()
+        root = Path(self.test_dir)
+        self.upstream, self.config = fetch_fixture(root, self.backend)
+        self.remote = self.upstream.remote
+        self.clone = self.upstream.clone
+        self.first_commit = self.upstream.cloned_commit
+        
+        self.config_path = root / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump(self.config, f)
+    
+    def tearDown(self):
+        """Clean up the repositories."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def _push_commit(self, files, message):
+        """Push a commit with the given files to the bare remote."""
+        return self.upstream.push(files, message)
+    
+    def test_unchanged_remote_skips_fetch(self):
+        """Test that a matching ref advertisement short-circuits the fetch."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch('sys.stdout', new_callable=io.StringIO) as output:
+            has_updates, new_commit, commits = tracker.check_for_updates()
+        
+        self.assertFalse(has_updates)
+        self.assertIn("skipping fetch", output.getvalue())
+        self.assertFalse((self.clone / ".git" / "FETCH_HEAD").exists())
+    
+    def test_untracked_change_is_not_an_update(self):
+        """Test that upstream commits outside the tracked paths report no updates."""
+        new_commit = self._push_commit({"database/seed.sql": "-- seed\n"}, "Add seed data")
+        
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT_PATH), "--config", str(self.config_path),
+             "--check", "--format", "json", "--no-cache"],
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        
+        document = json.loads(result.stdout)
+        self.assertFalse(document["report"]["has_updates"])
+        self.assertEqual(document["report"]["to_commit"], new_commit)
+        self.assertEqual(document["commits"], [])
+    
+    def test_listing_limits_do_not_hide_updates(self):
+        """Test that --since only narrows the listed commits, not the update check."""
+        new_commit = self._push_commit({"src/DTO/User.php": "<?php // v2\n"}, "Update User")
+        
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT_PATH), "--config", str(self.config_path),
+             "--check", "--since", "2099-01-01", "--format", "json", "--no-cache"],
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        
+        document = json.loads(result.stdout)
+        self.assertTrue(document["report"]["has_updates"])
+        self.assertEqual(document["report"]["to_commit"], new_commit)
+        self.assertEqual(document["commits"], [])
+        self.assertEqual([f["path"] for f in document["files"]], ["src/DTO/User.php"])
+    
+    def test_blobless_fetch_pulls_blobs_on_demand(self):
+        """Test a single-branch blobless fetch followed by a diff of tracked paths."""
+        new_commit = self._push_commit(
+            {"src/DTO/User.php": "<?php // v2\n", "database/big.sql": "x" * 10000},
+            "Update User",
+        )
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            has_updates, latest, commits = tracker.check_for_updates()
+            commits = list(commits)
+        
+        self.assertTrue(has_updates)
+        self.assertEqual(latest, new_commit)
+        self.assertEqual(commits, [f"{new_commit[:8]} - Update User"])
+        self.assertEqual(run_git(self.clone, "config", "remote.origin.partialclonefilter"), "blob:none")
+        missing = run_git(self.clone, "rev-list", "--objects", "--missing=print", new_commit)
+        self.assertIn("?", missing)
+        
+        snapshot = tracker.get_diff_snapshot(self.first_commit, new_commit)
+        user_change = next(c for c in snapshot if c.path == "src/DTO/User.php")
+        
+        # Sizes and binary status come from batched calls, not one lookup per blob
+        backend = tracker._get_backend()
+        with patch.object(backend, 'blob_size', side_effect=AssertionError("blob_size called")), \
+                patch.object(backend, 'read_blob', side_effect=AssertionError("read_blob called")):
+            self.assertEqual(snapshot.summarized(), [])
+        self.assertEqual(user_change.b_size, len("<?php // v2\n"))
+        self.assertFalse(user_change.binary)
+        
+        self.assertIn(b"+<?php // v2", snapshot.patch(user_change))
+        # The unrelated large blob was never downloaded
+        big_blob = run_git(self.clone, "rev-parse", f"{new_commit}:database/big.sql")
+        self.assertIn(f"?{big_blob}", run_git(self.clone, "rev-list", "--objects", "--missing=print", new_commit))
+
+
+class TestUpstreamFetchNativeBackend(TestUpstreamFetch):
+    """The fetch tests again, through the native cat-file backend."""
+    
+    backend = "native"
+
+
+class TestWatchMode(unittest.TestCase):
+    """A long-running watcher polling a local bare remote."""
+    
+    def setUp(self):
+        """Copy an upstream fixture and enable the journal."""
+        self.test_dir = tempfile.mkdtemp()
+        self.upstream, config = fetch_fixture(Path(self.test_dir), "native")
+        config["journal"] = {"enabled": True}
+        config["watch"] = {"max_backoff": 200}
+        self.config_path = Path(self.test_dir) / "upstream.json"
+        with open(self.config_path, 'w') as f:
+            json.dump(config, f)
+    
+    def tearDown(self):
+        """Clean up the fixture."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_checks_only_when_head_moves(self):
+        """Test that unchanged polls cost one ls-remote and a moved head runs a check."""
+        tracker = UpstreamTracker(str(self.config_path))
+        checked, backends, sleeps = [], [], []
+        
+        def on_change(head):
+            has_updates, new_commit, commits = tracker.check_for_updates()
+            checked.append((head, new_commit, list(commits)))
+            tracker.record_check(new_commit, len(checked[-1][2]))
+            backends.append(tracker._get_backend())
+        
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 1:
+                self.new_commit = self.upstream.push({"src/DTO/User.php": "<?php // v2\n"}, "Update User")
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.watch(on_change, interval=60, max_polls=3, sleep=sleep)
+        
+        self.assertEqual(checked, [(self.new_commit, self.new_commit, [f"{self.new_commit[:8]} - Update User"])])
+        self.assertIs(backends[0], tracker._get_backend())
+        self.assertEqual(tracker.timings.totals["processes"], 1)
+        self.assertEqual(len(sleeps), 2)
+        for seconds in sleeps:
+            self.assertTrue(54 <= seconds <= 66, seconds)
+        
+        history = list(tracker.journal.history())
+        self.assertEqual([(r["type"], r["to_commit"]) for r in history], [("check", self.new_commit)])
+        tracker.close()
+    
+    def test_failed_check_is_retried(self):
+        """Test that a head whose check failed is checked again after a backoff."""
+        tracker = UpstreamTracker(str(self.config_path))
+        new_commit = self.upstream.push({"src/DTO/User.php": "<?php // v2\n"}, "Update User")
+        checked, sleeps = [], []
+        fetch = tracker.fetch_upstream
+        
+        def flaky_fetch():
+            if not checked:
+                raise RuntimeError("offline")
+            return fetch()
+        
+        def on_change(head):
+            has_updates, found, commits = tracker.check_for_updates()
+            checked.append(found)
+            list(commits)
+        
+        with patch.object(tracker, "fetch_upstream", side_effect=flaky_fetch), \
+                patch('sys.stdout', new_callable=io.StringIO), patch('sys.stderr', new_callable=io.StringIO) as errors:
+            tracker.watch(on_change, interval=60, max_polls=3, sleep=sleeps.append)
+        
+        self.assertEqual(checked, [None, new_commit])
+        self.assertIn("Error watching upstream: offline", errors.getvalue())
+        for seconds, base in zip(sleeps, [120, 60]):
+            self.assertTrue(base * 0.9 <= seconds <= base * 1.1, (seconds, base))
+        tracker.close()
+    
+    def test_failures_back_off(self):
+        """Test exponential, capped backoff after failed polls and reset after success."""
+        tracker = UpstreamTracker(str(self.config_path))
+        sleeps = []
+        
+        with patch.object(tracker, "get_remote_head", side_effect=[RuntimeError("offline")] * 3 + [None, None]), \
+                patch('sys.stderr', new_callable=io.StringIO) as errors:
+            tracker.watch(Mock(), interval=60, max_polls=5, sleep=sleeps.append)
+        
+        expected = [120, 200, 200, 60]
+        for seconds, base in zip(sleeps, expected):
+            self.assertTrue(base * 0.9 <= seconds <= base * 1.1, (seconds, base))
+        self.assertEqual(len(sleeps), 4)
+        self.assertEqual(errors.getvalue().count("Error watching upstream: offline"), 3)
+        tracker.close()
+
+
+class TestGitBackends(unittest.TestCase):
+    """Every git backend must return the same results for the same repository."""
+    
+    def setUp(self):
+        """Copy a repository with an add, modify, delete and rename."""
+        self.test_dir = tempfile.mkdtemp()
+        upstream = FIXTURES.upstream(BACKEND_HISTORY, Path(self.test_dir))
+        self.repo = upstream.clone
+        self.first, self.second = upstream.commits
+        
+        self.backends = {}
+        for name, backend_class in GIT_BACKENDS.items():
+            if name == "gitpython":
+                import git
+                self.backends[name] = backend_class(git.Repo(self.repo))
+            else:
+                self.backends[name] = backend_class(self.repo)
+    
+    def tearDown(self):
+        """Stop backend processes and remove the repository."""
+        import shutil
+        for backend in self.backends.values():
+            backend.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_resolve_and_commit_time(self):
+        """Test ref resolution and commit metadata."""
+        timestamp = int(run_git(self.repo, "log", "-1", "--format=%ct", self.first))
+        
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name):
+                self.assertEqual(backend.resolve("HEAD~1"), self.first)
+                self.assertEqual(backend.head(), self.second)
+                self.assertEqual(backend.commit_time(self.first), timestamp)
+                with self.assertRaises(ValueError):
+                    backend.resolve("no-such-ref")
+    
+    def test_diff_tree(self):
+        """Test the file-level change listing."""
+        expected = sorted([
+            ('A', 'src/DTO/New.php', 'src/DTO/New.php'),
+            ('R', 'src/DTO/Old.php', 'src/DTO/Renamed.php'),
+            ('M', 'src/DTO/User.php', 'src/DTO/User.php'),
+            ('D', 'src/Enums/Gone.php', 'src/Enums/Gone.php'),
+        ])
+        
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name):
+                changes = backend.diff_tree(self.first, self.second, [])
+                self.assertEqual(sorted((c.change_type, c.a_path, c.b_path) for c in changes), expected)
+                added = next(c for c in changes if c.change_type == 'A')
+                self.assertIsNone(added.a_blob)
+                self.assertEqual(added.b_blob, run_git(self.repo, "rev-parse", f"{self.second}:src/DTO/New.php"))
+                
+                filtered = backend.diff_tree(self.first, self.second, [":(glob)src/Enums/**"])
+                self.assertEqual([c.path for c in filtered], ['src/Enums/Gone.php'])
+    
+    def test_read_blob_run_and_stream(self):
+        """Test blob reads, one-shot commands and streamed output."""
+        blob = run_git(self.repo, "rev-parse", f"{self.second}:src/DTO/User.php")
+        
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name):
+                self.assertEqual(backend.read_blob(blob), b"<?php // user v2\n")
+                self.assertEqual(backend.run("rev-parse", "HEAD"), self.second)
+                
+                proc = backend.stream("log", "--format=%s", f"{self.first}..{self.second}")
+                output = proc.stdout.read()
+                proc.wait()
+                self.assertEqual(output, b"Second\n")
+    
+    def test_patches_ignore_user_diff_config(self):
+        """Test that patch headers are parsed under configs changing their prefixes."""
+        config = Path(self.test_dir) / "gitconfig"
+        config.write_text("[diff]\n\tnoprefix = true\n\tmnemonicPrefix = true\n\trelative = true\n")
+        
+        with patch.dict(os.environ, {"GIT_CONFIG_GLOBAL": str(config)}):
+            for name, backend in self.backends.items():
+                with self.subTest(backend=name):
+                    snapshot = check_upstream.DiffSnapshot(backend, self.first, self.second, PathFilter({}), None)
+                    user = next(c for c in snapshot if c.path == "src/DTO/User.php")
+                    
+                    self.assertIn(b"+<?php // user v2\n", snapshot.patch(user))
+                    self.assertTrue(snapshot.patch(user).startswith(b"diff --git a/src/DTO/User.php b/src/DTO/User.php\n"))
+                    self.assertEqual(snapshot.stats(user), (1, 1))
+
+
+# Paths git writes unquoted (non-ASCII) and C-quoted (quote, tab, backslash) in patch headers
+QUOTED_PATHS = ["src/DTO/Café.php", 'src/DTO/Say "hi".php', "src/DTO/Tab\there.php", "src/DTO/Back\\slash.php"]
+QUOTED_PATHS_HISTORY = RepoSpec("quoted-paths-history", [
+    ("Add files", {path: "<?php // v1\n" for path in QUOTED_PATHS}),
+    ("Change files", {
+        **{path: "<?php // v2\n" for path in QUOTED_PATHS[:3]},
+        QUOTED_PATHS[3]: None,
+        "src/DTO/Back\\moved.php": "<?php // v1\n",
+    }),
+])
+
+
+class TestQuotedPaths(unittest.TestCase):
+    """Patches for paths git quotes in its headers."""
+    
+    def setUp(self):
+        """Copy a history changing and renaming files with unusual names."""
+        self.test_dir = tempfile.mkdtemp()
+        self.upstream = FIXTURES.upstream(QUOTED_PATHS_HISTORY, Path(self.test_dir))
+    
+    def tearDown(self):
+        """Clean up the repositories."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_every_change_gets_its_patch(self):
+        """Test that non-ASCII and C-quoted paths are paired with their patches on both backends."""
+        first, second = self.upstream.commits
+        
+        for name, backend_class in GIT_BACKENDS.items():
+            with self.subTest(backend=name):
+                if name == "gitpython":
+                    import git
+                    backend = backend_class(git.Repo(self.upstream.clone))
+                else:
+                    backend = backend_class(self.upstream.clone)
+                snapshot = check_upstream.DiffSnapshot(backend, first, second, PathFilter({}), None)
+                
+                self.assertEqual(
+                    sorted(change.path for change in snapshot),
+                    sorted(QUOTED_PATHS[:3] + ["src/DTO/Back\\moved.php"]),
+                )
+                self.assertEqual([change.path for change in snapshot if not snapshot.patch(change)], [])
+                for change in snapshot:
+                    if change.change_type == 'R':
+                        self.assertIn(b"rename to ", snapshot.patch(change), change.path)
+                    else:
+                        self.assertIn(b"+<?php // v2\n", snapshot.patch(change), change.path)
+                backend.close()
+
+
+class TestMultipleUpstreams(unittest.TestCase):
+    """Configs listing several upstreams, each with its own tracking."""
+    
+    def setUp(self):
+        """Copy two upstream fixtures and write a config listing both."""
+        self.test_dir = tempfile.mkdtemp()
+        self.upstreams, configs = [], []
+        for i, name in enumerate(("defstudio/telegraph", "other/telegram-lib")):
+            upstream, config = fetch_fixture(Path(self.test_dir) / f"upstream{i}", name=name)
+            self.upstreams.append(upstream)
+            configs.append(config)
+        
+        self.config_path = Path(self.test_dir) / "upstream.json"
+        self.document = {"cache": {"enabled": False}, "upstreams": configs}
+        with open(self.config_path, 'w') as f:
+            json.dump(self.document, f)
+    
+    def tearDown(self):
+        """Clean up all fixtures."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_check_all_upstreams_applies_overrides(self):
+        """Test that command-line overrides reach every upstream's tracker."""
+        seen = []
+        close = UpstreamTracker.close
+        
+        def record_and_close(tracker):
+            seen.append((tracker.config["repository"]["name"], type(tracker._backend).__name__,
+                         tracker.render_workers, tracker.max_blob_bytes))
+            close(tracker)
+        
+        args = Mock(no_cache=True, backend="native", render_workers=3, max_blob_bytes=1000)
+        with patch.object(UpstreamTracker, "close", record_and_close), patch('sys.stdout', new_callable=io.StringIO):
+            results = check_upstream.check_all_upstreams(
+                str(self.config_path), max_workers=2, overrides=check_upstream.tracker_overrides(args)
+            )
+        
+        self.assertEqual([r["error"] for r in results], [None, None])
+        self.assertEqual(sorted(seen), [
+            ("defstudio/telegraph", "NativeGitBackend", 3, 1000),
+            ("other/telegram-lib", "NativeGitBackend", 3, 1000),
+        ])
+    
+    def test_select_upstream_and_save(self):
+        """Test that each tracker sees its own block and saves into the shared document."""
+        with self.assertRaises(ValueError):
+            UpstreamTracker(str(self.config_path))
+        
+        tracker = UpstreamTracker(str(self.config_path), "other/telegram-lib")
+        self.assertEqual(tracker.repo_path, self.upstreams[1].clone)
+        self.assertEqual(tracker.config["cache"], {"enabled": False})
+        self.assertEqual(tracker.manifest_path.name, "upstream-manifest-other-telegram-lib.json")
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.update_tracking("f" * 40)
+        
+        with open(self.config_path, 'r') as f:
+            saved = json.load(f)
+        self.assertEqual(saved["upstreams"][1]["tracking"]["current_commit"], "f" * 40)
+        self.assertEqual(saved["upstreams"][0]["tracking"]["current_commit"], self.upstreams[0].cloned_commit)
+        self.assertNotIn("repository", saved)
+    
+    def test_check_all_upstreams_combined_report(self):
+        """Test a parallel check producing one section per upstream."""
+        new_commit = self.upstreams[1].push({"src/DTO/Chat.php": "<?php // chat\n"}, "Add Chat")
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            results = check_upstream.check_all_upstreams(str(self.config_path), max_workers=2)
+        
+        self.assertEqual([r["name"] for r in results], ["defstudio/telegraph", "other/telegram-lib"])
+        self.assertFalse(results[0]["has_updates"])
+        self.assertTrue(results[1]["has_updates"])
+        self.assertEqual(results[1]["commits"], [f"{new_commit[:8]} - Add Chat"])
+        
+        stream = io.StringIO()
+        check_upstream.write_combined_report(results, stream)
+        report = stream.getvalue()
+        
+        self.assertIn("## defstudio/telegraph\nUp to date", report)
+        self.assertIn("## other/telegram-lib\nUpdates available", report)
+        self.assertIn("### Upstream Diff Report", report)
+        self.assertIn("+<?php // chat", report)
+        self.assertFalse(os.path.exists(results[1]["report_file"]))
+
+
+SCRIPT_PATH = Path(__file__).resolve().parent / "check-upstream.py"
+
+# Cold start (interpreter excluded) allowed for config-only commands
+COLD_START_BUDGET_SECONDS = float(os.environ.get("UPSTREAM_COLD_START_BUDGET", "0.25"))
+
+
+class TestCommandLine(unittest.TestCase):
+    """Config-only commands must not pay for git."""
+    
+    # Wall-clock budgets only hold without other shards competing for the CPU
+    run_serially = True
+    
+    def setUp(self):
+        """Copy the project config into a temporary directory."""
+        import shutil
+        self.test_dir = tempfile.mkdtemp()
+        self.config_path = Path(self.test_dir) / "upstream.json"
+        shutil.copy(SCRIPT_PATH.parent.parent / "upstream.json", self.config_path)
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def _run_without_git(self, *argv):
+        """Run the CLI in a fresh interpreter where GitPython cannot be imported."""
+        code = (
+            "import sys, time, runpy\n"
+            "start = time.perf_counter()\n"
+            "sys.modules['git'] = None\n"
+            f"sys.argv = ['check-upstream.py', *{list(argv)!r}]\n"
+            f"runpy.run_path({str(SCRIPT_PATH)!r}, run_name='__main__')\n"
+            "print('heavy modules:', sorted(m for m in ('git', 'concurrent.futures') if sys.modules.get(m)))\n"
+            "print('elapsed:', time.perf_counter() - start)\n"
+        )
+        return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    
+    def test_config_only_commands_without_gitpython(self):
+        """Test that --status and --update work when GitPython is missing."""
+        result = self._run_without_git("--config", str(self.config_path), "--status")
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn("=== Upstream Tracking Status ===", result.stdout)
+        self.assertIn("heavy modules: []", result.stdout)
+        
+        result = self._run_without_git("--config", str(self.config_path), "--update", "f" * 40)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        # The project config records updates in its sync journal
+        self.assertEqual(UpstreamTracker(str(self.config_path)).config["tracking"]["current_commit"], "f" * 40)
+        self.assertTrue((Path(self.test_dir) / "upstream-journal.ndjson").exists())
+    
+    def test_git_commands_report_missing_gitpython(self):
+        """Test that commands needing git fail with an install hint."""
+        with open(self.config_path, 'r') as f:
+            config = json.load(f)
+        config["repository"]["local_path"] = self.test_dir
+        with open(self.config_path, 'w') as f:
+            json.dump(config, f)
+        
+        result = self._run_without_git("--config", str(self.config_path), "--backend", "gitpython", "--diff", "a", "b")
+        self.assertIn("GitPython is required. Install with: pip install gitpython", result.stdout)
+    
+    def test_status_cold_start_budget(self):
+        """Test that cold start for --status stays within budget."""
+        # Best of a few runs, so a busy machine does not fail the test
+        elapsed = []
+        for _ in range(3):
+            result = self._run_without_git("--config", str(self.config_path), "--status")
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+            elapsed.append(float(result.stdout.rsplit("elapsed:", 1)[1]))
+        
+        self.assertLess(
+            min(elapsed), COLD_START_BUDGET_SECONDS,
+            f"--status cold start took {min(elapsed):.3f}s, budget is {COLD_START_BUDGET_SECONDS}s",
+        )
+    
+    def test_command_registry(self):
+        """Test that each command flag runs its handler."""
+        cu = check_upstream
+        handlers = {
+            ("--status",): cu._cmd_status,
+            ("--check",): cu._cmd_check,
+            ("--diff", "a", "b"): cu._cmd_diff,
+            ("--diff-matrix", "a", "b"): cu._cmd_diff_matrix,
+            ("--update", "f" * 40): cu._cmd_update,
+            ("--clear-cache",): cu._cmd_clear_cache,
+            ("--build-manifest",): cu._cmd_build_manifest,
+            ("--manifest-check",): cu._cmd_manifest_check,
+            ("--drift",): cu._cmd_drift,
+            ("--history",): cu._cmd_history,
+            ("--query",): cu._cmd_query,
+            ("--reindex",): cu._cmd_reindex,
+            ("--watch",): cu._cmd_watch,
+        }
+        self.assertEqual(set(cu.COMMANDS.values()), set(handlers.values()))
+        
+        for flag, handler in handlers.items():
+            with self.subTest(flag=flag[0]):
+                # Swap every handler for a mock and see which one the flag reaches
+                mocks = {name: MagicMock(name=name) for name in cu.COMMANDS}
+                with patch.dict(cu.COMMANDS, mocks), \
+                        patch.object(cu, "_create_tracker"), patch.object(cu, "_report_timings"), \
+                        patch.object(sys, "argv", ["check-upstream.py", "--config", str(self.config_path), *flag]):
+                    cu.main()
+                called = [name for name, mock in mocks.items() if mock.called]
+                self.assertEqual(len(called), 1)
+                self.assertIs(cu.COMMANDS[called[0]], handler)
+        
+        self.assertEqual(cu.ALL_UPSTREAM_COMMANDS, {
+            "status": cu._cmd_status_all,
+            "check": cu._cmd_check_all,
+            "clear_cache": cu._cmd_clear_cache_all,
+        })
+    
+    def test_config_only_commands_never_import_git(self):
+        """Test that the config-only commands run without importing git."""
+        for argv in (["--status"], ["--update", "f" * 40], ["--history"], ["--history", "2"], ["--clear-cache"]):
+            with self.subTest(argv=argv):
+                result = self._run_without_git("--config", str(self.config_path), *argv)
+                self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+                self.assertIn("heavy modules: []", result.stdout)
+
+
+class TestUpstreamTrackerIntegration(unittest.TestCase):
+    """Integration tests that require actual git operations."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.config_path = Path(self.test_dir) / "test_upstream.json"
+        
+        # Create a minimal config for integration tests
+        self.config = {
+            "repository": {
+                "name": "test/repo",
+                "url": "https://github.com/test/repo",
+                "local_path": str(Path(self.test_dir) / "test_repo")
+            },
+            "tracking": {
+                "current_commit": "abc123456789",
+                "last_checked": None,
+                "last_sync_commit": "abc123456789",
+                "created": "2025-11-07"
+            },
+            "files": {"extracted_count": 10},
+            "sync_status": {"up_to_date": True, "pending_changes": [], "conflicts": []}
+        }
+        
+        with open(self.config_path, 'w') as f:
+            json.dump(self.config, f, indent=2)
+    
+    def tearDown(self):
+        """Clean up test files."""
+        import shutil
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_error_handling_missing_repo(self):
+        """Test error handling when repository doesn't exist."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        # Try to check for updates with non-existent repo
+        has_updates, new_commit, commits = tracker.check_for_updates()
+        
+        # Should handle the error gracefully
+        self.assertFalse(has_updates)
+        self.assertIsNone(new_commit)
+        self.assertEqual(commits, [])
+    
+    def test_json_operations(self):
+        """Test JSON file reading and writing operations."""
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        # Modify and save config
+        original_commit = tracker.config["tracking"]["current_commit"]
+        new_commit = "def987654321"
+        
+        tracker.config["tracking"]["current_commit"] = new_commit
+        tracker._save_config()
+        
+        # Create new tracker instance to test loading
+        tracker2 = UpstreamTracker(str(self.config_path))
+        
+        self.assertEqual(tracker2.config["tracking"]["current_commit"], new_commit)
+        self.assertNotEqual(tracker2.config["tracking"]["current_commit"], original_commit)
+    
+    def test_fetch_diff_and_report(self):
+        """Test a full check, diff, report and update against a real upstream."""
+        upstream = FIXTURES.upstream(UPSTREAM_HISTORY, Path(self.test_dir) / "fixture")
+        self.config["repository"]["local_path"] = str(upstream.clone)
+        self.config["repository"]["backend"] = "native"
+        self.config["tracking"]["current_commit"] = upstream.cloned_commit
+        self.config["fetch"] = {"branch": "main", "filter": "blob:none"}
+        self.config["files"]["categories"] = {
+            "dto_classes": {"include": ["src/DTO/**/*.php"]},
+            "enums": {"include": ["src/Enums/**/*.php"]},
+        }
+        with open(self.config_path, 'w') as f:
+            json.dump(self.config, f)
+        tracker = UpstreamTracker(str(self.config_path))
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            has_updates, new_commit, commits = tracker.check_for_updates()
+            commits = list(commits)
+        
+        self.assertTrue(has_updates)
+        self.assertEqual(new_commit, upstream.tags["v1.1.0"])
+        self.assertEqual(commits, [
+            f"{sha[:8]} - {message}" for sha, message in zip(
+                reversed(upstream.commits[1:]), ["Drop ChatActions", "Add Chat DTO", "Add username to User"]
+            )
+        ])
+        
+        changes = tracker.get_file_changes(upstream.cloned_commit, new_commit)
+        self.assertEqual(changes["modified"], ["src/DTO/User.php"])
+        self.assertEqual(changes["added"], ["src/DTO/Chat.php"])
+        self.assertEqual(changes["deleted"], ["src/Enums/ChatActions.php"])
+        
+        report_path = Path(self.test_dir) / "report.md"
+        with patch('sys.stdout', new_callable=io.StringIO):
+            report = tracker.generate_diff_report(upstream.cloned_commit, new_commit, str(report_path))
+        self.assertEqual(report_path.read_text(), report)
+        self.assertIn("+    public string $username;", report)
+        self.assertIn("+class Chat", report)
+        self.assertNotIn("README.md", report)
+        
+        with patch('sys.stdout', new_callable=io.StringIO):
+            tracker.update_tracking(new_commit)
+            self.assertFalse(UpstreamTracker(str(self.config_path)).check_for_updates()[0])
+        tracker.close()
 
 
 if __name__ == '__main__':